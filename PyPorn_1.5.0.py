@@ -2,166 +2,2168 @@ import os
 import subprocess
 import sys
 import json
-from pydub import AudioSegment
-from pydub.silence import split_on_silence
+import time
+import zlib
+import sqlite3
+import hashlib
+import io
+import argparse
+import contextlib
+import threading
+import queue
+import collections
+import uuid
+import struct
+import re
+import concurrent.futures
+import urllib.parse
+import importlib.util
+import shutil
+import signal
 
 # --- GLOBAL DEBUG SETTING ---
-DEBUG_MODE = True  # Set to False to disable verbose JSON output
+DEBUG_MODE = False  # Set to True to save the raw yt-dlp info of every lookup to INFO_DUMP_DIR
 # --- END GLOBAL DEBUG SETTING ---
 
+# --- INSTRUMENTATION SETTINGS ---
+TRACE_FILE = 'trace.jsonl'  # Timed spans of every phase, in the output directory; None disables tracing
+TRACE_KEEP_RUNS = 20  # Runs kept in each trace file; older runs are dropped when a run starts writing (None keeps all)
+TRACE_SUMMARY = False  # Print a table of span timings at exit (or pass --trace-summary)
+INFO_DUMP_DIR = 'info_dumps'  # Raw info files written when DEBUG_MODE is on, in the output directory
+# --- END INSTRUMENTATION SETTINGS ---
+
+# --- YT-DLP BACKEND SETTING ---
+# 'inprocess' drives the yt_dlp Python module and keeps it warm between calls,
+# 'subprocess' runs the yt-dlp binary for every operation,
+# 'auto' uses the Python module when it can be imported and the binary otherwise.
+# Downloads and raced lookups always run the binary when it is installed, so they can be killed.
+YT_DLP_BACKEND = 'auto'
+# yt_dlp releases the in-process backend was tested with (it relies on some of their internals);
+# with any other release the binary is used.
+YT_DLP_INPROCESS_VERSIONS = ('2023.09.24', '2026.08.19')
+# --- END YT-DLP BACKEND SETTING ---
+
+# --- CAPABILITY CACHE SETTINGS ---
+CAPABILITY_CACHE_FILE = 'capabilities.json'  # Tool paths and versions, in the output directory
+STARTUP_BENCHMARK_LOG = 'startup_benchmark.jsonl'  # One line per --benchmark-startup run
+# --- END CAPABILITY CACHE SETTINGS ---
+
+# --- METADATA CACHE SETTINGS ---
+METADATA_CACHE_FILE = 'metadata_cache.sqlite3'  # Created inside the output directory
+METADATA_CACHE_DEFAULT_TTL = 2 * 3600  # Seconds a cached media info entry stays valid
+METADATA_CACHE_TTLS = {
+    # Signed stream URLs inside the info expire, so keep these shorter than the host's expiry.
+    'youtube.com': 5 * 3600,
+    'fetlife.com': 30 * 60,
+}
+METADATA_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Least recently used entries are evicted past this size
+TRACKING_QUERY_PARAMS = {'si', 'feature', 'fbclid', 'gclid', 'pp'}
+# --- END METADATA CACHE SETTINGS ---
+
+# --- DOWNLOAD ARCHIVE SETTINGS ---
+DOWNLOAD_ARCHIVE_FILE = 'download_archive.sqlite3'  # Maps downloaded video IDs to files, in the output directory
+# Written by yt-dlp for every file once it has been post-processed and moved to its final path
+OUTPUT_MANIFEST_TEMPLATE = 'after_move:%(extractor_key)s\t%(id)s\t%(filepath)s'
+# --- END DOWNLOAD ARCHIVE SETTINGS ---
+
+# --- SESSION POOL SETTINGS ---
+SESSION_DIR = 'sessions'  # Cookie jars of logged-in sessions, one per site and account, in the output directory
+# Cookies that mark a live login on a site. For other sites, the cookies a login adds to those the site
+# sets anonymously are taken as the login cookies (see AuthSession.log_in).
+SESSION_COOKIES = {}  # e.g. {'example.com': ('sessionid',)}
+SESSION_LOGIN_OPTIONS = ['--flat-playlist', '--playlist-items', '1', '--socket-timeout', '10']  # Short request used to log in
+AUTH_FAILURE_MARKERS = ('HTTP Error 401', 'login required', 'Login required', 'registered users',
+                        'for the authentication', 'Sign in to confirm')
+# --- END SESSION POOL SETTINGS ---
+
+# --- PLAYLIST SCHEDULER SETTINGS ---
+PLAYLIST_WORKERS = 3  # Maximum number of playlist items downloading at the same time
+DEFAULT_HOST_CONCURRENCY = 2  # Maximum concurrent downloads per host...
+HOST_CONCURRENCY = {'youtube.com': 2}  # ...unless configured here
+DEFAULT_START_DELAY = 0.0  # Initial seconds between download starts on one host...
+HOST_START_DELAYS = {'youtube.com': 5.0}  # ...unless configured here
+THROTTLE_MIN_DELAY = 5.0  # Delay used after the first 403/429 from a host
+MAX_START_DELAY = 120.0
+THROTTLE_START_RATE = 1024 * 1024  # Rate limit (bytes/s) applied after the first 403/429
+MIN_RATE_LIMIT = 128 * 1024
+MAX_RATE_LIMIT = 16 * 1024 * 1024  # Above this the rate limit is dropped again
+PLAYLIST_JOB_ATTEMPTS = 3  # Tries per item when the host keeps throttling
+PLAYLIST_PREVIEW_ITEMS = 50  # Playlist items listed before asking for a selection; the rest keeps loading
+PLAYLIST_ENTRY_FIELDS = ('id', 'title', 'duration', 'url', 'webpage_url', 'ie_key', 'extractor_key', 'playlist_index', 'n_entries')
+THROTTLE_MARKERS = ('HTTP Error 429', 'HTTP Error 403', 'Too Many Requests', 'rate-limit', 'rate limit')
+# --- END PLAYLIST SCHEDULER SETTINGS ---
+
+# --- PROGRESS MONITOR SETTINGS ---
+PROGRESS_MARKER = '[pyanide-progress] '
+PROGRESS_TEMPLATE = 'download:' + PROGRESS_MARKER + '%(progress)j'  # Machine-readable progress lines from yt-dlp
+PROGRESS_SPEED_WINDOW = 10.0  # Seconds the moving-average speed and the ETA are computed over
+PROGRESS_PRINT_INTERVAL = 3.0  # Seconds between progress lines on the console
+STALL_MIN_SPEED = 16 * 1024  # Bytes/s; keep this below MIN_RATE_LIMIT so rate-limited downloads are not stalls
+STALL_WINDOW = 90.0  # Seconds a download must stay below STALL_MIN_SPEED before it is restarted
+STALL_MAX_RESTARTS = 3  # Restarts per download; yt-dlp resumes from the partial file
+STALL_PLAYER_CLIENTS = ('android', 'web', 'ios', 'web_public')  # YouTube clients cycled through on restarts; () keeps the client
+# --- END PROGRESS MONITOR SETTINGS ---
+
+# --- SEGMENTED DOWNLOAD SETTINGS ---
+CONCURRENT_FRAGMENTS = 4  # HLS/DASH fragments of one download fetched at the same time
+# Direct files are split into HTTP Range parts fetched at the same time by aria2c when it is installed
+# (pkg install aria2); servers without Range support get one connection. False always uses one connection.
+SEGMENTED_DOWNLOADS = True
+SEGMENT_CONNECTIONS = 4  # Range parts of one file downloading at the same time
+MIN_SEGMENT_SIZE = '4M'  # Files are not split into parts smaller than this
+# 'falloc' reserves the whole file on disk before the parts arrive; use 'prealloc' on filesystems without
+# fallocate, 'none' to grow the file as parts complete.
+SEGMENT_FILE_ALLOCATION = 'falloc'
+# aria2c reports no live progress, so it enforces the stall limits itself (STALL_MIN_SPEED per connection,
+# STALL_WINDOW without data). These exit codes (timeout, too slow, network problem) are restarted like stalls;
+# other aria2c failures are downloaded again by yt-dlp over one connection.
+ARIA2C_STALL_EXIT_CODES = (2, 5, 6)
+# --- END SEGMENTED DOWNLOAD SETTINGS ---
+
+# --- BATCH MODE SETTINGS ---
+BATCH_QUEUE_FILE = 'batch_queue.sqlite3'  # Durable job queue for --batch, in the output directory
+BATCH_SUMMARY_FILE = 'batch_summary.json'  # Throughput and failures of the last batch run
+BATCH_JOB_ATTEMPTS = 2  # Tries per job before it is marked as failed
+BATCH_DEFAULT_FORMAT = 'bestvideo+bestaudio/best'  # Used for video jobs that do not give a format
+BATCH_HEARTBEAT_INTERVAL = 30.0  # Seconds between a run's updates of the lease on the jobs it is working on
+BATCH_LEASE_SECONDS = 300.0  # A job whose run sent no heartbeat for this long is taken over by another run
+BATCH_SECRET_FIELDS = ('username', 'password')  # Job keys kept in memory only, never written to the queue
+# --- END BATCH MODE SETTINGS ---
+
+# --- FORMAT SELECTION SETTINGS ---
+# Video codecs by compression efficiency, best first; at the same height the first available one is
+# offered. Remove 'av01' on devices that cannot decode AV1 smoothly. Unlisted codecs rank last.
+PREFERRED_VIDEO_CODECS = ('av01', 'vp09', 'vp9', 'hev1', 'hvc1', 'avc1')
+PREFERRED_AUDIO_CODECS = ('opus', 'mp4a')
+MAX_DOWNLOAD_BYTES = None  # Qualities estimated larger than this are not offered (or pass --max-size MB); None for no limit
+MAX_BITRATE_KBPS = None  # Qualities with a higher total bitrate are not offered (or pass --max-bitrate); None for no limit
+# --- END FORMAT SELECTION SETTINGS ---
+
+# --- AUDIO SPLITTING SETTINGS ---
+SILENCE_BLOCK_FRAMES = 1 << 18  # Audio frames decoded per block while detecting silence
+CHUNK_EXPORT_WORKERS = None  # Chunks encoded in parallel when splitting; None uses every CPU core
+# Keep each file's loudness in a cache, so silence settings can be tried again without decoding
+LOUDNESS_INDEX = True
+LOUDNESS_INDEX_DIR = 'loudness_index'  # In the output directory
+LOUDNESS_INDEX_BIN_MS = 10  # Resolution of the index and of silence splits answered from it (about 1.4 MB per hour)
+LOUDNESS_INDEX_MAX_BYTES = 64 * 1024 * 1024  # Least recently used indexes are evicted past this size
+# --- END AUDIO SPLITTING SETTINGS ---
+
+# --- AUDIO PIPELINE SETTINGS ---
+PIPELINE_SOURCE_FORMAT = 'bestaudio/best'  # Downloaded as-is by the audio pipeline, then transcoded to MP3 by ffmpeg
+PIPELINE_DOWNLOAD_WORKERS = 2  # Most playlist items downloading at the same time; each host is also paced by its HostRateController
+PIPELINE_TRANSCODE_WORKERS = 2  # MP3 encodes running at the same time
+PIPELINE_SPLIT_WORKERS = 1  # Files split at the same time; every split already exports its chunks on all cores
+PIPELINE_QUEUE_SIZE = 2  # Items waiting between two stages; a full queue pauses the stage before it
+# --- END AUDIO PIPELINE SETTINGS ---
+
+# --- EXTRACTOR RACING SETTINGS ---
+RACE_EXTRACTORS = True  # Try several YouTube player clients at once instead of one after another
+EXTRACTOR_RACE_FANOUT = 3  # Maximum number of yt-dlp processes racing at the same time
+EXTRACTOR_STATS_FILE = 'extractor_stats.json'  # Per-host success and latency, in the output directory
+EXTRACTOR_ATTEMPT_LOG = 'extractor_attempts.jsonl'  # One line per attempt and per lookup
+# --- END EXTRACTOR RACING SETTINGS ---
+
+_trace_lock = threading.Lock()
+_trace_write_lock = threading.Lock()
+_trace_pending = []
+_trace_files = {}
+_trace_totals = {}
+_trace_run = uuid.uuid4().hex[:12]
+_trace_local = threading.local()
+
+@contextlib.contextmanager
+def trace_to(output_dir):
+    """
+    Sends the spans this thread records inside the block to the trace in output_dir instead
+    of the one in get_output_dir(). Blocks nest; the innermost directory wins.
+    """
+    previous = getattr(_trace_local, 'output_dir', None)
+    _trace_local.output_dir = output_dir or previous
+    try:
+        yield
+    finally:
+        _trace_local.output_dir = previous
+
+def open_trace_file(path):
+    """
+    Opens a trace for appending, first dropping all but the last TRACE_KEEP_RUNS - 1 runs in it
+    so that the trace holds at most TRACE_KEEP_RUNS runs once this one is added.
+    """
+    if TRACE_KEEP_RUNS and os.path.isfile(path):
+        runs = {}
+        with open(path, encoding='utf-8', errors='replace') as f:
+            lines = f.readlines()
+        for line in lines:
+            try:
+                runs.setdefault(json.loads(line).get('run'), None)
+            except (ValueError, AttributeError):
+                pass
+        if len(runs) >= TRACE_KEEP_RUNS:
+            keep = set(list(runs)[len(runs) - TRACE_KEEP_RUNS + 1:])
+            kept = []
+            for line in lines:
+                try:
+                    if json.loads(line).get('run') in keep:
+                        kept.append(line)
+                except (ValueError, AttributeError):
+                    pass
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                f.writelines(kept)
+            os.replace(path + '.tmp', path)
+    return open(path, 'a', encoding='utf-8')
+
+def flush_trace():
+    """
+    Writes the queued trace records to their files. Only one thread writes at a time; the
+    others leave their records in the queue for it, so recording a span never waits on disk.
+    """
+    while _trace_pending:
+        if not _trace_write_lock.acquire(blocking=False):
+            return
+        try:
+            with _trace_lock:
+                records = _trace_pending[:]
+                del _trace_pending[:]
+            for output_dir, line in records:
+                try:
+                    trace_file = _trace_files.get(output_dir)
+                    if trace_file is None:
+                        os.makedirs(output_dir, exist_ok=True)
+                        trace_file = _trace_files[output_dir] = open_trace_file(os.path.join(output_dir, TRACE_FILE))
+                    trace_file.write(line)
+                except OSError:
+                    pass
+            for trace_file in _trace_files.values():
+                try:
+                    trace_file.flush()
+                except OSError:
+                    pass
+        finally:
+            _trace_write_lock.release()
+
+def record_span(name, duration, output_dir=None, **fields):
+    """
+    Records one timed phase: queues it as a JSON line for the TRACE_FILE trace and adds it to
+    the per-phase totals shown by print_trace_summary.
+
+    Args:
+        name (str): Phase name (e.g. 'download', 'chunk_export').
+        duration (float): Seconds the phase took.
+        output_dir (str, optional): Directory of the trace. Defaults to the one of the current
+            trace_to block, or get_output_dir() outside one.
+        **fields: Extra fields; 'bytes' and 'outcome' are used by the summary.
+    """
+    record = {'span': name, 'duration': round(duration, 6), 'outcome': 'ok', 'time': time.time(),
+              'run': _trace_run, 'thread': threading.current_thread().name}
+    record.update((key, value) for key, value in fields.items() if value is not None)
+    line = json.dumps(record, default=str) + '\n' if TRACE_FILE else None
+    with _trace_lock:
+        totals = _trace_totals.setdefault(name, {'count': 0, 'seconds': 0.0, 'max': 0.0, 'bytes': 0, 'failed': 0})
+        totals['count'] += 1
+        totals['seconds'] += duration
+        totals['max'] = max(totals['max'], duration)
+        totals['bytes'] += record.get('bytes') or 0
+        if record['outcome'] in ('error', 'failure', 'failed', 'throttled', 'invalid', 'missing'):
+            totals['failed'] += 1
+        if line is not None:
+            _trace_pending.append((output_dir or getattr(_trace_local, 'output_dir', None) or get_output_dir(), line))
+    flush_trace()
+
+@contextlib.contextmanager
+def span(name, output_dir=None, **fields):
+    """
+    Times the enclosed block and records it with record_span. Yields a dict the block can
+    add fields to, such as 'bytes' or 'outcome'; an exception sets the outcome to 'error'.
+    With output_dir, the span and the spans nested in the block go to the trace there
+    (see trace_to).
+    """
+    record = dict(fields)
+    started = time.perf_counter()
+    with trace_to(output_dir):
+        try:
+            yield record
+        except BaseException as e:
+            record.setdefault('outcome', 'error')
+            record.setdefault('error', str(e) or type(e).__name__)
+            raise
+        finally:
+            record_span(name, time.perf_counter() - started, **record)
+
+def print_trace_summary():
+    """
+    Prints the number of spans, total and maximum time, bytes and failures per phase
+    recorded by this process.
+    """
+    with _trace_lock:
+        totals = {name: dict(entry) for name, entry in _trace_totals.items()}
+    if not totals:
+        print("\nNo timed phases were recorded.")
+        return
+    print(f"\n{'Phase':<22}{'Count':>7}{'Total s':>10}{'Mean s':>9}{'Max s':>9}{'MB':>10}{'Failed':>8}")
+    for name, entry in sorted(totals.items(), key=lambda item: -item[1]['seconds']):
+        print(f"{name:<22}{entry['count']:>7}{entry['seconds']:>10.2f}{entry['seconds'] / entry['count']:>9.3f}"
+              f"{entry['max']:>9.3f}{entry['bytes'] / 1048576:>10.1f}{entry['failed']:>8}")
+
+def dump_raw_info(output_dir, url, extractor_arg, info):
+    """
+    Writes the raw yt-dlp info of a lookup to INFO_DUMP_DIR (used when DEBUG_MODE is on).
+    """
+    dump_dir = os.path.join(output_dir, INFO_DUMP_DIR)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{hashlib.sha256(normalize_url(url).encode('utf-8')).hexdigest()[:10]}.json"
+    try:
+        os.makedirs(dump_dir, exist_ok=True)
+        with open(os.path.join(dump_dir, name), 'w', encoding='utf-8') as f:
+            json.dump({'url': url, 'extractor': extractor_arg, 'info': info}, f, indent=2)
+    except OSError as e:
+        print(f"Warning: Could not write the raw media info: {e}")
+
+_capabilities = None
+
+def probe_binary(name, version_args, cached=None):
+    """
+    Finds a binary on PATH and reads its version, reusing the cached probe result when the
+    binary's path, mtime and size are unchanged so that no process has to be started.
+
+    Returns:
+        dict: path, mtime, size and version (None if the binary is missing or does not run).
+    """
+    path = shutil.which(name)
+    if path is None:
+        return {'path': None, 'version': None}
+    try:
+        stat = os.stat(os.path.realpath(path))
+    except OSError:
+        return {'path': None, 'version': None}
+    probe = {'path': path, 'mtime': stat.st_mtime, 'size': stat.st_size}
+    if cached and all(cached.get(key) == value for key, value in probe.items()):
+        return cached
+    try:
+        result = subprocess.run([path] + version_args, check=True, capture_output=True, text=True,
+                                encoding='utf-8', errors='replace')
+        probe['version'] = (result.stdout.strip().splitlines() or ['unknown'])[0]
+    except (subprocess.CalledProcessError, OSError):
+        probe['version'] = None
+    return probe
+
+def probe_module(name, cached=None):
+    """
+    Finds a Python module without importing it, reusing the cached version while the
+    module's files are unchanged.
+
+    Returns:
+        dict: path, mtime and version (None if the module is not installed).
+    """
+    spec = importlib.util.find_spec(name)
+    if spec is None or not spec.origin:
+        return {'path': None, 'version': None}
+    version_file = os.path.join(os.path.dirname(spec.origin), 'version.py')
+    if not os.path.isfile(version_file):
+        version_file = spec.origin
+    try:
+        probe = {'path': spec.origin, 'mtime': os.stat(version_file).st_mtime}
+    except OSError:
+        return {'path': spec.origin, 'version': 'unknown'}
+    if cached and all(cached.get(key) == value for key, value in probe.items()):
+        return cached
+    probe['version'] = 'unknown'
+    try:
+        with open(version_file, 'r', encoding='utf-8', errors='replace') as f:
+            match = re.search(r"^__version__\s*=\s*['\"]([^'\"]+)", f.read(), re.MULTILINE)
+        if match:
+            probe['version'] = match.group(1)
+    except OSError:
+        pass
+    return probe
+
+def get_capabilities(cache_dir=None, refresh=False):
+    """
+    Returns the external tools and optional modules this script can use, probed once per
+    process. Results are cached in CAPABILITY_CACHE_FILE and a tool is only probed again
+    when its binary changes, so a normal start does not spawn any process.
+
+    Args:
+        cache_dir (str, optional): Directory holding the cache. Defaults to get_output_dir().
+        refresh (bool, optional): Ignore the cache and probe everything. Defaults to False.
+
+    Returns:
+        dict: 'yt-dlp', 'ffmpeg' and 'aria2c' binary probes and 'yt_dlp', 'numpy' and 'pydub' module probes.
+    """
+    global _capabilities
+    if _capabilities is not None and not refresh:
+        return _capabilities
+
+    cache_path = os.path.join(cache_dir or get_output_dir(), CAPABILITY_CACHE_FILE)
+    cached = {}
+    if not refresh:
+        try:
+            with open(cache_path, 'r', encoding='utf-8') as f:
+                cached = json.load(f)
+        except (OSError, ValueError):
+            cached = {}
+
+    capabilities = {}
+    for tool, version_args in (('yt-dlp', ['--version']), ('ffmpeg', ['-version']), ('aria2c', ['--version'])):
+        with span('capability_probe', tool=tool) as trace:
+            capabilities[tool] = probe_binary(tool, version_args, cached.get(tool))
+            trace['outcome'] = 'cached' if capabilities[tool] is cached.get(tool) else (
+                'ok' if capabilities[tool]['version'] else 'missing')
+    for module in ('yt_dlp', 'numpy', 'pydub'):
+        capabilities[module] = probe_module(module, cached.get(module))
+
+    if capabilities != cached:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, 'w', encoding='utf-8') as f:
+                json.dump(capabilities, f, indent=2)
+        except OSError:
+            pass
+    _capabilities = capabilities
+    return capabilities
+
 def check_yt_dlp():
     """
-    Checks if yt-dlp is installed and executable by trying to get its version.
+    Checks if yt-dlp is available through the configured backend.
     Returns True if found, False otherwise.
     """
-    try:
-        subprocess.run(['yt-dlp', '--version'], check=True, capture_output=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+    return get_yt_dlp_backend().available()
 
 def check_ffmpeg():
     """
-    Checks if ffmpeg is installed and executable by trying to get its version.
+    Checks if ffmpeg is installed and executable (see get_capabilities).
     Returns True if found, False otherwise.
     """
-    try:
-        subprocess.run(['ffmpeg', '-version'], check=True, capture_output=True)
-        return True
-    except (subprocess.CalledProcessError, FileNotFoundError):
-        return False
+    return get_capabilities()['ffmpeg']['version'] is not None
 
 def check_pydub():
     """
-    Checks if pydub is installed.
+    Checks if pydub is installed, without importing it.
     Returns True if found, False otherwise.
     """
+    return get_capabilities()['pydub']['version'] is not None
+
+def parse_info_line(line):
+    """
+    Parses one line of `yt-dlp --dump-json` output, returning None for anything that is
+    not a JSON object (e.g. stray log lines).
+    """
+    line = line.strip()
+    if not line.startswith('{'):
+        return None
     try:
-        import pydub
-        return True
-    except ImportError:
+        document = json.loads(line)
+    except json.JSONDecodeError:
+        return None
+    return document if isinstance(document, dict) else None
+
+def playlist_entry_record(document):
+    """
+    Returns the lightweight record of a flat playlist entry: just what is needed to list,
+    select, archive-check and download it.
+    """
+    return {field: document.get(field) for field in PLAYLIST_ENTRY_FIELDS if document.get(field) is not None}
+
+def media_info_from_documents(documents):
+    """
+    Turns the documents printed by `yt-dlp --dump-json` into one info dict. A single document
+    is the media itself; flat playlist entries (documents with a playlist_index) are wrapped
+    in a playlist info dict, in playlist order.
+
+    Returns:
+        dict: The info dict, or None if there were no documents.
+    """
+    entries = {}
+    for document in documents:
+        if document.get('playlist_index') is not None:
+            entries[document['playlist_index']] = playlist_entry_record(document)
+    if not entries:
+        return documents[-1] if documents else None
+    first = next(document for document in documents if document.get('playlist_index') is not None)
+    return {
+        '_type': 'playlist',
+        'id': first.get('playlist_id'),
+        'title': first.get('playlist_title') or first.get('playlist'),
+        'webpage_url': first.get('playlist_webpage_url'),
+        'playlist_count': first.get('playlist_count') or first.get('n_entries'),
+        'entries': [entries[index] for index in sorted(entries)],
+    }
+
+def spawn_process_group(command, **kwargs):
+    """
+    Starts a command in its own session (process group) where the platform has them.
+
+    Returns:
+        tuple: (Popen object, function that kills the command together with every process it
+                started, such as the aria2c of a segmented yt-dlp download)
+    """
+    grouped = hasattr(os, 'killpg')
+    process = subprocess.Popen(command, start_new_session=grouped, **kwargs)
+
+    def kill():
+        if grouped:
+            with contextlib.suppress(OSError):
+                os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+
+    return process, kill
+
+class SubprocessBackend:
+    """
+    Runs the yt-dlp binary for every operation.
+
+    Both backends take the same yt-dlp command line options (without the program name
+    and the URL), so callers build one option list and do not care which backend runs it.
+    """
+    name = 'subprocess'
+
+    def available(self):
+        """
+        Returns True if the yt-dlp binary can be executed (see get_capabilities).
+        """
+        return get_capabilities()['yt-dlp']['version'] is not None
+
+    def fetch_info(self, options, url, on_start=None, on_entry=None):
+        """
+        Fetches the media info for a URL with `yt-dlp --dump-json`, parsing its output line by
+        line as it arrives. With --flat-playlist in the options, a playlist prints one
+        lightweight document per entry; these are collected into a playlist info dict.
+
+        Args:
+            options (list): yt-dlp command line options.
+            url (str): The URL of the media to analyze.
+            on_start (callable, optional): Called with a function that cancels the fetch.
+            on_entry (callable, optional): Called with each playlist entry record (see
+                playlist_entry_record) as soon as yt-dlp prints it.
+
+        Returns:
+            tuple: (info dict or None, error message or None)
+        """
+        command = ['yt-dlp', '--dump-json', '--no-warnings'] + options + [url]
+        try:
+            process, kill = spawn_process_group(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True,
+                encoding='utf-8',
+                errors='replace'
+            )
+        except OSError as e:
+            return None, f"An unexpected error occurred: {e}"
+        if on_start:
+            on_start(kill)
+
+        stderr = []
+        stderr_reader = threading.Thread(target=lambda: stderr.extend(process.stderr), daemon=True)
+        stderr_reader.start()
+        documents = []
+        parse_seconds = 0.0
+        received = 0
+        try:
+            for line in process.stdout:
+                parse_started = time.perf_counter()
+                received += len(line)
+                document = parse_info_line(line)
+                if document is not None:
+                    documents.append(document)
+                    if on_entry and document.get('playlist_index') is not None:
+                        on_entry(playlist_entry_record(document))
+                parse_seconds += time.perf_counter() - parse_started
+            process.wait()
+        except KeyboardInterrupt:
+            # yt-dlp runs in its own process group, so Ctrl+C does not reach it by itself.
+            kill()
+            raise
+        stderr_reader.join()
+
+        if process.returncode != 0:
+            return None, f"Error fetching media info: {''.join(stderr)}"
+        parse_started = time.perf_counter()
+        info = media_info_from_documents(documents)
+        record_span('metadata_parse', parse_seconds + time.perf_counter() - parse_started,
+                    bytes=received, documents=len(documents), outcome='ok' if info is not None else 'invalid')
+        if info is None:
+            return None, "Error parsing media info: Invalid JSON response from yt-dlp."
+        return info, None
+
+    def download(self, options, url, on_error=None, on_progress=None, on_start=None):
+        """
+        Downloads a URL, streaming yt-dlp's progress directly to the console.
+        Returns yt-dlp's exit code. Raises FileNotFoundError if yt-dlp is not installed.
+
+        Args:
+            options (list): yt-dlp command line options.
+            url (str): The URL to download.
+            on_error (callable, optional): Called with every line yt-dlp writes to stderr
+                (the lines are still shown on the console).
+            on_progress (callable, optional): Called with every yt-dlp progress dict. yt-dlp then
+                prints them as PROGRESS_TEMPLATE lines, which are parsed instead of shown.
+            on_start (callable, optional): Called with a function that cancels the download,
+                killing yt-dlp together with any external downloader it started.
+        """
+        if on_error is None and on_progress is None:
+            process, kill = spawn_process_group(['yt-dlp'] + options + [url], stdout=sys.stdout, stderr=sys.stderr)
+            if on_start:
+                on_start(kill)
+            try:
+                process.wait()
+            except KeyboardInterrupt:
+                kill()
+                raise
+            return process.returncode
+
+        if on_progress:
+            options = [option for option in options if option != '--no-progress']
+            options = options + ['--newline', '--progress-template', PROGRESS_TEMPLATE]
+        process, kill = spawn_process_group(['yt-dlp'] + options + [url],
+                                            stdout=subprocess.PIPE if on_progress else sys.stdout,
+                                            stderr=subprocess.PIPE if on_error else sys.stderr,
+                                            text=True, encoding='utf-8', errors='replace')
+        if on_start:
+            on_start(kill)
+
+        def read_errors():
+            for line in process.stderr:
+                sys.stderr.write(line)
+                on_error(line.rstrip('\n'))
+
+        stderr_reader = None
+        if on_error:
+            stderr_reader = threading.Thread(target=read_errors, daemon=True)
+            stderr_reader.start()
+        try:
+            if on_progress:
+                for line in process.stdout:
+                    if line.startswith(PROGRESS_MARKER):
+                        with contextlib.suppress(ValueError):
+                            on_progress(json.loads(line[len(PROGRESS_MARKER):]))
+                    else:
+                        sys.stdout.write(line)
+            process.wait()
+        except KeyboardInterrupt:
+            kill()
+            raise
+        if stderr_reader:
+            stderr_reader.join()
+        return process.returncode
+
+    def close(self):
+        """
+        Nothing to release; every call runs in its own process.
+        """
+
+def inprocess_version_supported(version):
+    """
+    Returns True if a yt_dlp version lies in YT_DLP_INPROCESS_VERSIONS. Only the release
+    date is compared, so nightly builds of a tested release count as tested.
+    """
+    def release(text):
+        return tuple(int(part) for part in text.split('.')[:3])
+
+    try:
+        return release(YT_DLP_INPROCESS_VERSIONS[0]) <= release(version) <= release(YT_DLP_INPROCESS_VERSIONS[1])
+    except (AttributeError, ValueError):
+        return False
+
+class InProcessBackend:
+    """
+    Drives the yt_dlp Python API in this process.
+
+    YoutubeDL instances are kept warm and reused for identical options. All instances that
+    share an auth context (same cookie file or session, or same credentials) also share one
+    cookie jar and one request director, so cookies and keep-alive connections carry over
+    from the metadata fetch to the download. Runs of a login session are keyed on the
+    session's jar rather than on their private copy of it (see AuthSession.lease), so they
+    stay warm from run to run; a run that logs in again drops the session's instances.
+    Anything the Python API cannot handle falls back to the binary, and so does everything
+    that may have to be cancelled (downloads and raced lookups), since a call into the
+    Python API can only stop at its next progress update while a process can be killed.
+    """
+    name = 'inprocess'
+
+    def __init__(self):
+        self._instances = {}
+        self._auth_contexts = {}
+        self._lent = collections.Counter()  # Instances in use per cookie file
+        self._lock = threading.Lock()
+        self._fallback = SubprocessBackend()
+
+    def available(self):
+        """
+        Returns True if the yt_dlp module is installed in a tested version (see
+        YT_DLP_INPROCESS_VERSIONS), without importing it yet.
+        """
+        return inprocess_version_supported(get_capabilities()['yt_dlp']['version'])
+
+    @contextlib.contextmanager
+    def _instance(self, options, **overrides):
+        """
+        Lends out an idle YoutubeDL instance for the given options, creating one if all
+        instances for these options are busy. Raises SystemExit if yt-dlp rejects the options.
+        """
+        import yt_dlp
+
+        cookie_file = next((options[i + 1] for i, option in enumerate(options[:-1]) if option == '--cookies'), None)
+        jar = AuthSession.session_jar(cookie_file) if cookie_file else None
+        key = (jar, tuple(jar if option == cookie_file else option for option in options), tuple(sorted(overrides.items())))
+        with self._lock:
+            if jar != cookie_file and '--password' in options:
+                # A login starts the session over; its warm instances hold the old login.
+                self._forget(jar)
+            # Forget dropped sessions and removed cookie files (such as login probes) nobody uses.
+            for stale in {k[0] for k in self._instances if k[0] and not self._lent[k[0]] and not os.path.exists(k[0])}:
+                self._forget(stale)
+            idle = self._instances.setdefault(key, [])
+            ydl = idle.pop() if idle else None
+            self._lent[jar] += 1
+        if ydl is None:
+            try:
+                ydl_opts = dict(yt_dlp.parse_options(options).ydl_opts, **overrides)
+                ydl = yt_dlp.YoutubeDL(ydl_opts)
+            except BaseException:
+                with self._lock:
+                    self._lent[jar] -= 1
+                raise
+            auth_key = jar or auth_fingerprint(ydl_opts.get('username'), ydl_opts.get('password'))
+            with self._lock:
+                shared = self._auth_contexts.setdefault(auth_key, ydl)
+            if shared is not ydl:
+                # Share the session state of the first instance of this auth context.
+                ydl.__dict__['cookiejar'] = shared.cookiejar
+                ydl.__dict__['_request_director'] = shared._request_director
+        ydl.params['cookiefile'] = cookie_file
+        try:
+            yield ydl
+        finally:
+            if cookie_file:
+                # Like the binary does on exit, so the run's cookie file is up to date when the run ends.
+                with contextlib.suppress(Exception):
+                    ydl.cookiejar.save(cookie_file)
+            # An idle instance must not write a run's jar after the run has ended.
+            ydl.params['cookiefile'] = None
+            with self._lock:
+                self._lent[jar] -= 1
+                self._instances.setdefault(key, []).append(ydl)
+
+    def _forget(self, jar):
+        """
+        Closes and drops the idle instances and the auth context of the session whose jar is
+        jar. Called with the lock held.
+        """
+        for stale in [key for key in self._instances if key[0] == jar]:
+            del self._instances[stale]
+        shared = self._auth_contexts.pop(jar, None)
+        if shared is not None:
+            with contextlib.suppress(Exception):
+                shared.close()
+
+    def fetch_info(self, options, url, on_start=None, on_entry=None):
+        """
+        Fetches the media info for a URL without downloading it.
+        Same arguments and return value as SubprocessBackend.fetch_info. A fetch the caller
+        wants to be able to cancel (on_start given) runs the binary if it is installed;
+        otherwise on_start is never called and a losing race result is discarded.
+        Flat playlist entries are captured from yt-dlp's JSON printing as they are extracted,
+        exactly like the binary prints them.
+        """
+        import yt_dlp
+
+        if on_start is not None and self._fallback.available():
+            return self._fallback.fetch_info(options, url, on_start, on_entry)
+
+        try:
+            with self._instance(options, quiet=True, no_warnings=True, noprogress=True, forcejson=True) as ydl:
+                entries = []
+
+                def capture(message, *args, **kwargs):
+                    document = parse_info_line(message)
+                    if document is not None and document.get('playlist_index') is not None:
+                        entries.append(document)
+                        if on_entry:
+                            on_entry(playlist_entry_record(document))
+
+                ydl.to_stdout = capture
+                try:
+                    info = ydl.extract_info(url, download=False)
+                finally:
+                    ydl.__dict__.pop('to_stdout', None)
+                with span('metadata_parse', documents=len(entries) or 1):
+                    info = ydl.sanitize_info(info)
+                if info is None:
+                    return None, "Error fetching media info: yt-dlp returned no media info."
+                if entries and info.get('_type') == 'playlist':
+                    info['entries'] = media_info_from_documents(entries)['entries']
+                return info, None
+        except SystemExit:
+            return self._fallback.fetch_info(options, url, on_start, on_entry)
+        except yt_dlp.utils.YoutubeDLError as e:
+            return None, f"Error fetching media info: {e}"
+        except Exception as e:
+            return None, f"An unexpected error occurred: {e}"
+
+    def download(self, options, url, on_error=None, on_progress=None, on_start=None):
+        """
+        Downloads a URL and returns a yt-dlp style exit code. Same arguments as
+        SubprocessBackend.download. Downloads run the binary if it is installed, so a stalled
+        download is killed at once (see spawn_process_group). Otherwise a warm YoutubeDL instance
+        is used: progress dicts come from a progress hook (yt-dlp's own progress bar is turned
+        off), and cancelling takes effect at the next progress update.
+        """
+        import yt_dlp
+
+        if self._fallback.available():
+            return self._fallback.download(options, url, on_error, on_progress, on_start)
+
+        cancelled = threading.Event()
+
+        def hook(progress):
+            if cancelled.is_set():
+                raise yt_dlp.utils.DownloadCancelled("The download was cancelled (stalled)")
+            on_progress(progress)
+
+        try:
+            with self._instance(options, **({'noprogress': True} if on_progress else {})) as ydl:
+                if on_error:
+                    write_stderr = ydl.to_stderr
+
+                    def tee(message, only_once=False):
+                        on_error(message)
+                        write_stderr(message, only_once)
+
+                    ydl.to_stderr = tee
+                if on_progress:
+                    ydl.add_progress_hook(hook)
+                if on_start:
+                    on_start(cancelled.set)
+                ydl._download_retcode = 0  # Left at 1 by an earlier failed download of this instance
+                try:
+                    return ydl.download([url])
+                finally:
+                    ydl.__dict__.pop('to_stderr', None)
+                    if on_progress:
+                        ydl._progress_hooks.remove(hook)
+        except SystemExit:
+            return self._fallback.download(options, url, on_error, on_progress, on_start)
+        except yt_dlp.utils.YoutubeDLError as e:
+            print(f"ERROR: {e}")
+            if on_error:
+                on_error(str(e))
+            return 1
+
+    def close(self):
+        """
+        Closes every warm instance, saving cookies and releasing connections.
+        """
+        with self._lock:
+            for ydl in self._auth_contexts.values():
+                ydl.close()
+            self._instances.clear()
+            self._auth_contexts.clear()
+
+_yt_dlp_backends = {}
+
+def get_yt_dlp_backend(name=None):
+    """
+    Returns the shared backend instance for name ('inprocess', 'subprocess' or 'auto').
+    Defaults to YT_DLP_BACKEND. 'auto' picks the in-process backend when yt_dlp is importable.
+    """
+    name = name or YT_DLP_BACKEND
+    if name == 'auto':
+        name = 'inprocess' if InProcessBackend().available() else 'subprocess'
+    elif name == 'inprocess' and not InProcessBackend().available():
+        version = get_capabilities()['yt_dlp']['version']
+        print(f"Warning: The in-process backend needs the yt_dlp module in a version from {YT_DLP_INPROCESS_VERSIONS[0]} "
+              f"to {YT_DLP_INPROCESS_VERSIONS[1]} (found {version or 'none'}); using the yt-dlp binary.")
+        name = 'subprocess'
+    if name not in _yt_dlp_backends:
+        _yt_dlp_backends[name] = InProcessBackend() if name == 'inprocess' else SubprocessBackend()
+    return _yt_dlp_backends[name]
+
+def normalize_url(url):
+    """
+    Normalizes a URL so that equivalent links map to the same metadata cache entry.
+    Lowercases the host, drops 'www.'/'m.' prefixes, fragments and tracking parameters,
+    sorts the query string and rewrites youtu.be/shorts links to the watch URL.
+    """
+    parts = urllib.parse.urlsplit(url.strip())
+    scheme = parts.scheme.lower() or 'https'
+    if scheme == 'http':
+        scheme = 'https'
+    host = (parts.hostname or '').lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = parts.path.rstrip('/') or '/'
+    query = [
+        (key, value) for key, value in urllib.parse.parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith('utm_') and key.lower() not in TRACKING_QUERY_PARAMS
+    ]
+
+    if host == 'youtu.be' and path != '/':
+        query.append(('v', path.lstrip('/')))
+        host, path = 'youtube.com', '/watch'
+    elif host == 'youtube.com' and path.startswith('/shorts/'):
+        query.append(('v', path[len('/shorts/'):]))
+        path = '/watch'
+
+    netloc = f"{host}:{parts.port}" if parts.port else host
+    return urllib.parse.urlunsplit((scheme, netloc, path, urllib.parse.urlencode(sorted(query)), ''))
+
+def is_single_video_url(url):
+    """
+    Returns True if a YouTube URL names one video (a watch, youtu.be or shorts link without a
+    playlist), as opposed to a playlist, channel or any other page listing several videos.
+    """
+    parts = urllib.parse.urlsplit(normalize_url(url))
+    query = urllib.parse.parse_qs(parts.query)
+    return parts.path == '/watch' and 'v' in query and 'list' not in query
+
+def auth_fingerprint(username=None, password=None, cookie_file=None):
+    """
+    Returns a short fingerprint of the credentials and cookie file used for a request,
+    so cached media info is never shared between different logins.
+    """
+    if not (username and password) and not cookie_file:
+        return 'anonymous'
+    digest = hashlib.sha256()
+    if username and password:
+        digest.update(f"{username}\0{password}".encode('utf-8'))
+    if cookie_file:
+        try:
+            with open(cookie_file, 'rb') as f:
+                digest.update(f.read())
+        except OSError:
+            digest.update(cookie_file.encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+def is_auth_error(line):
+    """
+    Returns True if a yt-dlp error line says that the request was not (or no longer) logged in.
+    """
+    return any(marker in line for marker in AUTH_FAILURE_MARKERS)
+
+class AuthSession:
+    """
+    The login of one account on one site, persisted as a Netscape cookie jar in SESSION_DIR.
+
+    Runs lease the session (see lease): when there is no valid login yet, a short request logs
+    in first (see log_in) and runs only get the cookies. Every run works on a private copy of
+    the jar, so no yt-dlp process reads the jar while another one writes it; the copy a run
+    leaves behind (including cookies the site refreshed) becomes the shared jar afterwards.
+    The names of the cookies that make up the login are kept in <jar>.json.
+    """
+    RUN_JAR_PATTERN = re.compile(r'(.+)\.[0-9a-f]{32}\.run')
+
+    def __init__(self, host, username, session_dir):
+        self.host = host
+        self.username = username
+        self.session_dir = session_dir
+        account = hashlib.sha256(username.encode('utf-8')).hexdigest()[:12]
+        self.path = os.path.join(session_dir, f"{host}-{account}.txt")
+        self.lock = threading.Lock()
+        self.unconfirmed = False  # A login in this process could not be confirmed from its cookies
+
+    @classmethod
+    def session_jar(cls, cookie_file):
+        """
+        Returns the shared jar a run's private copy (see lease) was made from, or cookie_file
+        itself if it is not such a copy.
+        """
+        match = cls.RUN_JAR_PATTERN.fullmatch(cookie_file)
+        return match.group(1) if match else cookie_file
+
+    def _site_cookies(self, path):
+        """
+        Returns the names of the unexpired cookies of the site in a jar.
+        """
+        names = set()
+        now = time.time()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if line.startswith('#HttpOnly_'):
+                        line = line[len('#HttpOnly_'):]
+                    elif line.startswith('#'):
+                        continue
+                    fields = line.rstrip('\n').split('\t')
+                    if len(fields) != 7:
+                        continue
+                    domain, _, _, _, expires, name, _ = fields
+                    domain = domain.lstrip('.')
+                    if not (self.host == domain or self.host.endswith('.' + domain) or domain.endswith('.' + self.host)):
+                        continue
+                    if not expires.isdigit() or int(expires) == 0 or int(expires) > now:
+                        names.add(name)
+        except OSError:
+            pass
+        return names
+
+    def _login_cookies(self):
+        required = SESSION_COOKIES.get(self.host)
+        if required:
+            return set(required)
+        try:
+            with open(self.path + '.json', 'r', encoding='utf-8') as f:
+                return set(json.load(f)['login_cookies'])
+        except (OSError, ValueError, KeyError, TypeError):
+            return set()
+
+    def valid(self, path=None):
+        """
+        Cheap offline check: True if the jar holds an unexpired login cookie of the site (one of
+        SESSION_COOKIES[host] if configured, otherwise one of the cookies its login added).
+        A jar whose login cookies are unknown is never valid.
+        """
+        return bool(self._login_cookies() & self._site_cookies(path or self.path))
+
+    def drop(self):
+        """
+        Forgets the saved login. Called with the lock held.
+        """
+        for path in (self.path, self.path + '.json'):
+            with contextlib.suppress(OSError):
+                os.remove(path)
+
+    def log_in(self, password, login):
+        """
+        Logs in with one short request and saves the jar as the session if the login shows in
+        its cookies: a cookie of SESSION_COOKIES[host] if configured, otherwise cookies that an
+        anonymous request (made first) does not get. Called with the lock held.
+
+        Args:
+            password (str): The account's password.
+            login (callable): login(options) makes a SESSION_LOGIN_OPTIONS request with the
+                given options added and returns its error lines.
+
+        Returns:
+            bool: True if the session is valid afterwards.
+        """
+        print(f"Logging in to {self.host} as {self.username}...")
+        probe_jar = f"{self.path}.{uuid.uuid4().hex}.probe"
+        login_jar = f"{self.path}.{uuid.uuid4().hex}.run"
+        try:
+            anonymous = set()
+            if not SESSION_COOKIES.get(self.host):
+                login(['--cookies', probe_jar])
+                anonymous = self._site_cookies(probe_jar)
+            errors = login(['--cookies', login_jar, '--username', self.username, '--password', password])
+            added = self._site_cookies(login_jar) - anonymous
+            if SESSION_COOKIES.get(self.host):
+                added &= set(SESSION_COOKIES[self.host])
+            if added and not any(is_auth_error(line) for line in errors):
+                with open(self.path + '.json', 'w', encoding='utf-8') as f:
+                    json.dump({'login_cookies': sorted(added)}, f)
+                os.replace(login_jar, self.path)
+                return True
+        finally:
+            for path in (probe_jar, login_jar):
+                with contextlib.suppress(OSError):
+                    os.remove(path)
+        self.unconfirmed = True
+        print(f"Warning: Could not confirm the login to {self.host}; every run will log in by itself.")
         return False
 
-def get_media_info(url, username=None, password=None, cookie_file=None):
+    @contextlib.contextmanager
+    def lease(self, password, login=None):
+        """
+        Lends the session to one yt-dlp run.
+
+        Yields a tuple (options, outcome): the yt-dlp options to add (--cookies with a private
+        copy of the jar) and a dict in which the caller stores the run's error lines as
+        outcome['errors']. Without a valid session, concurrent leases wait while the first one
+        logs in (see log_in), and then all use its cookies; the lock is not held during the
+        run itself. If the login cannot be done or confirmed up front, the run gets the
+        credentials as well (outcome['login'] is set) and its jar is not kept. If a run with
+        saved cookies fails with an auth error, the session is dropped and outcome['expired']
+        is set: the caller should retry, which logs in again.
+
+        Args:
+            password (str): The account's password.
+            login (callable, optional): Makes the login request (see log_in).
+        """
+        os.makedirs(self.session_dir, exist_ok=True)
+        run_jar = f"{self.path}.{uuid.uuid4().hex}.run"
+        with self.lock:
+            session = self.valid()
+            if not session and login is not None and not self.unconfirmed:
+                session = self.log_in(password, login)
+            if session:
+                shutil.copyfile(self.path, run_jar)
+        outcome = {'errors': [], 'login': not session}
+        try:
+            options = ['--cookies', run_jar]
+            if not session:
+                options.extend(['--username', self.username, '--password', password])
+            yield options, outcome
+        finally:
+            with self.lock:
+                if session and any(is_auth_error(line) for line in outcome['errors']):
+                    self.drop()
+                    self.unconfirmed = False
+                    outcome['expired'] = True
+                elif session and self.valid(run_jar):
+                    os.replace(run_jar, self.path)
+            with contextlib.suppress(OSError):
+                os.remove(run_jar)
+
+_auth_sessions = {}
+_auth_sessions_lock = threading.Lock()
+
+def get_auth_session(url, username, session_dir):
+    """
+    Returns the shared AuthSession of username on the site of url, whose jar is kept in
+    session_dir/SESSION_DIR.
+    """
+    host = urllib.parse.urlsplit(normalize_url(url)).hostname or ''
+    key = (os.path.abspath(session_dir), host, username)
+    with _auth_sessions_lock:
+        if key not in _auth_sessions:
+            _auth_sessions[key] = AuthSession(host, username, os.path.join(session_dir, SESSION_DIR))
+        return _auth_sessions[key]
+
+@contextlib.contextmanager
+def auth_options(url, username=None, password=None, cookie_file=None, session_dir=None, backend=None):
+    """
+    Yields (options, outcome) with the yt-dlp auth options for one run: a session lease (see
+    AuthSession.lease) when credentials are given, otherwise the user's cookie file or nothing.
+
+    Args:
+        url (str): The URL of the run; the session belongs to its site.
+        username, password (str, optional): Login credentials.
+        cookie_file (str, optional): A cookie file of the user, used when there are no credentials.
+        session_dir (str, optional): Directory holding SESSION_DIR. Defaults to get_output_dir().
+        backend (optional): The yt-dlp backend used to log in ahead of the run. Without it, the
+            run itself logs in and its login is not kept.
+    """
+    if username and password:
+        login = None
+        if backend is not None:
+            def login(options):
+                _, error = backend.fetch_info(SESSION_LOGIN_OPTIONS + options, url)
+                return error.splitlines() if error else []
+
+        with get_auth_session(url, username, session_dir or get_output_dir()).lease(password, login) as lease:
+            yield lease
+    else:
+        yield (['--cookies', cookie_file] if cookie_file else []), {'errors': [], 'login': False}
+
+def get_cache_ttl(url):
+    """
+    Returns the metadata cache TTL in seconds for the host of a URL.
+    """
+    host = urllib.parse.urlsplit(normalize_url(url)).hostname or ''
+    for domain, ttl in METADATA_CACHE_TTLS.items():
+        if host == domain or host.endswith('.' + domain):
+            return ttl
+    return METADATA_CACHE_DEFAULT_TTL
+
+def open_metadata_cache(cache_dir):
+    """
+    Opens (and creates if needed) the SQLite metadata cache in cache_dir.
+    """
+    conn = sqlite3.connect(os.path.join(cache_dir, METADATA_CACHE_FILE), timeout=10)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS media_info ("
+        "key TEXT PRIMARY KEY, url TEXT NOT NULL, extractor TEXT, "
+        "created REAL NOT NULL, expires REAL NOT NULL, last_access REAL NOT NULL, "
+        "size INTEGER NOT NULL, data BLOB NOT NULL)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS media_info_url ON media_info (url)")
+    conn.execute("CREATE INDEX IF NOT EXISTS media_info_lru ON media_info (last_access)")
+    return conn
+
+def metadata_cache_key(url, extractor_args, fingerprint):
+    """
+    Builds the cache key from the normalized URL, the extractor arguments and the auth fingerprint.
+    """
+    raw = json.dumps([normalize_url(url), list(extractor_args), fingerprint])
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+def load_cached_media_info(cache_dir, key):
+    """
+    Looks up a cache entry and refreshes its LRU timestamp.
+
+    Returns:
+        tuple: (info dict, extractor name) for a fresh entry, or (None, None) on a miss.
+    """
+    try:
+        with contextlib.closing(open_metadata_cache(cache_dir)) as conn, conn:
+            row = conn.execute("SELECT extractor, expires, data FROM media_info WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None, None
+            extractor, expires, data = row
+            now = time.time()
+            if expires < now:
+                conn.execute("DELETE FROM media_info WHERE key = ?", (key,))
+                return None, None
+            conn.execute("UPDATE media_info SET last_access = ? WHERE key = ?", (now, key))
+        return json.loads(zlib.decompress(data).decode('utf-8')), extractor
+    except (sqlite3.Error, zlib.error, ValueError) as e:
+        print(f"Warning: Could not read the metadata cache: {e}")
+        return None, None
+
+def store_cached_media_info(cache_dir, key, url, extractor, info):
+    """
+    Stores a media info dict in the cache and evicts least recently used entries
+    until the cache fits in METADATA_CACHE_MAX_BYTES.
+    """
+    try:
+        data = zlib.compress(json.dumps(info).encode('utf-8'))
+        now = time.time()
+        with contextlib.closing(open_metadata_cache(cache_dir)) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO media_info VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, normalize_url(url), extractor, now, now + get_cache_ttl(url), now, len(data), data)
+            )
+            conn.execute("DELETE FROM media_info WHERE expires < ?", (now,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM media_info").fetchone()[0]
+            if total > METADATA_CACHE_MAX_BYTES:
+                for old_key, size in conn.execute("SELECT key, size FROM media_info ORDER BY last_access").fetchall():
+                    if total <= METADATA_CACHE_MAX_BYTES:
+                        break
+                    conn.execute("DELETE FROM media_info WHERE key = ?", (old_key,))
+                    total -= size
+    except sqlite3.Error as e:
+        print(f"Warning: Could not write the metadata cache: {e}")
+
+def invalidate_metadata_cache(cache_dir, url=None):
+    """
+    Removes cached media info for a URL (for every login), or the whole cache if url is None.
+
+    Returns:
+        int: The number of entries removed.
+    """
+    if not os.path.isfile(os.path.join(cache_dir, METADATA_CACHE_FILE)):
+        return 0
+    with contextlib.closing(open_metadata_cache(cache_dir)) as conn, conn:
+        if url:
+            cursor = conn.execute("DELETE FROM media_info WHERE url = ?", (normalize_url(url),))
+        else:
+            cursor = conn.execute("DELETE FROM media_info")
+        return cursor.rowcount
+
+def race_extractors(backend, base_options, url, extractor_args, fanout=1, on_entry=None):
+    """
+    Fetches media info with each extractor argument until one returns valid JSON.
+    Up to `fanout` attempts run concurrently; as soon as one succeeds the others are cancelled.
+    With fanout=1 the extractors are simply tried one after another, in order.
+
+    Args:
+        backend: The yt-dlp backend used for the attempts.
+        base_options (list): yt-dlp options shared by every attempt (without --extractor-args).
+        url (str): The URL of the media to analyze.
+        extractor_args (list): Extractor arguments to try, best candidate first.
+        fanout (int, optional): Maximum number of concurrent attempts. Defaults to 1.
+        on_entry (callable, optional): Called once per playlist entry, from whichever attempt
+            delivers it first.
+
+    Returns:
+        tuple: (info dict or None, winning extractor or None, list of attempt records, error message or None)
+    """
+    results = queue.Queue()
+    pending = list(extractor_args)
+    running = {}
+    cancels = {}
+    cancelled = set()
+    cancel_lock = threading.Lock()
+    attempts = []
+    error = None
+    delivered_entries = set()
+
+    def deliver_entry(entry):
+        with cancel_lock:
+            if entry['playlist_index'] in delivered_entries:
+                return
+            delivered_entries.add(entry['playlist_index'])
+        on_entry(entry)
+
+    def register_cancel(extractor_arg, cancel):
+        with cancel_lock:
+            cancels[extractor_arg] = cancel
+            if extractor_arg in cancelled:
+                cancel()
+
+    def cancel_attempt(extractor_arg):
+        with cancel_lock:
+            cancelled.add(extractor_arg)
+            if extractor_arg in cancels:
+                cancels[extractor_arg]()
+
+    def attempt(extractor_arg):
+        info, attempt_error = backend.fetch_info(
+            base_options + ['--extractor-args', extractor_arg], url,
+            on_start=(lambda cancel: register_cancel(extractor_arg, cancel)) if fanout > 1 else None,
+            on_entry=deliver_entry if on_entry else None
+        )
+        results.put((extractor_arg, info, attempt_error))
+
+    def launch():
+        extractor_arg = pending.pop(0)
+        print(f"Attempting to fetch media info with {extractor_arg} extractor...")
+        running[extractor_arg] = time.monotonic()
+        threading.Thread(target=attempt, args=(extractor_arg,), daemon=True).start()
+
+    while pending and len(running) < fanout:
+        launch()
+
+    while running:
+        extractor_arg, info, attempt_error = results.get()
+        latency = time.monotonic() - running.pop(extractor_arg)
+
+        attempts.append({'extractor': extractor_arg, 'outcome': 'success' if info is not None else 'failure', 'latency': latency})
+        if info is not None:
+            for loser, launched in running.items():
+                cancel_attempt(loser)
+                attempts.append({'extractor': loser, 'outcome': 'cancelled', 'latency': time.monotonic() - launched})
+            return info, extractor_arg, attempts, None
+
+        error = attempt_error
+        last_lines = error.strip().splitlines()
+        print(f"Failed with {extractor_arg} extractor: {last_lines[-1] if last_lines else error}")
+        if pending:
+            print("Trying next extractor...")
+            launch()
+
+    return None, None, attempts, error
+
+def load_extractor_stats(stats_dir):
+    """
+    Loads the per-host extractor statistics, or an empty dict if none were recorded yet.
+    """
+    try:
+        with open(os.path.join(stats_dir, EXTRACTOR_STATS_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def order_extractors_by_stats(stats, host, extractor_args):
+    """
+    Sorts extractor arguments so the historically best one for a host comes first.
+    Extractors that have succeeded before come first, ranked by expected time to a successful
+    result (mean latency divided by a smoothed success rate), then extractors without history
+    in their original order, then extractors that have only ever failed.
+    """
+    host_stats = stats.get(host, {})
+
+    def expected_cost(indexed_arg):
+        index, extractor_arg = indexed_arg
+        entry = host_stats.get(extractor_arg)
+        if not entry or not entry.get('attempts'):
+            return (1, 0, index)
+        success_rate = (entry['successes'] + 0.5) / (entry['attempts'] + 1)
+        mean_latency = entry['latency_total'] / entry['attempts']
+        return (0 if entry['successes'] else 2, mean_latency / success_rate, index)
+
+    return [extractor_arg for _, extractor_arg in sorted(enumerate(extractor_args), key=expected_cost)]
+
+def record_extractor_attempts(stats_dir, host, attempts, time_to_first_success):
+    """
+    Adds the outcome of one media info lookup to the per-host extractor statistics and
+    appends every attempt to the attempt log (used by --extractor-stats).
+
+    Args:
+        stats_dir (str): Directory holding the statistics files.
+        host (str): Normalized host name of the URL.
+        attempts (list): Attempt records as returned by race_extractors.
+        time_to_first_success (float): Seconds until a valid result, or None if every attempt failed.
+    """
+    try:
+        stats = load_extractor_stats(stats_dir)
+        host_stats = stats.setdefault(host, {})
+        for attempt in attempts:
+            if attempt['outcome'] == 'cancelled':
+                continue
+            entry = host_stats.setdefault(attempt['extractor'], {'attempts': 0, 'successes': 0, 'latency_total': 0.0})
+            entry['attempts'] += 1
+            entry['latency_total'] += attempt['latency']
+            if attempt['outcome'] == 'success':
+                entry['successes'] += 1
+
+        stats_path = os.path.join(stats_dir, EXTRACTOR_STATS_FILE)
+        with open(stats_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(stats, f, indent=1)
+        os.replace(stats_path + '.tmp', stats_path)
+
+        now = time.time()
+        with open(os.path.join(stats_dir, EXTRACTOR_ATTEMPT_LOG), 'a', encoding='utf-8') as f:
+            for attempt in attempts:
+                f.write(json.dumps(dict(attempt, time=now, host=host)) + '\n')
+            f.write(json.dumps({'time': now, 'host': host, 'time_to_first_success': time_to_first_success}) + '\n')
+    except OSError as e:
+        print(f"Warning: Could not record extractor statistics: {e}")
+
+def print_extractor_stats(stats_dir):
+    """
+    Prints per-host extractor success rates and the time-to-first-success distribution.
+    """
+    stats = load_extractor_stats(stats_dir)
+    if not stats:
+        print("No extractor statistics recorded yet.")
+        return
+
+    samples = {}
+    try:
+        with open(os.path.join(stats_dir, EXTRACTOR_ATTEMPT_LOG), 'r', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                if record.get('time_to_first_success') is not None:
+                    samples.setdefault(record['host'], []).append(record['time_to_first_success'])
+    except (OSError, ValueError):
+        pass
+
+    for host, host_stats in sorted(stats.items()):
+        print(f"\n{host}")
+        ranked = order_extractors_by_stats(stats, host, list(host_stats))
+        for extractor_arg in ranked:
+            entry = host_stats[extractor_arg]
+            print(f"  {extractor_arg}: {entry['successes']}/{entry['attempts']} succeeded, "
+                  f"mean {entry['latency_total'] / max(entry['attempts'], 1):.1f}s")
+        host_samples = sorted(samples.get(host, []))
+        if host_samples:
+            pick = lambda q: host_samples[min(len(host_samples) - 1, int(q * len(host_samples)))]
+            print(f"  time to first success: p50 {pick(0.5):.1f}s, p90 {pick(0.9):.1f}s, "
+                  f"max {host_samples[-1]:.1f}s over {len(host_samples)} lookups")
+
+def get_media_info(url, username=None, password=None, cookie_file=None, cache_dir=None, refresh=False, backend=None, on_entry=None):
     """
     Fetches and parses detailed media information for a given URL using yt-dlp's JSON output.
     Includes various extractor attempts and common workarounds.
+    When cache_dir is given, results are cached there and reused until their TTL expires.
+    Playlists are enumerated flat: their entries are lightweight records (id, title, duration,
+    URL) streamed to on_entry as yt-dlp lists them; full metadata of an entry is only fetched
+    when get_media_info is called for that entry's URL.
     
     Args:
         url (str): The URL of the media to analyze.
         username (str, optional): Username for login. Defaults to None.
         password (str, optional): Password for login. Defaults to None.
         cookie_file (str, optional): Path to a cookie file. Defaults to None.
+        cache_dir (str, optional): Directory holding the metadata cache. Defaults to None (no caching).
+        refresh (bool, optional): Ignore any cached entry and fetch again. Defaults to False.
+        backend (optional): The yt-dlp backend to use. Defaults to get_yt_dlp_backend().
+        on_entry (callable, optional): Called with each playlist entry record as soon as it is
+            known (also for cached playlists). Not called for single media.
 
     Returns:
         tuple: A tuple containing:
                - dict: The full JSON info dictionary from yt-dlp, or None if an error occurred.
                - str: An error message if an error occurred, otherwise None.
     """
-    base_command = [
-        'yt-dlp',
-        '--dump-json',
-        '--no-warnings',
-        '--no-simulate',
-        '--extractor-retries', '3',
-        '--socket-timeout', '10',
-        url
-    ]
+    if backend is None:
+        backend = get_yt_dlp_backend()
+
+    base_options = [
+        '--flat-playlist',
+        '--extractor-retries', '3',
+        '--socket-timeout', '10',
+    ]
+
+    yt_player_clients_to_try = []
+    if "youtube.com" in url or "youtu.be" in url:
+        yt_player_clients_to_try = [
+            'youtube',
+            'youtube:player_client=android',
+            'youtube:player_client=web',
+            'youtube:player_client=web_public',
+            'youtube:player_client=ios'
+        ]
+
+    cache_key = None
+    if cache_dir:
+        cache_key = metadata_cache_key(url, yt_player_clients_to_try + ['generic:impersonate'],
+                                       auth_fingerprint(username, password, cookie_file))
+        if not refresh:
+            with span('metadata_cache_lookup') as trace:
+                info, extractor_arg = load_cached_media_info(cache_dir, cache_key)
+                trace['outcome'] = 'hit' if info is not None else 'miss'
+            if info is not None:
+                print(f"Using cached media info (fetched with {extractor_arg} extractor).")
+                if on_entry and info.get('_type') == 'playlist':
+                    for entry in info.get('entries') or []:
+                        if entry:
+                            on_entry(entry)
+                return info, None
+
+    host = urllib.parse.urlsplit(normalize_url(url)).hostname or ''
+    if yt_player_clients_to_try and cache_dir:
+        yt_player_clients_to_try = order_extractors_by_stats(load_extractor_stats(cache_dir), host, yt_player_clients_to_try)
+    started = time.monotonic()
+    attempts = []
+
+    # A rejected saved login is dropped by the session, and the second pass logs in again.
+    for _ in range(2):
+        info = None
+        with auth_options(url, username, password, cookie_file, cache_dir, backend) as (auth, outcome):
+            options = base_options + auth
+            if yt_player_clients_to_try:
+                # Attempts of a run that logs in run one at a time: they share the lease's
+                # jar, and racing them would send the credentials several times at once.
+                # Playlists are listed by one client at a time too, as every attempt lists
+                # the whole playlist.
+                race = RACE_EXTRACTORS and not outcome['login'] and is_single_video_url(url)
+                fanout = EXTRACTOR_RACE_FANOUT if race else 1
+                if fanout > 1:
+                    print(f"Racing up to {fanout} YouTube extractors at a time...")
+                info, extractor_arg, youtube_attempts, error = race_extractors(backend, options, url, yt_player_clients_to_try, fanout, on_entry)
+                attempts.extend(youtube_attempts)
+                if info is None:
+                    print("All YouTube-specific extractors failed. Falling back to generic extractor...")
+
+            if info is None:
+                info, extractor_arg, generic_attempts, error = race_extractors(backend, options, url, ['generic:impersonate'], 1, on_entry)
+                attempts.extend(generic_attempts)
+            if info is None and error:
+                outcome['errors'] = error.splitlines()
+        if not outcome.get('expired'):
+            break
+        print("The saved login session was rejected. Logging in again...")
+
+    for attempt in attempts:
+        record_span('extractor_attempt', attempt['latency'], host=host, extractor=attempt['extractor'], outcome=attempt['outcome'])
+    if cache_dir:
+        record_extractor_attempts(cache_dir, host, attempts, time.monotonic() - started if info is not None else None)
+    if info is None:
+        return None, error
+
+    if DEBUG_MODE:
+        dump_raw_info(cache_dir or get_output_dir(), url, extractor_arg, info)
+
+    if cache_key:
+        store_cached_media_info(cache_dir, cache_key, url, extractor_arg, info)
+    return info, None
+
+class MediaInfoLookup:
+    """
+    Runs get_media_info in the background so that playlist entries can be listed and
+    selected while yt-dlp is still enumerating the rest of the playlist.
+    """
+
+    def __init__(self, url, username=None, password=None, cookie_file=None, cache_dir=None):
+        self.entries = {}  # playlist_index -> entry record, in arrival order
+        self.info = None
+        self.error = None
+        self.done = False
+        self._queue = queue.Queue()
+        threading.Thread(target=self._run, args=(url, username, password, cookie_file, cache_dir), daemon=True).start()
+
+    def _run(self, url, username, password, cookie_file, cache_dir):
+        try:
+            self.info, self.error = get_media_info(url, username, password, cookie_file,
+                                                   cache_dir=cache_dir, on_entry=self._queue.put)
+        except Exception as e:
+            self.error = f"An unexpected error occurred: {e}"
+        self._queue.put(None)
+
+    def next_entry(self):
+        """
+        Waits for the next playlist entry. Returns None once the lookup has finished
+        (immediately, for single media).
+        """
+        if self.done:
+            return None
+        entry = self._queue.get()
+        if entry is None:
+            self.done = True
+            return None
+        self.entries[entry.get('playlist_index') or len(self.entries) + 1] = entry
+        return entry
+
+    def wait(self):
+        """
+        Collects the remaining entries and waits for the lookup to finish.
+
+        Returns:
+            tuple: (info dict or None, error message or None), as returned by get_media_info.
+        """
+        while self.next_entry() is not None:
+            pass
+        return self.info, self.error
+
+    def count(self):
+        """
+        Returns the number of playlist items: exact once the lookup is done, otherwise the
+        playlist length reported by the site (if any) or the number of entries seen so far.
+        """
+        seen = max(self.entries, default=0)
+        if self.done:
+            return seen
+        reported = max((entry.get('n_entries') or 0 for entry in self.entries.values()), default=0)
+        return max(seen, reported)
+
+    def entry_list(self):
+        """
+        Returns the entries seen so far as a list indexed by playlist position - 1
+        (None for positions not listed yet), as expected by download_playlist.
+        """
+        return [self.entries.get(index) for index in range(1, max(self.entries, default=0) + 1)]
+
+def get_entry_info(entry, username=None, password=None, cookie_file=None, cache_dir=None):
+    """
+    Fetches the full metadata of one flat playlist entry. Playlists are only enumerated
+    flat, so this is called lazily, for selected items only.
+
+    Returns:
+        tuple: (info dict or None, error message or None), as returned by get_media_info.
+    """
+    entry_url = (entry or {}).get('webpage_url') or (entry or {}).get('url')
+    if not entry_url or not entry_url.startswith(('http://', 'https://')):
+        return None, "The playlist entry has no URL of its own."
+    print(f"\nFetching media information for {entry.get('title') or entry_url}...")
+    return get_media_info(entry_url, username, password, cookie_file, cache_dir=cache_dir)
+
+def codec_rank(codec, preferred):
+    """
+    Returns the position of codec (e.g. 'vp09.00.40.08') in a preference list such as
+    PREFERRED_VIDEO_CODECS, or len(preferred) for unknown codecs.
+    """
+    codec = (codec or '').lower()
+    for rank, prefix in enumerate(preferred):
+        if codec.startswith(prefix):
+            return rank
+    return len(preferred)
+
+def estimate_format_bytes(f, duration):
+    """
+    Estimates the transfer size of one format from filesize, filesize_approx or its bitrate
+    times the duration. Returns None when none of these are known.
+    """
+    size = f.get('filesize') or f.get('filesize_approx')
+    if size:
+        return int(size)
+    bitrate = f.get('tbr') or ((f.get('vbr') or 0) + (f.get('abr') or 0))
+    if bitrate and duration:
+        return int(bitrate * 1000 / 8 * duration)
+    return None
+
+def format_bytes(size):
+    """
+    Formats a byte count for menus, e.g. '~41.2 MB'.
+    """
+    if size is None:
+        return "size unknown"
+    if size >= 1024 ** 3:
+        return f"~{size / 1024 ** 3:.1f} GB"
+    return f"~{size / 1024 ** 2:.1f} MB"
+
+def rank_video_formats(info, max_bytes=None, max_bitrate_kbps=None):
+    """
+    Picks the cheapest good format for every video height in info['formats'].
+
+    Video-only formats are paired with the preferred audio-only format, and the size of each
+    pair (or of each muxed format) is estimated. Per height, higher frame rates win, then
+    more efficient codecs (PREFERRED_VIDEO_CODECS), then the smaller estimated size.
+    Candidates over max_bytes or max_bitrate_kbps are skipped; unknown sizes are allowed.
+
+    Args:
+        info (dict): The yt-dlp info dictionary for the media.
+        max_bytes (int, optional): Largest acceptable estimated transfer size.
+        max_bitrate_kbps (float, optional): Largest acceptable total bitrate.
+
+    Returns:
+        tuple: (ranked, over_limit) - lists of candidate dicts (height, fps, vcodec, acodec,
+               format_string, bytes, tbr), sorted by height in descending order. over_limit
+               holds the best candidate of every height that only exceeds the limits.
+    """
+    duration = info.get('duration')
+    formats = info.get('formats') or []
+    audio_formats = [f for f in formats if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none')]
+    audio = min(audio_formats, key=lambda f: (codec_rank(f.get('acodec'), PREFERRED_AUDIO_CODECS),
+                                              -(f.get('abr') or f.get('tbr') or 0)), default=None)
+
+    by_height = collections.defaultdict(list)
+    for f in formats:
+        if f.get('vcodec') == 'none' or not f.get('height') or not f.get('format_id'):
+            continue
+        height = f['height']
+        fallback = f"bestvideo[height={height}]+bestaudio/best[height={height}]"
+        size = estimate_format_bytes(f, duration)
+        tbr = f.get('tbr')
+        acodec = f.get('acodec')
+        if f.get('acodec') == 'none' and audio:
+            audio_size = estimate_format_bytes(audio, duration)
+            size = size + audio_size if size is not None and audio_size is not None else None
+            tbr = tbr + (audio.get('tbr') or audio.get('abr') or 0) if tbr else None
+            acodec = audio.get('acodec')
+            format_string = f"{f['format_id']}+{audio['format_id']}/{fallback}"
+        elif f.get('acodec') == 'none':
+            format_string = f"{f['format_id']}+bestaudio/{fallback}"
+        else:
+            format_string = f"{f['format_id']}/{fallback}"
+        by_height[height].append({
+            'height': height,
+            'fps': f.get('fps'),
+            'vcodec': f.get('vcodec'),
+            'acodec': acodec,
+            'format_string': format_string,
+            'bytes': size,
+            'tbr': tbr,
+        })
+
+    def preference(candidate):
+        return (-(1 if (candidate['fps'] or 0) > 30 else 0), codec_rank(candidate['vcodec'], PREFERRED_VIDEO_CODECS),
+                candidate['bytes'] if candidate['bytes'] is not None else float('inf'))
+
+    def within_limits(candidate):
+        if max_bytes and candidate['bytes'] is not None and candidate['bytes'] > max_bytes:
+            return False
+        return not (max_bitrate_kbps and candidate['tbr'] and candidate['tbr'] > max_bitrate_kbps)
+
+    ranked, over_limit = [], []
+    for height in sorted(by_height, reverse=True):
+        candidates = sorted(by_height[height], key=preference)
+        fitting = [candidate for candidate in candidates if within_limits(candidate)]
+        if fitting:
+            ranked.append(fitting[0])
+        else:
+            over_limit.append(min(candidates, key=lambda c: c['bytes'] if c['bytes'] is not None else float('inf')))
+    return ranked, over_limit
+
+def get_available_video_formats(info, max_bytes=None, max_bitrate_kbps=None):
+    """
+    Extracts and formats available video resolutions from the yt-dlp info dictionary, one option
+    per height using the format chosen by rank_video_formats, labelled with its estimated size.
+    
+    Args:
+        info (dict): The yt-dlp info dictionary for the media.
+        max_bytes (int, optional): Size limit. Defaults to MAX_DOWNLOAD_BYTES.
+        max_bitrate_kbps (float, optional): Bitrate limit. Defaults to MAX_BITRATE_KBPS.
+
+    Returns:
+        list: A list of tuples (display_name, yt_dlp_format_string) for available options.
+              Sorted by height in descending order, with a fallback "Best available" option.
+              If every height exceeds the limits, only the smallest one is offered.
+    """
+    max_bytes = max_bytes if max_bytes is not None else MAX_DOWNLOAD_BYTES
+    max_bitrate_kbps = max_bitrate_kbps if max_bitrate_kbps is not None else MAX_BITRATE_KBPS
+    ranked, over_limit = rank_video_formats(info, max_bytes, max_bitrate_kbps)
+    if over_limit:
+        if ranked:
+            print(f"Note: {len(over_limit)} qualities above the size/bitrate limit are hidden.")
+        else:
+            print("Warning: Every quality is above the size/bitrate limit; offering the smallest one.")
+            ranked = [min(over_limit, key=lambda c: c['bytes'] if c['bytes'] is not None else float('inf'))]
+
+    options = []
+    for candidate in ranked:
+        fps = f"{candidate['fps']:.0f}" if (candidate['fps'] or 0) > 30 else ""
+        codecs = (candidate['vcodec'] or 'unknown').split('.')[0]
+        if candidate['acodec'] and candidate['acodec'] != 'none':
+            codecs += f" + {candidate['acodec'].split('.')[0]}"
+        display_name = f"{candidate['height']}p{fps} {codecs} ({format_bytes(candidate['bytes'])})"
+        options.append((display_name, candidate['format_string']))
+    
+    if info.get('_type') == 'video' and not options:
+        options.append(("Best available quality", "best"))
+    
+    return options
+
+def archive_variant(media_type, format_string=None):
+    """
+    Returns the archive variant for a download: 'audio', or 'video:<format>' because
+    different video qualities are different files.
+    """
+    return 'audio' if media_type == 'audio' else f"video:{format_string}"
+
+def open_download_archive(output_dir):
+    """
+    Opens (and creates if needed) the SQLite download archive in output_dir.
+    """
+    conn = sqlite3.connect(os.path.join(output_dir, DOWNLOAD_ARCHIVE_FILE), timeout=10)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS downloads ("
+        "extractor TEXT NOT NULL, video_id TEXT NOT NULL, variant TEXT NOT NULL, "
+        "filepath TEXT NOT NULL, downloaded REAL NOT NULL, "
+        "PRIMARY KEY (extractor, video_id, variant))"
+    )
+    return conn
+
+def archive_lookup(output_dir, extractor, video_id, variant):
+    """
+    Returns the path of an earlier download of this video and variant if the file still exists,
+    otherwise None. Does not touch the network.
+    """
+    if not (extractor and video_id) or not os.path.isfile(os.path.join(output_dir, DOWNLOAD_ARCHIVE_FILE)):
+        return None
+    try:
+        with contextlib.closing(open_download_archive(output_dir)) as conn:
+            row = conn.execute(
+                "SELECT filepath FROM downloads WHERE extractor = ? AND video_id = ? AND variant = ?",
+                (extractor.lower(), str(video_id), variant)
+            ).fetchone()
+    except sqlite3.Error as e:
+        print(f"Warning: Could not read the download archive: {e}")
+        return None
+    if row and os.path.isfile(row[0]):
+        return row[0]
+    return None
+
+def archive_record(output_dir, variant, produced):
+    """
+    Records produced files in the download archive.
+
+    Args:
+        output_dir (str): Directory holding the archive.
+        variant (str): Archive variant as returned by archive_variant.
+        produced (list): (extractor, video_id, filepath) tuples as returned by read_output_manifest.
+    """
+    if not produced:
+        return
+    try:
+        now = time.time()
+        with contextlib.closing(open_download_archive(output_dir)) as conn, conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?)",
+                [(extractor.lower(), video_id, variant, filepath, now) for extractor, video_id, filepath in produced]
+            )
+    except sqlite3.Error as e:
+        print(f"Warning: Could not update the download archive: {e}")
+
+def new_manifest_path(output_dir):
+    """
+    Returns a unique path for the manifest of one yt-dlp run (the file is created by yt-dlp).
+    """
+    return os.path.join(output_dir, f".manifest-{uuid.uuid4().hex}.tsv")
+
+def read_output_manifest(manifest_path):
+    """
+    Reads and deletes a manifest written by yt-dlp with OUTPUT_MANIFEST_TEMPLATE.
+
+    Returns:
+        list: (extractor, video_id, filepath) tuples for the files that exist, in download order.
+    """
+    produced = []
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                fields = line.rstrip('\n').split('\t', 2)
+                if len(fields) == 3 and os.path.isfile(fields[2]):
+                    produced.append(tuple(fields))
+        os.remove(manifest_path)
+    except OSError:
+        pass
+    return produced
+
+class ProgressMonitor:
+    """
+    Live throughput monitor for one download, fed with yt-dlp progress dicts (parsed from
+    PROGRESS_TEMPLATE lines of the binary, or from progress hooks of the Python API).
+
+    Keeps a moving-average speed over PROGRESS_SPEED_WINDOW seconds and an ETA for the file
+    being downloaded. A download is stalled when it averaged less than min_speed over the
+    last window seconds while downloading; post-processing (merging, extracting audio) is
+    never a stall. Events are passed to on_progress as dicts with an 'event' key:
+    'progress', 'stall', 'restart' or 'done'.
+    """
+
+    def __init__(self, label=None, on_progress=None, show=True, min_speed=None, window=None):
+        self.label = label
+        self.on_progress = on_progress
+        self.show = show
+        self.min_speed = min_speed or STALL_MIN_SPEED
+        self.window = window or STALL_WINDOW
+        self.restarts = 0
+        self.transferred = 0  # Bytes received over all files and attempts
+        self.speed = None
+        self.eta = None
+        self.downloading = False
+        self._lock = threading.Lock()
+        self._files = {}  # Bytes downloaded per file, so resumed transfers are not counted twice
+        self._last_print = 0.0
+        self.restart()
+
+    def restart(self):
+        """
+        Starts a new measurement window, for a new attempt of the download.
+        """
+        with self._lock:
+            self.started = time.monotonic()
+            self.downloading = False
+            self._samples = collections.deque([(self.started, self.transferred)])
+
+    def _bytes_at(self, when):
+        value = self._samples[0][1]
+        for sample_time, transferred in self._samples:
+            if sample_time > when:
+                break
+            value = transferred
+        return value
+
+    def update(self, progress):
+        """
+        Records one yt-dlp progress dict and emits a 'progress' event.
+        """
+        now = time.monotonic()
+        status = progress.get('status')
+        filename = progress.get('filename') or progress.get('tmpfilename') or ''
+        downloaded = progress.get('downloaded_bytes') or 0
+        total = progress.get('total_bytes') or progress.get('total_bytes_estimate')
+        with self._lock:
+            self.transferred += max(0, downloaded - self._files.get(filename, 0))
+            self._files[filename] = downloaded
+            self.downloading = status == 'downloading'
+            self._samples.append((now, self.transferred))
+            horizon = now - max(PROGRESS_SPEED_WINDOW, self.window)
+            while len(self._samples) > 1 and self._samples[1][0] <= horizon:
+                self._samples.popleft()
+            elapsed = min(PROGRESS_SPEED_WINDOW, now - self.started)
+            if elapsed > 0.5:
+                self.speed = (self.transferred - self._bytes_at(now - PROGRESS_SPEED_WINDOW)) / elapsed
+            self.eta = (total - downloaded) / self.speed if total and self.speed and status == 'downloading' else None
+        self.emit('progress', status=status, filename=filename, downloaded_bytes=downloaded, total_bytes=total)
+
+        if self.show and (status == 'finished' or now - self._last_print >= PROGRESS_PRINT_INTERVAL):
+            self._last_print = now
+            name = f"{self.label}: " if self.label else ""
+            if status == 'finished':
+                print(f"[progress] {name}{os.path.basename(filename)} done, {format_bytes(downloaded)}")
+            else:
+                done = f"{downloaded / total * 100:.1f}% of {format_bytes(total)}" if total else format_bytes(downloaded)
+                speed = f"{self.speed / 1024:.0f} KB/s" if self.speed is not None else "unknown speed"
+                eta = f"{int(self.eta) // 60}:{int(self.eta) % 60:02d}" if self.eta is not None else "unknown"
+                print(f"[progress] {name}{done} at {speed} (average), ETA {eta}")
+
+    def stalled(self):
+        """
+        Returns True if the download has been slower than min_speed for the whole window.
+        """
+        now = time.monotonic()
+        with self._lock:
+            if not self.downloading or now - self.started < self.window:
+                return False
+            return (self.transferred - self._bytes_at(now - self.window)) / self.window < self.min_speed
+
+    def emit(self, event, **fields):
+        if self.on_progress:
+            self.on_progress(dict(fields, event=event, label=self.label, transferred_bytes=self.transferred,
+                                  speed=self.speed, eta=self.eta, restarts=self.restarts, time=time.time()))
+
+def next_player_client(options):
+    """
+    Returns a copy of the yt-dlp options with the YouTube player client replaced by the next
+    one in STALL_PLAYER_CLIENTS, or the options unchanged if they do not select a client.
+    """
+    prefix = 'youtube:player_client='
+    options = list(options)
+    for i, option in enumerate(options[:-1]):
+        if option == '--extractor-args' and options[i + 1].startswith(prefix) and STALL_PLAYER_CLIENTS:
+            current = options[i + 1][len(prefix):]
+            position = STALL_PLAYER_CLIENTS.index(current) if current in STALL_PLAYER_CLIENTS else -1
+            options[i + 1] = prefix + STALL_PLAYER_CLIENTS[(position + 1) % len(STALL_PLAYER_CLIENTS)]
+    return options
+
+def segmented_download_options(connections=None):
+    """
+    Returns the yt-dlp options that download over several connections at once:
+    CONCURRENT_FRAGMENTS parallel requests for HLS/DASH fragments and, when aria2c is installed,
+    parallel HTTP Range requests for direct files (see SEGMENTED DOWNLOAD SETTINGS). aria2c
+    writes the parts into one preallocated file and records the finished parts in a control
+    file next to it, so an interrupted download resumes with only the missing parts. As yt-dlp
+    gets no progress from aria2c, aria2c is given the stall limits of the ProgressMonitor and
+    exits when a transfer stalls (see ARIA2C_STALL_EXIT_CODES).
+
+    Args:
+        connections (int, optional): Connections per download. Defaults to SEGMENT_CONNECTIONS
+            for direct files and CONCURRENT_FRAGMENTS for fragments.
+
+    Returns:
+        list: yt-dlp command line options.
+    """
+    options = ['--concurrent-fragments', str(connections or CONCURRENT_FRAGMENTS)]
+    if SEGMENTED_DOWNLOADS and get_capabilities()['aria2c']['version']:
+        connections = connections or SEGMENT_CONNECTIONS
+        options.extend(['--downloader', 'http:aria2c', '--downloader-args', 'aria2c:' + ' '.join([
+            f'--max-connection-per-server={connections}', f'--split={connections}',
+            f'--min-split-size={MIN_SEGMENT_SIZE}', f'--file-allocation={SEGMENT_FILE_ALLOCATION}',
+            f'--lowest-speed-limit={max(1, STALL_MIN_SPEED // connections)}', f'--timeout={int(STALL_WINDOW)}',
+            '--max-tries=1'])])
+    return options
+
+def without_segmented_downloader(options):
+    """
+    Returns a copy of the yt-dlp options with aria2c removed, so direct files are downloaded by
+    yt-dlp itself over one connection. Partial files are not resumed, because a preallocated
+    aria2c file already has the full size.
+    """
+    stripped = []
+    skip = 0
+    for i, option in enumerate(options):
+        if skip:
+            skip -= 1
+        elif option == '--downloader' and options[i + 1:i + 2] == ['http:aria2c']:
+            skip = 1
+        elif option == '--downloader-args' and options[i + 1:i + 2] and options[i + 1].startswith('aria2c:'):
+            skip = 1
+        else:
+            stripped.append(option)
+    return stripped + ['--no-continue']
+
+def segmented_download_exit_code(line):
+    """
+    Returns aria2c's exit code if a yt-dlp error line reports that aria2c failed, otherwise None.
+    """
+    match = re.search(r'aria2c exited with code (\d+)', line)
+    return int(match.group(1)) if match else None
+
+def monitored_download(backend, options, url, on_error=None, on_progress=None, label=None, show=True):
+    """
+    Runs backend.download under a ProgressMonitor. A stalled download is killed and started
+    again up to STALL_MAX_RESTARTS times; yt-dlp resumes it from the partial file, and YouTube
+    downloads switch to the next player client in STALL_PLAYER_CLIENTS. aria2c detects stalls of
+    segmented downloads itself; its stall exits (ARIA2C_STALL_EXIT_CODES) are restarted the same
+    way and resume from its control file. If aria2c fails otherwise, the file is downloaded again
+    over one connection by yt-dlp itself.
+
+    Args:
+        backend: The yt-dlp backend to use.
+        options (list): yt-dlp command line options.
+        url (str): The URL to download.
+        on_error (callable, optional): Called with every error line, as for backend.download.
+        on_progress (callable, optional): Called with every progress event (see ProgressMonitor).
+        label (str, optional): Name of the download in events and console lines.
+        show (bool, optional): Print progress lines to the console. Defaults to True.
+
+    Returns:
+        int: yt-dlp's exit code of the last attempt.
+    """
+    monitor = ProgressMonitor(label, on_progress, show)
+    while True:
+        cancel = []
+        finished = threading.Event()
+        stalled = threading.Event()
+        segmented_failures = []
 
-    if username and password:
-        base_command.extend(['--username', username, '--password', password])
-    if cookie_file:
-        base_command.extend(['--cookies', cookie_file])
+        def collect(line):
+            exit_code = segmented_download_exit_code(line)
+            if exit_code is not None:
+                segmented_failures.append(exit_code)
+            if on_error:
+                on_error(line)
 
-    if "youtube.com" in url or "youtu.be" in url:
-        yt_player_clients_to_try = [
-            'youtube',
-            'youtube:player_client=android',
-            'youtube:player_client=web',
-            'youtube:player_client=web_public',
-            'youtube:player_client=ios'
-        ]
+        def watchdog():
+            while not finished.wait(1.0):
+                if monitor.stalled():
+                    stalled.set()
+                    if cancel:
+                        cancel[0]()
+                    return
 
-        for extractor_arg in yt_player_clients_to_try:
-            current_command = base_command + ['--extractor-args', extractor_arg]
-            try:
-                print(f"Attempting to fetch media info with {extractor_arg} extractor...")
-                result = subprocess.run(
-                    current_command,
-                    check=True,
-                    capture_output=True,
-                    text=True,
-                    encoding='utf-8'
-                )
-                info = json.loads(result.stdout)
-                
-                if DEBUG_MODE:
-                    print(f"--- DEBUG: Raw info from yt-dlp (Extractor: {extractor_arg}): {json.dumps(info, indent=2)}")
-                
-                return info, None
-            except (subprocess.CalledProcessError, json.JSONDecodeError, Exception) as e:
-                print(f"Failed with {extractor_arg} extractor: {e}")
-                if extractor_arg == yt_player_clients_to_try[-1]:
-                    print("All YouTube-specific extractors failed. Falling back to generic extractor...")
-                else:
-                    print("Trying next YouTube extractor...")
-                pass
+        watcher = threading.Thread(target=watchdog, daemon=True)
+        watcher.start()
+        try:
+            returncode = backend.download(options, url, on_error=collect, on_progress=monitor.update, on_start=cancel.append)
+        finally:
+            finished.set()
+            watcher.join()
+        name = f" ({label})" if label else ""
+        if returncode != 0 and segmented_failures and all(code in ARIA2C_STALL_EXIT_CODES for code in segmented_failures):
+            stalled.set()
+        elif returncode != 0 and segmented_failures and 'http:aria2c' in options:
+            print(f"Warning: The segmented download{name} failed; downloading it again over one connection.")
+            options = without_segmented_downloader(options)
+            monitor.restart()
+            monitor.emit('restart')
+            continue
+        if not stalled.is_set() or returncode == 0:
+            monitor.emit('done', returncode=returncode)
+            return returncode
 
-    generic_command = base_command + ['--extractor-args', 'generic:impersonate']
-    try:
-        print("Attempting to fetch media info with generic:impersonate extractor...")
-        result = subprocess.run(
-            generic_command,
-            check=True,
-            capture_output=True,
-            text=True,
-            encoding='utf-8'
-        )
-        info = json.loads(result.stdout)
-        
-        if DEBUG_MODE:
-            print(f"--- DEBUG: Raw info from yt-dlp (Extractor: generic:impersonate): {json.dumps(info, indent=2)}")
-        
-        return info, None
-    except subprocess.CalledProcessError as e:
-        return None, f"Error fetching media info: {e.stderr}"
-    except json.JSONDecodeError:
-        return None, "Error parsing media info: Invalid JSON response from yt-dlp."
-    except Exception as e:
-        return None, f"An unexpected error occurred: {e}"
+        monitor.emit('stall', returncode=returncode)
+        if monitor.restarts >= STALL_MAX_RESTARTS:
+            print(f"Warning: The download{name} stalled {monitor.restarts + 1} times, giving up.")
+            monitor.emit('done', returncode=returncode)
+            return returncode
+        monitor.restarts += 1
+        switched = next_player_client(options)
+        client = f" with player client {switched[switched.index('--extractor-args') + 1].split('=', 1)[1]}" if switched != options else ""
+        print(f"Warning: The download{name} stalled below {monitor.min_speed // 1024} KB/s for {monitor.window:.0f}s; "
+              f"resuming it{client} (restart {monitor.restarts}/{STALL_MAX_RESTARTS}).")
+        options = [option for option in switched if option != '--no-continue']
+        monitor.restart()
+        monitor.emit('restart')
 
-def get_available_video_formats(info):
+def authenticated_download(backend, options, url, output_dir, username=None, password=None, cookie_file=None, save_cookies_to=None, on_error=None, on_progress=None, label=None, show=True):
     """
-    Extracts and formats available video resolutions from the yt-dlp info dictionary.
-    
+    Runs monitored_download with the login options of the account's session (see auth_options),
+    so in steady state only the saved cookies are sent. A rejected session is logged in again
+    once. After a successful download with credentials, the session's cookies are also copied
+    to save_cookies_to, so they can be used as a cookie file later.
+
     Args:
-        info (dict): The yt-dlp info dictionary for the media.
+        output_dir (str): Directory holding the SESSION_DIR of the sessions.
+        username, password, cookie_file, save_cookies_to: Same as for download_media.
+        backend, options, url, on_error, on_progress, label, show: Same as for monitored_download.
 
     Returns:
-        list: A list of tuples (display_name, yt_dlp_format_string) for available options.
-              Sorted by height in descending order, with a fallback "Best available" option.
+        int: yt-dlp's exit code of the last attempt.
     """
-    options = []
-    unique_heights = set()
+    for _ in range(2):
+        with auth_options(url, username, password, cookie_file, output_dir, backend) as (auth, outcome):
+            def collect(line):
+                outcome['errors'].append(line)
+                if on_error:
+                    on_error(line)
+
+            returncode = monitored_download(backend, options + auth, url, collect, on_progress, label, show)
+        if not outcome.get('expired'):
+            break
+        print("The saved login session was rejected. Logging in again...")
+    if returncode == 0 and username and password and save_cookies_to:
+        session = get_auth_session(url, username, output_dir)
+        with session.lock, contextlib.suppress(OSError):
+            shutil.copyfile(session.path, save_cookies_to)
+    return returncode
+
+def build_download_options(url, format_string, output_dir, media_type, playlist_items=None, manifest_path=None):
+    """
+    Builds the yt-dlp options (without the URL) for downloading media.
+    Takes the same arguments as download_media, plus manifest_path: a file yt-dlp appends
+    the final path of every produced file to (see read_output_manifest). Login options are
+    added per run by authenticated_download.
 
-    for f in info.get('formats', []):
-        if f.get('vcodec') != 'none' and f.get('height'):
-            height = f['height']
-            unique_heights.add(height)
+    Returns:
+        list: yt-dlp command line options.
+    """
+    output_template = os.path.join(output_dir, '%(title)s.%(ext)s')
+    options = []
     
-    for height in sorted(list(unique_heights), reverse=True):
-        format_string = f"bestvideo[height={height}]+bestaudio/best[height={height}]"
-        options.append((f"{height}p", format_string))
+    if media_type == 'video':
+        options.extend(['-f', format_string])
+    elif media_type == 'audio':
+        options.extend(['-x', '--audio-format', 'mp3', '--audio-quality', '0'])
+        output_template = os.path.join(output_dir, '%(title)s.mp3')
     
-    if info.get('_type') == 'video' and not options:
-        options.append(("Best available quality", "best"))
+    if playlist_items:
+        options.extend(['--playlist-items', playlist_items])
+
+    if manifest_path:
+        options.extend(['--print-to-file', OUTPUT_MANIFEST_TEMPLATE, manifest_path])
     
+    options.extend([
+        '-o', output_template,
+        '--progress',
+        '--extractor-retries', '3',
+        '--socket-timeout', '10',
+        '--fragment-retries', '10',
+    ])
+    options.extend(segmented_download_options())
+
+    if "youtube.com" in url or "youtu.be" in url:
+        options.extend(['--extractor-args', 'youtube:player_client=android'])
+    else:
+        options.extend(['--extractor-args', 'generic:impersonate'])
+
     return options
 
-def download_media(url, format_string, output_dir, media_type, playlist_items=None, username=None, password=None, cookie_file=None, save_cookies_to=None):
+def download_media(url, format_string, output_dir, media_type, playlist_items=None, username=None, password=None, cookie_file=None, save_cookies_to=None, backend=None, info=None, on_progress=None):
     """
     Downloads media (video or audio) using yt-dlp.
-    Streams yt-dlp's progress directly to the console.
+    Shows the moving-average speed and ETA on the console and restarts stalled transfers
+    (see monitored_download).
+    Playlist items are downloaded in a single yt-dlp run; use download_playlist to
+    download them concurrently with per-host rate control.
+    Produced files are recorded in the download archive; when info is given and the
+    video is already in the archive, the download is skipped without any network access.
    
     Args:
         url (str): The URL of the media to download.
@@ -173,118 +2175,906 @@ def download_media(url, format_string, output_dir, media_type, playlist_items=No
         password (str, optional): Password for login. Defaults to None.
         cookie_file (str, optional): Path to a cookie file. Defaults to None.
         save_cookies_to (str, optional): Path to save cookies after successful login. Defaults to None.
+        backend (optional): The yt-dlp backend to use. Defaults to get_yt_dlp_backend().
+        info (dict, optional): The media info from get_media_info, used for the archive check.
+        on_progress (callable, optional): Called with every progress event (see ProgressMonitor).
 
     Returns:
-        list: List of paths to downloaded files, or empty list if download fails.
+        list: List of paths to the files of this download (exactly the files yt-dlp produced,
+              or the archived file if it was skipped), or empty list if download fails.
     """
-    output_template = os.path.join(output_dir, '%(title)s.%(ext)s')
-    downloaded_files = []
-    
-    command = ['yt-dlp']
-    
-    if media_type == 'video':
-        command.extend(['-f', format_string])
-    elif media_type == 'audio':
-        command.extend(['-x', '--audio-format', 'mp3', '--audio-quality', '0'])
-        output_template = os.path.join(output_dir, '%(title)s.mp3')
-    
-    if username and password:
-        command.extend(['--username', username, '--password', password])
-        if save_cookies_to:
-            command.extend(['--write-cookies', save_cookies_to])
-    elif cookie_file:
-        command.extend(['--cookies', cookie_file])
+    if backend is None:
+        backend = get_yt_dlp_backend()
 
-    if playlist_items:
-        command.extend(['--playlist-items', playlist_items])
-        command.extend(['--sleep-interval', '5'])
-        command.extend(['--throttled-rate', '500K'])
-        print("\nNote: For playlists, a 5-second delay is added between videos, and the download rate is limited to 500KB/s to help avoid rate-limiting issues.")
-    
-    command.extend([
-        '-o', output_template,
-        '--progress',
-        '--extractor-retries', '3',
-        '--socket-timeout', '10',
-        '--fragment-retries', '10',
-        url
-    ])
+    variant = archive_variant(media_type, format_string)
+    if info and not playlist_items and info.get('_type', 'video') == 'video':
+        existing = archive_lookup(output_dir, info.get('extractor_key'), info.get('id'), variant)
+        if existing:
+            print(f"\nAlready downloaded, skipping: {existing}")
+            record_span('download', 0.0, output_dir, media_type=media_type, outcome='skipped')
+            return [existing]
 
-    if "youtube.com" in url or "youtu.be" in url:
-        command.extend(['--extractor-args', 'youtube:player_client=android'])
-    else:
-        command.extend(['--extractor-args', 'generic:impersonate'])
+    manifest_path = new_manifest_path(output_dir)
+    options = build_download_options(url, format_string, output_dir, media_type, playlist_items, manifest_path)
 
-    try:
-        print(f"\nStarting {media_type} download from: {url}")
-        if playlist_items:
-            print(f"Selected playlist items: {playlist_items}")
-            print("Note: Downloading playlists may encounter issues due to rate-limiting protections. If this fails, consider downloading individual items.")
-        print(f"Saving to: {output_dir}")
+    with span('download', output_dir, media_type=media_type, host=urllib.parse.urlsplit(url).hostname) as trace:
+        try:
+            print(f"\nStarting {media_type} download from: {url}")
+            if playlist_items:
+                print(f"Selected playlist items: {playlist_items}")
+                print("Note: Downloading playlists may encounter issues due to rate-limiting protections. If this fails, consider downloading individual items.")
+            print(f"Saving to: {output_dir}")
        
-        process = subprocess.Popen(command, stdout=sys.stdout, stderr=sys.stderr)
-        process.wait()
+            returncode = authenticated_download(backend, options, url, output_dir, username, password, cookie_file,
+                                                save_cookies_to, on_progress=on_progress)
+            produced = read_output_manifest(manifest_path)
+            archive_record(output_dir, variant, produced)
+            trace['bytes'] = sum(os.path.getsize(filepath) for _, _, filepath in produced)
        
-        if process.returncode == 0:
-            print(f"\n{media_type.capitalize()} download completed successfully!")
-            if media_type == 'audio':
-                if playlist_items:
-                    for idx in parse_selection(playlist_items, 9999).split(',') if playlist_items else ['']:
-                        for f in os.listdir(output_dir):
-                            if f.endswith('.mp3') and os.path.isfile(os.path.join(output_dir, f)):
-                                downloaded_files.append(os.path.join(output_dir, f))
-                else:
-                    for f in os.listdir(output_dir):
-                        if f.endswith('.mp3') and os.path.isfile(os.path.join(output_dir, f)):
-                            downloaded_files.append(os.path.join(output_dir, f))
+            if returncode == 0 and not produced:
+                print("\nyt-dlp finished without producing a file (already downloaded or skipped by yt-dlp).")
+                trace['outcome'] = 'no_file'
+            elif returncode == 0:
+                print(f"\n{media_type.capitalize()} download completed successfully!")
+            else:
+                print(f"\nError during {media_type} download. yt-dlp returned error code {returncode}.")
+                print("Please verify the URL, your internet connection, and ensure dependencies (ffmpeg, httpx, h2) are installed.")
+                if username and password:
+                    print("Additionally, please check your login credentials for accuracy.")
+                trace['outcome'] = 'failed'
+                return []
+           
+        except FileNotFoundError:
+            read_output_manifest(manifest_path)
+            trace['outcome'] = 'failed'
+            print("Error: yt-dlp is not installed or not found in your system's PATH.")
+            if media_type == 'audio' or media_type == 'video':
+                print("For audio or certain video formats, ffmpeg is also required. Install it with: pkg install ffmpeg")
+            return []
+        except Exception as e:
+            read_output_manifest(manifest_path)
+            trace['outcome'] = 'failed'
+            print(f"An unexpected error occurred during {media_type} download: {e}")
+            return []
+    
+        return [filepath for _, _, filepath in produced]
+
+class HostRateController:
+    """
+    Adaptive pacing for one host, shared by every playlist job that downloads from it.
+
+    Uses additive-increase/multiplicative-decrease: a 403/429 response halves the number of
+    concurrent downloads and the rate limit and doubles the delay between download starts;
+    every clean download ramps them back up towards the host's configured limits (the delay
+    never drops below the host's HOST_START_DELAYS entry).
+    """
+
+    def __init__(self, host):
+        self.host = host
+        self.max_concurrency = HOST_CONCURRENCY.get(host, DEFAULT_HOST_CONCURRENCY)
+        self.concurrency = self.max_concurrency
+        self.min_delay = HOST_START_DELAYS.get(host, DEFAULT_START_DELAY)
+        self.delay = self.min_delay
+        self.rate_limit = None  # Bytes per second, or None for unlimited
+        self.active = 0
+        self.next_start = 0.0
+
+    def can_start(self, now):
+        return self.active < self.concurrency and now >= self.next_start
+
+    def ready(self, now):
+        """
+        Returns the seconds until the next download on this host may start (0 if one may
+        start now), or None while all of the host's download slots are busy.
+        """
+        if self.active >= self.concurrency:
+            return None
+        return max(0.0, self.next_start - now)
+
+    def started(self, now):
+        self.active += 1
+        self.next_start = now + self.delay
+
+    def finished(self, throttled):
+        self.active -= 1
+        if throttled:
+            self.concurrency = max(1, self.concurrency // 2)
+            self.delay = min(MAX_START_DELAY, max(self.delay * 2, THROTTLE_MIN_DELAY))
+            self.rate_limit = THROTTLE_START_RATE if self.rate_limit is None else max(MIN_RATE_LIMIT, self.rate_limit // 2)
+            print(f"[scheduler] {self.host} is rate-limiting us: {self.concurrency} at a time, "
+                  f"{self.delay:.0f}s apart, limited to {self.rate_limit // 1024}K/s.")
         else:
-            print(f"\nError during {media_type} download. yt-dlp returned error code {process.returncode}.")
-            print("Please verify the URL, your internet connection, and ensure dependencies (ffmpeg, httpx, h2) are installed.")
-            if username and password:
-                print("Additionally, please check your login credentials for accuracy.")
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+            # Decay back towards the host's configured spacing, never below it.
+            self.delay = max(self.min_delay, self.delay * 0.75 if self.delay * 0.75 >= 0.5 else 0.0)
+            if self.rate_limit is not None:
+                self.rate_limit *= 2
+                if self.rate_limit > MAX_RATE_LIMIT:
+                    self.rate_limit = None
+
+    def options(self):
+        """
+        Returns the yt-dlp options for the current rate limit. A rate-limited host also gets
+        only one connection per download.
+        """
+        if not self.rate_limit:
             return []
-           
-    except FileNotFoundError:
-        print("Error: yt-dlp is not installed or not found in your system's PATH.")
-        if media_type == 'audio' or media_type == 'video':
-            print("For audio or certain video formats, ffmpeg is also required. Install it with: pkg install ffmpeg")
-        return []
-    except Exception as e:
-        print(f"An unexpected error occurred during {media_type} download: {e}")
-        return []
+        return ['--limit-rate', str(self.rate_limit)] + segmented_download_options(connections=1)
+
+def is_throttle_error(line):
+    """
+    Returns True if a yt-dlp error line reports that the server is rate-limiting or blocking us.
+    """
+    return any(marker in line for marker in THROTTLE_MARKERS)
+
+def playlist_job_target(url, entries, index):
+    """
+    Returns (entry, job_url, playlist_items) for downloading one playlist item on its own:
+    the entry's own URL, or the playlist URL restricted to the item if the entry has none.
+    """
+    entry = (entries[index - 1] if index <= len(entries) else None) or {}
+    job_url = entry.get('webpage_url') or entry.get('url')
+    if not job_url or not job_url.startswith(('http://', 'https://')):
+        return entry, url, str(index)
+    return entry, job_url, None
+
+def download_playlist(url, entries, playlist_items, format_string, output_dir, media_type, username=None, password=None, cookie_file=None, save_cookies_to=None, backend=None, workers=None, on_progress=None):
+    """
+    Downloads playlist items as separate jobs on a worker pool, with per-host concurrency
+    caps and adaptive delay/rate control (see HostRateController). Stalled jobs are restarted
+    (see monitored_download).
+    Failed jobs that were throttled are retried up to PLAYLIST_JOB_ATTEMPTS times.
+    Items already in the download archive are skipped without any network access.
+
+    Args:
+        url (str): The URL of the playlist.
+        entries (list): The playlist entries from get_media_info (may contain None).
+        playlist_items (str): Selected item numbers as returned by parse_selection, or None for all.
+        format_string, output_dir, media_type, username, password, cookie_file, save_cookies_to:
+            Same as for download_media.
+        backend (optional): The yt-dlp backend to use. Defaults to get_yt_dlp_backend().
+        workers (int, optional): Maximum number of concurrent downloads. Defaults to PLAYLIST_WORKERS.
+        on_progress (callable, optional): Called with every progress event of every job (see
+            ProgressMonitor), with the item number added as 'playlist_index'.
+
+    Returns:
+        list: Paths of the files of the selected items (produced or already archived), in playlist order.
+    """
+    if backend is None:
+        backend = get_yt_dlp_backend()
+    workers = workers or PLAYLIST_WORKERS
+
+    if playlist_items:
+        indices = [int(idx) for idx in playlist_items.split(',')]
+    else:
+        indices = list(range(1, len(entries) + 1))
+
+    variant = archive_variant(media_type, format_string)
+    files_by_index = {}
+    jobs = collections.deque()
+    for index in indices:
+        entry, job_url, items = playlist_job_target(url, entries, index)
+        existing = archive_lookup(output_dir, entry.get('extractor_key') or entry.get('ie_key'), entry.get('id'), variant)
+        if existing:
+            files_by_index[index] = [existing]
+            continue
+        manifest_path = new_manifest_path(output_dir)
+        options = build_download_options(job_url, format_string, output_dir, media_type, items, manifest_path)
+        jobs.append({
+            'index': index,
+            'title': entry.get('title') or f"item {index}",
+            'url': job_url,
+            'options': options,
+            'manifest': manifest_path,
+            'host': urllib.parse.urlsplit(normalize_url(job_url)).hostname or '',
+            'attempts': 0,
+        })
+    if files_by_index:
+        print(f"\nSkipping {len(files_by_index)} items that are already downloaded.")
+
+    controllers = {}
+    results = queue.Queue()
+    running = 0
+    total = len(jobs)
+    succeeded = []
+    failed = []
+    transferred = 0
+    started = time.monotonic()
+
+    def run_job(job, options):
+        errors = []
+        try:
+            forward = (lambda event: on_progress(dict(event, playlist_index=job['index']))) if on_progress else None
+            returncode = authenticated_download(backend, options, job['url'], output_dir, username, password, cookie_file,
+                                                save_cookies_to, errors.append, forward, f"{job['index']}. {job['title']}",
+                                                show=workers == 1)
+        except FileNotFoundError:
+            errors.append("yt-dlp is not installed or not found in your system's PATH.")
+            returncode = 1
+        except Exception as e:
+            errors.append(f"An unexpected error occurred: {e}")
+            returncode = 1
+        results.put((job, returncode, any(is_throttle_error(line) for line in errors), errors))
+
+    print(f"\nDownloading {total} playlist items with up to {workers} at a time. Saving to: {output_dir}")
+    while jobs or running:
+        now = time.monotonic()
+        for job in list(jobs):
+            if running >= workers:
+                break
+            controller = controllers.setdefault(job['host'], HostRateController(job['host']))
+            if controller.can_start(now):
+                jobs.remove(job)
+                controller.started(now)
+                job['attempts'] += 1
+                job['started'] = time.monotonic()
+                running += 1
+                print(f"[scheduler] Starting {job['index']}. {job['title']}")
+                threading.Thread(target=run_job, args=(job, job['options'] + controller.options()), daemon=True).start()
+
+        waits = [controllers[job['host']].ready(now) for job in jobs if job['host'] in controllers]
+        waits = [wait for wait in waits if wait is not None]
+        timeout = max(0.1, min(waits)) if waits and running < workers else None
+        try:
+            job, returncode, throttled, errors = results.get(timeout=timeout)
+        except queue.Empty:
+            continue
+        running -= 1
+        controllers[job['host']].finished(throttled)
+        produced = read_output_manifest(job['manifest'])
+        archive_record(output_dir, variant, produced)
+        files_by_index.setdefault(job['index'], []).extend(filepath for _, _, filepath in produced)
+        produced_bytes = sum(os.path.getsize(filepath) for _, _, filepath in produced)
+        transferred += produced_bytes
+        record_span('download', time.monotonic() - job['started'], output_dir, media_type=media_type, host=job['host'],
+                    playlist_index=job['index'], bytes=produced_bytes,
+                    outcome=('ok' if produced else 'no_file') if returncode == 0 else ('throttled' if throttled else 'failed'))
+
+        if returncode == 0:
+            succeeded.append(job)
+        elif throttled and job['attempts'] < PLAYLIST_JOB_ATTEMPTS:
+            print(f"[scheduler] {job['index']}. {job['title']} was throttled, retrying later.")
+            jobs.append(job)
+            continue
+        else:
+            failed.append(job)
+            print(f"[scheduler] Failed {job['index']}. {job['title']}: {errors[-1] if errors else f'error code {returncode}'}")
+
+        elapsed = time.monotonic() - started
+        done = len(succeeded) + len(failed)
+        print(f"[scheduler] {done}/{total} done, {running} running, {len(jobs)} queued, "
+              f"{done / elapsed * 60:.1f} items/min")
+
+    elapsed = time.monotonic() - started
+    print(f"\nPlaylist finished: {len(succeeded)} downloaded, {len(failed)} failed in {elapsed:.0f}s "
+          f"({transferred / max(elapsed, 0.001) / 1024:.0f} KB/s on average).")
+    if failed:
+        print("Failed items: " + ",".join(str(job['index']) for job in sorted(failed, key=lambda job: job['index'])))
+
+    return [filepath for index in sorted(files_by_index) for filepath in files_by_index[index]]
+
+def split_audio_by_chunk(audio_file, output_dir, chunk_length_ms, sample_accurate=False):
+    """
+    Splits an audio file into equal chunks of specified length.
+
+    By default the chunks are cut by ffmpeg's segment muxer with stream copy: cuts land on
+    the nearest MP3 frame boundary and nothing is decoded or re-encoded, so memory use stays
+    constant however long the input is. With sample_accurate=True every chunk is decoded and
+    cut at sample offsets instead of frame boundaries (after a fast seek, see
+    export_audio_pieces), then re-encoded in parallel by export_chunks.
     
-    return downloaded_files
+    Args:
+        audio_file (str): Path to the audio file to split.
+        output_dir (str): Directory to save split chunks.
+        chunk_length_ms (int): Length of each chunk in milliseconds.
+        sample_accurate (bool, optional): Decode and cut between MP3 frames. Defaults to False.
+
+    Returns:
+        list: Paths of the chunks written, or empty list if splitting failed.
+    """
+    with trace_to(output_dir):
+        if not sample_accurate:
+            return split_audio_by_chunk_streaming(audio_file, output_dir, chunk_length_ms)
+
+        try:
+            print(f"Splitting audio into chunks of {chunk_length_ms / 60000:.1f} minutes (decoding the cuts)...")
+            chunk_dir = os.path.join(output_dir, "split_chunks")
+            os.makedirs(chunk_dir, exist_ok=True)
+
+            duration_ms, frame_rate = probe_audio(audio_file)
+            ms_frames = frame_rate / 1000.0
+            chunks = [
+                [[int(i * ms_frames), int((i + chunk_length_ms) * ms_frames)]]
+                for i in range(0, duration_ms, chunk_length_ms)
+            ]
+            # The probed duration can be a few milliseconds off, so the last chunk runs to the end.
+            chunks[-1][0][1] = None
+
+            chunk_names = export_chunks(audio_file, chunks, frame_rate, chunk_dir)
+            print(f"\nAudio successfully split into {len(chunk_names)} chunks in: {chunk_dir}")
+            return chunk_names
+        except Exception as e:
+            print(f"Error splitting audio by chunk length: {e}")
+            return []
 
-def split_audio_by_chunk(audio_file, output_dir, chunk_length_ms):
+def split_audio_by_chunk_streaming(audio_file, output_dir, chunk_length_ms):
     """
-    Splits an audio file into equal chunks of specified length using pydub.
+    Splits an audio file into chunks with ffmpeg's segment muxer, copying the audio stream
+    without decoding it. Chunks are named like the pydub path: <name>_chunkN.mp3.
     
     Args:
         audio_file (str): Path to the audio file to split.
         output_dir (str): Directory to save split chunks.
         chunk_length_ms (int): Length of each chunk in milliseconds.
+
+    Returns:
+        list: Paths of the chunks written, or empty list if splitting failed.
     """
+    started = time.perf_counter()
     try:
         print(f"Splitting audio into chunks of {chunk_length_ms / 60000:.1f} minutes...")
         chunk_dir = os.path.join(output_dir, "split_chunks")
         os.makedirs(chunk_dir, exist_ok=True)
 
-        audio = AudioSegment.from_file(audio_file)
-        duration_ms = len(audio)
-        chunks = [audio[i:i + chunk_length_ms] for i in range(0, duration_ms, chunk_length_ms)]
+        base_name = os.path.splitext(os.path.basename(audio_file))[0]
+        chunk_pattern = os.path.join(chunk_dir, base_name.replace('%', '%%') + "_chunk%d.mp3")
+        result = subprocess.run(
+            [
+                'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+                '-i', audio_file,
+                '-map', '0:a', '-c', 'copy',
+                '-f', 'segment',
+                '-segment_time', f"{chunk_length_ms / 1000:.3f}",
+                '-segment_start_number', '1',
+                '-reset_timestamps', '1',
+                '-segment_list', 'pipe:1', '-segment_list_type', 'flat',
+                chunk_pattern
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+            encoding='utf-8'
+        )
+
+        chunk_names = [line.strip() for line in result.stdout.splitlines() if line.strip()]
+        chunk_bytes = 0
+        for chunk_name in chunk_names:
+            chunk_path = os.path.join(chunk_dir, os.path.basename(chunk_name))
+            chunk_bytes += os.path.getsize(chunk_path) if os.path.isfile(chunk_path) else 0
+            print(f"Saved chunk: {chunk_path}")
+        record_span('chunk_export', time.perf_counter() - started, output_dir, file=os.path.basename(audio_file),
+                    mode='stream_copy', chunks=len(chunk_names), bytes=chunk_bytes)
+
+        print(f"\nAudio successfully split into {len(chunk_names)} chunks in: {chunk_dir}")
+        return [os.path.join(chunk_dir, os.path.basename(chunk_name)) for chunk_name in chunk_names]
+    except subprocess.CalledProcessError as e:
+        print(f"Error splitting audio by chunk length: {e.stderr.strip()}")
+    except FileNotFoundError:
+        print("Error splitting audio by chunk length: ffmpeg is not installed. Install it with: pkg install ffmpeg")
+    except Exception as e:
+        print(f"Error splitting audio by chunk length: {e}")
+    return []
+
+def open_pcm_stream(audio_file):
+    """
+    Starts ffmpeg decoding an audio file to 16-bit PCM WAV on a pipe and reads the WAV header.
+
+    Returns:
+        tuple: (ffmpeg process positioned at the start of the sample data, frame rate, channels)
+
+    Raises:
+        ValueError: If ffmpeg cannot decode the file.
+    """
+    process = subprocess.Popen(
+        ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-i', audio_file,
+         '-vn', '-f', 'wav', '-acodec', 'pcm_s16le', 'pipe:1'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    )
+    stream = process.stdout
+    frame_rate = channels = None
+    header = stream.read(12)
+    if len(header) == 12 and header[:4] == b'RIFF' and header[8:12] == b'WAVE':
+        chunk_header = stream.read(8)
+        while len(chunk_header) == 8 and chunk_header[:4] != b'data':
+            size = struct.unpack('<I', chunk_header[4:])[0]
+            body = stream.read(size + (size & 1))
+            if chunk_header[:4] == b'fmt ':
+                channels, frame_rate = struct.unpack('<HI', body[2:8])
+            chunk_header = stream.read(8)
+        if chunk_header[:4] == b'data' and frame_rate:
+            return process, frame_rate, channels
+
+    process.kill()
+    stderr = process.communicate()[1].decode('utf-8', errors='replace').strip()
+    raise ValueError(f"ffmpeg could not decode {audio_file}: {stderr or 'no audio stream found'}")
+
+def decode_ms_energy(audio_file, on_bins):
+    """
+    Decodes an audio file with ffmpeg in SILENCE_BLOCK_FRAMES blocks and passes the sum of
+    squared samples of every millisecond, and the number of samples in it, to
+    on_bins(energy, count) as numpy int64 arrays, block by block. Millisecond boundaries follow
+    pydub's AudioSegment slicing; milliseconds past the end of the data are padded with silence.
+
+    Returns:
+        tuple: (length in ms, frame rate, channels, frame count, seconds spent waiting for ffmpeg)
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    process, frame_rate, channels = open_pcm_stream(audio_file)
+    decode_seconds = time.perf_counter() - started
+    decoded = 0
+    ms_frames = frame_rate / 1000.0  # pydub's AudioSegment.frame_count(ms=1)
+    carry = np.zeros(0, dtype=np.int64)  # Per-frame energy of frames not yet in a complete millisecond
+    carry_start = 0  # Frame index of carry[0]
+    next_ms = 0
+
+    try:
+        while True:
+            read_started = time.perf_counter()
+            data = process.stdout.read(SILENCE_BLOCK_FRAMES * 2 * channels)
+            decode_seconds += time.perf_counter() - read_started
+            decoded += len(data)
+            if not data:
+                break
+            samples = np.frombuffer(data[:len(data) - len(data) % (2 * channels)], dtype='<i2').astype(np.int64)
+            frame_energy = (samples * samples).reshape(-1, channels).sum(axis=1)
+            carry = np.concatenate((carry, frame_energy))
+            available = carry_start + len(carry)
+
+            bounds = (np.arange(next_ms, next_ms + int(len(carry) / ms_frames) + 3) * ms_frames).astype(np.int64)
+            complete = int(np.searchsorted(bounds, available, side='right')) - 1
+            if complete > 0:
+                offsets = bounds[:complete + 1] - carry_start
+                energy_sums = np.concatenate(([0], np.cumsum(carry)))
+                on_bins(energy_sums[offsets[1:]] - energy_sums[offsets[:-1]], np.diff(offsets) * channels)
+                next_ms += complete
+                carry = carry[offsets[-1]:]
+                carry_start = int(bounds[complete])
+    finally:
+        process.stdout.close()
+        process.wait()
+
+    total_frames = carry_start + len(carry)
+    length_ms = round(1000 * (float(total_frames) / frame_rate))  # len(AudioSegment)
+    if next_ms < length_ms:
+        # Trailing milliseconds; pydub pads frames past the end of the data with silence.
+        bounds = (np.arange(next_ms, length_ms + 1) * ms_frames).astype(np.int64)
+        offsets = np.minimum(bounds, total_frames) - carry_start
+        energy_sums = np.concatenate(([0], np.cumsum(carry)))
+        on_bins(energy_sums[offsets[1:]] - energy_sums[offsets[:-1]], np.diff(bounds) * channels)
+
+    record_span('decode', decode_seconds, file=os.path.basename(audio_file), bytes=decoded)
+    return length_ms, frame_rate, channels, total_frames, decode_seconds
+
+def detect_silent_ranges(audio_file, min_silence_len=1000, silence_thresh=-16):
+    """
+    Streaming, NumPy-vectorized equivalent of pydub.silence.detect_silence (seek_step=1).
+
+    The file is decoded block by block (see decode_ms_energy). Per-millisecond sums of squared
+    samples are kept only for the last min_silence_len milliseconds, so memory does not grow
+    with the length of the file. Millisecond boundaries, the RMS of each window and the merging
+    of overlapping silent windows follow pydub exactly.
+
+    Returns:
+        tuple: (list of [start_ms, end_ms] silent ranges, length in ms, frame rate, frame count)
+    """
+    import numpy as np
+
+    started = time.perf_counter()
+    threshold = (10 ** (silence_thresh / 20)) * 32768.0  # db_to_float(thresh) * max amplitude of 16-bit audio
+    window = max(1, int(min_silence_len))
+
+    silent_ranges = []
+    open_range = None
+    hist_energy = np.zeros(0, dtype=np.int64)
+    hist_count = np.zeros(0, dtype=np.int64)
+    hist_start = 0  # Millisecond index of hist_energy[0]
+
+    def add_bins(energy, count):
+        nonlocal hist_energy, hist_count, hist_start, open_range
+        energy = np.concatenate((hist_energy, energy))
+        count = np.concatenate((hist_count, count))
+        if len(energy) >= window:
+            energy_sums = np.concatenate(([0], np.cumsum(energy)))
+            count_sums = np.concatenate(([0], np.cumsum(count)))
+            window_energy = (energy_sums[window:] - energy_sums[:-window]).astype(np.float64)
+            window_count = count_sums[window:] - count_sums[:-window]
+            rms = np.floor(np.sqrt(window_energy / np.maximum(window_count, 1)))
+            starts = hist_start + np.nonzero(rms <= threshold)[0]
+            if len(starts):
+                breaks = np.nonzero(starts[1:] > starts[:-1] + window)[0]
+                range_starts = starts[np.concatenate(([0], breaks + 1))]
+                range_ends = starts[np.concatenate((breaks, [len(starts) - 1]))] + window
+                for start, end in zip(range_starts.tolist(), range_ends.tolist()):
+                    if open_range is not None and start <= open_range[1]:
+                        open_range[1] = end
+                    else:
+                        if open_range is not None:
+                            silent_ranges.append(open_range)
+                        open_range = [start, end]
+            keep = window - 1
+            hist_start += len(energy) - keep
+            hist_energy, hist_count = energy[len(energy) - keep:], count[len(count) - keep:]
+        else:
+            hist_energy, hist_count = energy, count
+
+    length_ms, frame_rate, _, total_frames, decode_seconds = decode_ms_energy(audio_file, add_bins)
+    if open_range is not None:
+        silent_ranges.append(open_range)
+
+    # Time spent waiting for ffmpeg is decoding; the rest is the detection itself.
+    record_span('silence_detection', time.perf_counter() - started - decode_seconds,
+                file=os.path.basename(audio_file), ranges=len(silent_ranges), length_ms=length_ms)
+    return silent_ranges, length_ms, frame_rate, total_frames
+
+class LoudnessIndex:
+    """
+    Loudness envelope of an audio file, kept in a cache so that silence detection with any
+    settings is answered without decoding the file again.
+
+    The cache directory holds, per file, <key>.loudness with the sum of squared samples of
+    every LOUDNESS_INDEX_BIN_MS milliseconds (little-endian float32) and <key>.loudness.json
+    with the audio format and the file's path, size, mtime and SHA-256. An index stays valid
+    while the size matches and either the mtime or, for a touched file, the hash does.
+    Windows are evaluated like detect_silent_ranges does, with starts and lengths rounded to
+    whole bins, so silent ranges are found to within one bin of it.
+    """
+    VERSION = 2
+
+    def __init__(self, audio_file, cache_dir=None):
+        self.audio_file = audio_file
+        self.cache_dir = os.path.join(cache_dir or get_output_dir(), LOUDNESS_INDEX_DIR)
+        key = hashlib.sha256(os.path.realpath(audio_file).encode('utf-8')).hexdigest()[:32]
+        self.path = os.path.join(self.cache_dir, key + '.loudness')
+        self.meta_path = self.path + '.json'
+        self.sums = None
+        self.length_ms = self.frame_rate = self.channels = None
+
+    def _file_hash(self):
+        digest = hashlib.sha256()
+        with open(self.audio_file, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def _write_meta(self, meta):
+        with open(self.meta_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(self.meta_path + '.tmp', self.meta_path)
+
+    def load(self):
+        """
+        Reads the cached index if it belongs to the current content of the audio file.
+        Returns True if the index can be queried.
+        """
+        import numpy as np
+
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            stat = os.stat(self.audio_file)
+            if meta.get('version') != self.VERSION or meta['bin_ms'] != LOUDNESS_INDEX_BIN_MS or meta['size'] != stat.st_size:
+                return False
+            if meta['mtime_ns'] != stat.st_mtime_ns:
+                if meta['sha256'] != self._file_hash():
+                    return False
+                meta['mtime_ns'] = stat.st_mtime_ns
+                with contextlib.suppress(OSError):
+                    self._write_meta(meta)
+            bins = np.fromfile(self.path, dtype='<f4')
+            if len(bins) != -(-meta['length_ms'] // LOUDNESS_INDEX_BIN_MS):
+                return False
+            os.utime(self.path)  # Marks the index as recently used for eviction
+        except (OSError, ValueError, KeyError, TypeError):
+            return False
+        self.sums = np.concatenate(([0.0], np.cumsum(bins, dtype=np.float64)))
+        self.length_ms, self.frame_rate, self.channels = meta['length_ms'], meta['frame_rate'], meta['channels']
+        return True
+
+    def build(self):
+        """
+        Decodes the audio file once, writes its index and evicts least recently used indexes
+        until the cache fits in LOUDNESS_INDEX_MAX_BYTES.
+
+        Raises:
+            OSError: If the index cannot be written.
+            ValueError: If ffmpeg cannot decode the file.
+        """
+        import numpy as np
+
+        stat = os.stat(self.audio_file)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        carry = np.zeros(0, dtype=np.int64)  # Millisecond energies not yet in a complete bin
+        try:
+            with open(temp_path, 'wb') as f:
+
+                def write_bins(energy, count):
+                    nonlocal carry
+                    carry = np.concatenate((carry, energy))
+                    complete = len(carry) - len(carry) % LOUDNESS_INDEX_BIN_MS
+                    f.write(carry[:complete].reshape(-1, LOUDNESS_INDEX_BIN_MS).sum(axis=1).astype('<f4').tobytes())
+                    carry = carry[complete:]
+
+                length_ms, frame_rate, channels, total_frames, _ = decode_ms_energy(self.audio_file, write_bins)
+                if len(carry):
+                    f.write(np.array([carry.sum()], dtype='<f4').tobytes())
+            os.replace(temp_path, self.path)
+        finally:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+        self._write_meta({'version': self.VERSION, 'bin_ms': LOUDNESS_INDEX_BIN_MS, 'file': os.path.realpath(self.audio_file),
+                          'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': self._file_hash(),
+                          'frame_rate': frame_rate, 'channels': channels, 'length_ms': length_ms, 'frames': total_frames})
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.loudness'):
+                path = os.path.join(self.cache_dir, name)
+                with contextlib.suppress(OSError):
+                    stat = os.stat(path)
+                    meta_size = os.path.getsize(path + '.json') if os.path.exists(path + '.json') else 0
+                    entries.append((stat.st_mtime, stat.st_size + meta_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= LOUDNESS_INDEX_MAX_BYTES or path == self.path:
+                continue
+            for stale in (path + '.json', path):
+                with contextlib.suppress(OSError):
+                    os.remove(stale)
+            total -= size
+
+    def silent_ranges(self, min_silence_len=1000, silence_thresh=-16):
+        """
+        Returns the [start_ms, end_ms] silent ranges detect_silent_ranges finds with these
+        settings, to within LOUDNESS_INDEX_BIN_MS.
+        """
+        import numpy as np
+
+        started = time.perf_counter()
+        threshold = (10 ** (silence_thresh / 20)) * 32768.0
+        bin_ms = LOUDNESS_INDEX_BIN_MS
+        window = max(1, int(round(min_silence_len / bin_ms)))  # In bins
+        silent_ranges = []
+        if len(self.sums) > window:
+            # Sample counts at bin boundaries, with pydub's millisecond boundaries.
+            bounds_ms = np.minimum(np.arange(len(self.sums)) * bin_ms, self.length_ms)
+            count_sums = (bounds_ms * (self.frame_rate / 1000.0)).astype(np.int64) * self.channels
+            window_energy = self.sums[window:] - self.sums[:-window]
+            window_count = count_sums[window:] - count_sums[:-window]
+            rms = np.floor(np.sqrt(np.maximum(window_energy, 0.0) / np.maximum(window_count, 1)))
+            starts = np.nonzero(rms <= threshold)[0]
+            if len(starts):
+                breaks = np.nonzero(starts[1:] > starts[:-1] + window)[0]
+                range_starts = starts[np.concatenate(([0], breaks + 1))] * bin_ms
+                range_ends = np.minimum((starts[np.concatenate((breaks, [len(starts) - 1]))] + window) * bin_ms,
+                                        self.length_ms)
+                silent_ranges = [[start, end] for start, end in zip(range_starts.tolist(), range_ends.tolist())]
+        record_span('silence_detection', time.perf_counter() - started, file=os.path.basename(self.audio_file),
+                    ranges=len(silent_ranges), length_ms=self.length_ms, source='index')
+        return silent_ranges
+
+def get_loudness_index(audio_file, cache_dir=None):
+    """
+    Returns the LoudnessIndex of an audio file, decoding the file and caching the index if
+    there is no valid one yet, or None if the index cannot be written.
+
+    Args:
+        audio_file (str): Path to the audio file.
+        cache_dir (str, optional): Directory holding LOUDNESS_INDEX_DIR. Defaults to get_output_dir().
+    """
+    index = LoudnessIndex(audio_file, cache_dir)
+    if index.load():
+        return index
+    with span('loudness_index', file=os.path.basename(audio_file)) as trace:
+        try:
+            index.build()
+        except OSError as e:
+            print(f"Warning: Could not save the loudness index of {os.path.basename(audio_file)}: {e}")
+            trace['outcome'] = 'failed'
+            return None
+    return index if index.load() else None
+
+def detect_nonsilent_intervals(audio_file, min_silence_len=1000, silence_thresh=-16, keep_silence=100, use_index=None, index_dir=None):
+    """
+    Finds the non-silent parts of an audio file the way pydub.silence.split_on_silence does,
+    but without decoding the whole file into memory (see detect_silent_ranges), and once the
+    file's loudness index exists without decoding it at all (see LoudnessIndex).
+
+    Args:
+        audio_file (str): Path to the audio file.
+        min_silence_len (int): Minimum length of silence in milliseconds.
+        silence_thresh (float): Silence threshold in dBFS.
+        keep_silence (int or bool): Milliseconds of silence kept around each interval
+            (True keeps all of it, False none), as in split_on_silence.
+        use_index (bool, optional): Answer from the file's LoudnessIndex, building it on first
+            use, instead of decoding the file. Interval bounds are then exact to within
+            LOUDNESS_INDEX_BIN_MS. Defaults to LOUDNESS_INDEX.
+        index_dir (str, optional): Directory holding LOUDNESS_INDEX_DIR. Defaults to get_output_dir().
+
+    Returns:
+        tuple: (numpy int64 array of shape (n, 2) with [start, end) sample offsets of each
+                interval, frame rate). Like a pydub slice, the last end offset can lie up to
+                2 ms past the decoded audio; pydub pads that with silence.
+    """
+    import numpy as np
+
+    index = get_loudness_index(audio_file, index_dir) if (LOUDNESS_INDEX if use_index is None else use_index) else None
+    if index is not None:
+        silent_ranges = index.silent_ranges(min_silence_len, silence_thresh)
+        length_ms, frame_rate = index.length_ms, index.frame_rate
+    else:
+        silent_ranges, length_ms, frame_rate, _ = detect_silent_ranges(audio_file, min_silence_len, silence_thresh)
+
+    # pydub.silence.detect_nonsilent
+    if not silent_ranges:
+        nonsilent_ranges = [[0, length_ms]]
+    elif silent_ranges[0][0] == 0 and silent_ranges[0][1] == length_ms:
+        nonsilent_ranges = []
+    else:
+        nonsilent_ranges = []
+        prev_end = 0
+        for start, end in silent_ranges:
+            nonsilent_ranges.append([prev_end, start])
+            prev_end = end
+        if end != length_ms:
+            nonsilent_ranges.append([prev_end, length_ms])
+        if nonsilent_ranges[0] == [0, 0]:
+            nonsilent_ranges.pop(0)
+
+    # pydub.silence.split_on_silence
+    if isinstance(keep_silence, bool):
+        keep_silence = length_ms if keep_silence else 0
+    output_ranges = [[start - keep_silence, end + keep_silence] for start, end in nonsilent_ranges]
+    for current, following in zip(output_ranges, output_ranges[1:]):
+        if following[0] < current[1]:
+            current[1] = (current[1] + following[0]) // 2
+            following[0] = current[1]
+
+    ms_frames = frame_rate / 1000.0
+    intervals = np.array(
+        [[int(min(max(start, 0), length_ms) * ms_frames), int(min(end, length_ms) * ms_frames)] for start, end in output_ranges],
+        dtype=np.int64
+    ).reshape(-1, 2)
+    return intervals, frame_rate
+
+def export_audio_pieces(audio_file, pieces, frame_rate, chunk_name):
+    """
+    Encodes the given sample ranges of an audio file, joined in order, into one MP3 with ffmpeg.
+    Only the needed part of the input is decoded, so the parent process never holds the audio.
+    The input is seeked to half a second before the first piece and the pieces are trimmed
+    relative to that point, so the cuts land on the requested samples only as far as ffmpeg's
+    seek is exact; check_chunk_export_alignment verifies this on VBR MP3s.
+
+    Args:
+        audio_file (str): Path to the source audio file.
+        pieces (list): [start, end) sample offsets to include, in order. The end of the last
+            piece may be None to include everything up to the end of the file.
+        frame_rate (int): Sample rate the offsets refer to.
+        chunk_name (str): Path of the MP3 to write.
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg fails.
+    """
+    # Seek a little before the first piece so the MP3 decoder is warmed up at the cut point.
+    seek_frame = max(0, int(pieces[0][0]) - frame_rate // 2)
+    read_limit = []
+    if pieces[-1][1] is not None:
+        read_limit = ['-t', f"{(int(pieces[-1][1]) - seek_frame) / frame_rate + 1:.6f}"]
+
+    trims = [
+        f"atrim=start_sample={int(start) - seek_frame}"
+        + (f":end_sample={int(end) - seek_frame}" if end is not None else "")
+        + ",asetpts=PTS-STARTPTS"
+        for start, end in pieces
+    ]
+    if len(trims) == 1:
+        filter_graph = f"[0:a]{trims[0]}[out]"
+    else:
+        labels = ''.join(f"[s{i}]" for i in range(len(trims)))
+        parts = ';'.join(f"[s{i}]{trim}[p{i}]" for i, trim in enumerate(trims))
+        joined = ''.join(f"[p{i}]" for i in range(len(trims)))
+        filter_graph = f"[0:a]asplit={len(trims)}{labels};{parts};{joined}concat=n={len(trims)}:v=0:a=1[out]"
+
+    subprocess.run(
+        [
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y',
+            '-ss', f"{seek_frame / frame_rate:.6f}", *read_limit, '-i', audio_file,
+            '-filter_complex', filter_graph, '-map', '[out]',
+            '-ar', str(frame_rate), '-f', 'mp3', chunk_name
+        ],
+        check=True,
+        capture_output=True
+    )
+
+def export_chunk_job(audio_file, pieces, frame_rate, chunk_name):
+    """
+    Worker entry point of export_chunks: encodes one chunk and times it.
+
+    Returns:
+        tuple: (chunk_name, seconds taken, error message or None)
+    """
+    started = time.monotonic()
+    try:
+        export_audio_pieces(audio_file, pieces, frame_rate, chunk_name)
+        return chunk_name, time.monotonic() - started, None
+    except subprocess.CalledProcessError as e:
+        return chunk_name, time.monotonic() - started, e.stderr.decode('utf-8', errors='replace').strip() or str(e)
+    except Exception as e:
+        return chunk_name, time.monotonic() - started, str(e)
+
+def export_chunks(audio_file, chunks, frame_rate, chunk_dir, workers=None):
+    """
+    Encodes chunks of an audio file to <name>_chunkN.mp3 concurrently in a thread pool.
+
+    Each worker only runs ffmpeg on the source path and sample offsets of its chunk, so the
+    decoding and encoding happen in the ffmpeg processes and no audio is held by this one.
+
+    Args:
+        audio_file (str): Path to the source audio file.
+        chunks (list): One list of [start, end) sample offsets per chunk (see export_audio_pieces).
+        frame_rate (int): Sample rate the offsets refer to.
+        chunk_dir (str): Directory to write the chunks to.
+        workers (int, optional): Pool size. Defaults to CHUNK_EXPORT_WORKERS or the number of cores.
+
+    Returns:
+        list: Paths of the chunks written successfully, in chunk order.
+    """
+    base_name = os.path.splitext(os.path.basename(audio_file))[0]
+    chunk_names = [os.path.join(chunk_dir, f"{base_name}_chunk{i+1}.mp3") for i in range(len(chunks))]
+    workers = max(1, min(workers or CHUNK_EXPORT_WORKERS or os.cpu_count() or 1, len(chunks)))
+
+    started = time.monotonic()
+    encode_seconds = 0.0
+    saved = set()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(export_chunk_job, audio_file, pieces, frame_rate, chunk_name)
+            for pieces, chunk_name in zip(chunks, chunk_names)
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            chunk_name, seconds, error = future.result()
+            encode_seconds += seconds
+            record_span('chunk_export', seconds, file=os.path.basename(chunk_name), outcome='failed' if error else 'ok',
+                        bytes=os.path.getsize(chunk_name) if not error and os.path.isfile(chunk_name) else None)
+            if error:
+                print(f"Error saving chunk {chunk_name}: {error}")
+            else:
+                saved.add(chunk_name)
+                print(f"Saved chunk: {chunk_name} ({seconds:.1f}s)")
 
-        for i, chunk in enumerate(chunks):
-            chunk_name = os.path.join(chunk_dir, f"{os.path.splitext(os.path.basename(audio_file))[0]}_chunk{i+1}.mp3")
-            chunk.export(chunk_name, format="mp3")
-            print(f"Saved chunk: {chunk_name}")
+    elapsed = time.monotonic() - started
+    print(f"Encoded {len(saved)} chunks in {elapsed:.1f}s with {workers} workers "
+          f"({encode_seconds:.1f}s of encoding, {encode_seconds / max(elapsed, 0.001):.1f}x parallel speed-up).")
+    return [chunk_name for chunk_name in chunk_names if chunk_name in saved]
 
-        print(f"\nAudio successfully split into {len(chunks)} chunks in: {chunk_dir}")
-    except Exception as e:
-        print(f"Error splitting audio by chunk length: {e}")
+def probe_audio(audio_file):
+    """
+    Reads the duration and sample rate of an audio file from ffmpeg's stream information,
+    without decoding it.
+
+    Returns:
+        tuple: (duration in milliseconds, sample rate)
+
+    Raises:
+        ValueError: If ffmpeg reports no duration or audio stream.
+    """
+    result = subprocess.run(['ffmpeg', '-hide_banner', '-i', audio_file], capture_output=True, text=True,
+                            encoding='utf-8', errors='replace')
+    duration = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", result.stderr)
+    sample_rate = re.search(r"Audio: .*?(\d+) Hz", result.stderr)
+    if not duration or not sample_rate:
+        raise ValueError(f"Could not read the duration of {audio_file}.")
+    hours, minutes, seconds = duration.groups()
+    return round((int(hours) * 3600 + int(minutes) * 60 + float(seconds)) * 1000), int(sample_rate.group(1))
 
 def split_audio_by_silence(audio_file, output_dir, min_silence_len=500, silence_thresh=-40, min_chunk_length_ms=300000):
     """
-    Splits an audio file based on silence detection using pydub.
+    Splits an audio file based on silence detection (see detect_nonsilent_intervals).
     
     Args:
         audio_file (str): Path to the audio file to split.
@@ -292,37 +3082,44 @@ def split_audio_by_silence(audio_file, output_dir, min_silence_len=500, silence_
         min_silence_len (int): Minimum length of silence in milliseconds to detect a split.
         silence_thresh (int): Silence threshold in dBFS (e.g., -40 dBFS).
         min_chunk_length_ms (int): Minimum length of chunks in milliseconds (default: 5 minutes).
-    """
-    try:
-        print(f"Splitting audio by silence detection...")
-        chunk_dir = os.path.join(output_dir, "split_chunks")
-        os.makedirs(chunk_dir, exist_ok=True)
 
-        audio = AudioSegment.from_file(audio_file)
-        chunks = split_on_silence(
-            audio,
-            min_silence_len=min_silence_len,
-            silence_thresh=silence_thresh,
-            keep_silence=200
-        )
+    Returns:
+        list: Paths of the chunks written, or empty list if splitting failed.
+    """
+    with trace_to(output_dir):
+        try:
+            print(f"Splitting audio by silence detection...")
+            chunk_dir = os.path.join(output_dir, "split_chunks")
+            os.makedirs(chunk_dir, exist_ok=True)
 
-        filtered_chunks = [chunk for chunk in chunks if len(chunk) >= min_chunk_length_ms]
-        if not filtered_chunks:
-            print("No chunks meet the minimum length requirement. Try adjusting silence parameters.")
-            return
+            intervals, frame_rate = detect_nonsilent_intervals(
+                audio_file,
+                min_silence_len=min_silence_len,
+                silence_thresh=silence_thresh,
+                keep_silence=200
+            )
 
-        for i, chunk in enumerate(filtered_chunks):
-            chunk_name = os.path.join(chunk_dir, f"{os.path.splitext(os.path.basename(audio_file))[0]}_chunk{i+1}.mp3")
-            chunk.export(chunk_name, format="mp3")
-            print(f"Saved chunk: {chunk_name}")
+            filtered_intervals = [
+                (start, end) for start, end in intervals.tolist()
+                if round(1000 * (end - start) / frame_rate) >= min_chunk_length_ms
+            ]
+            if not filtered_intervals:
+                print("No chunks meet the minimum length requirement. Try adjusting silence parameters.")
+                return []
 
-        print(f"\nAudio successfully split into {len(filtered_chunks)} chunks in: {chunk_dir}")
-    except Exception as e:
-        print(f"Error splitting audio by silence: {e}")
+            chunk_names = export_chunks(audio_file, [[interval] for interval in filtered_intervals], frame_rate, chunk_dir)
+            print(f"\nAudio successfully split into {len(chunk_names)} chunks in: {chunk_dir}")
+            return chunk_names
+        except ImportError:
+            print("Error splitting audio by silence: numpy is required. Install it with: pip install numpy")
+        except Exception as e:
+            print(f"Error splitting audio by silence: {e}")
+        return []
 
 def split_audio_by_silence_then_chunks(audio_file, output_dir, chunk_length_ms, min_silence_len=500, silence_thresh=-40):
     """
     Splits an audio file by removing silence, then splits the concatenated non-silent audio into equal chunks.
+    Only sample offsets are computed here; each chunk is cut from the source file and encoded by ffmpeg.
     
     Args:
         audio_file (str): Path to the audio file to split.
@@ -330,62 +3127,107 @@ def split_audio_by_silence_then_chunks(audio_file, output_dir, chunk_length_ms,
         chunk_length_ms (int): Length of each chunk in milliseconds after silence removal.
         min_silence_len (int): Minimum length of silence in milliseconds to detect.
         silence_thresh (int): Silence threshold in dBFS (e.g., -40 dBFS).
+
+    Returns:
+        list: Paths of the chunks written, or empty list if splitting failed.
     """
-    try:
-        print(f"Removing silence and splitting into chunks of {chunk_length_ms / 60000:.1f} minutes...")
-        chunk_dir = os.path.join(output_dir, "split_chunks")
-        os.makedirs(chunk_dir, exist_ok=True)
+    with trace_to(output_dir):
+        try:
+            print(f"Removing silence and splitting into chunks of {chunk_length_ms / 60000:.1f} minutes...")
+            chunk_dir = os.path.join(output_dir, "split_chunks")
+            os.makedirs(chunk_dir, exist_ok=True)
 
-        audio = AudioSegment.from_file(audio_file)
-        non_silent_chunks = split_on_silence(
-            audio,
-            min_silence_len=min_silence_len,
-            silence_thresh=silence_thresh,
-            keep_silence=200
-        )
+            intervals, frame_rate = detect_nonsilent_intervals(
+                audio_file,
+                min_silence_len=min_silence_len,
+                silence_thresh=silence_thresh,
+                keep_silence=200
+            )
 
-        if not non_silent_chunks:
-            print("No non-silent segments detected. Try adjusting silence parameters.")
-            return
+            if not len(intervals):
+                print("No non-silent segments detected. Try adjusting silence parameters.")
+                return []
 
-        concatenated_audio = AudioSegment.empty()
-        for chunk in non_silent_chunks:
-            concatenated_audio += chunk
+            total_frames = int((intervals[:, 1] - intervals[:, 0]).sum())
+            duration_ms = round(1000 * total_frames / frame_rate)
+            if duration_ms < chunk_length_ms:
+                print(f"Error: After removing silence, audio duration ({duration_ms / 1000:.1f}s) is shorter than requested chunk length ({chunk_length_ms / 1000:.1f}s).")
+                return []
 
-        duration_ms = len(concatenated_audio)
-        if duration_ms < chunk_length_ms:
-            print(f"Error: After removing silence, audio duration ({duration_ms / 1000:.1f}s) is shorter than requested chunk length ({chunk_length_ms / 1000:.1f}s).")
-            return
+            chunks = concatenated_chunk_pieces(intervals.tolist(), frame_rate, chunk_length_ms)
 
-        chunks = [concatenated_audio[i:i + chunk_length_ms] for i in range(0, duration_ms, chunk_length_ms)]
+            chunk_names = export_chunks(audio_file, chunks, frame_rate, chunk_dir)
+            print(f"\nAudio successfully split into {len(chunk_names)} chunks after silence removal in: {chunk_dir}")
+            return chunk_names
+        except ImportError:
+            print("Error splitting audio by silence then chunks: numpy is required. Install it with: pip install numpy")
+        except Exception as e:
+            print(f"Error splitting audio by silence then chunks: {e}")
+        return []
 
-        for i, chunk in enumerate(chunks):
-            chunk_name = os.path.join(chunk_dir, f"{os.path.splitext(os.path.basename(audio_file))[0]}_chunk{i+1}.mp3")
-            chunk.export(chunk_name, format="mp3")
-            print(f"Saved chunk: {chunk_name}")
+def concatenated_chunk_pieces(intervals, frame_rate, chunk_length_ms):
+    """
+    Maps equal chunks of the concatenation of intervals back to pieces of the source audio,
+    using the same millisecond-to-sample conversion as slicing a pydub AudioSegment.
 
-        print(f"\nAudio successfully split into {len(chunks)} chunks after silence removal in: {chunk_dir}")
-    except Exception as e:
-        print(f"Error splitting audio by silence then chunks: {e}")
+    Args:
+        intervals (list): [start, end) sample offsets of the intervals, in order.
+        frame_rate (int): Sample rate of the audio.
+        chunk_length_ms (int): Length of each chunk in milliseconds.
+
+    Returns:
+        list: One list of [start, end) source sample offsets per chunk.
+    """
+    total_frames = sum(end - start for start, end in intervals)
+    duration_ms = round(1000 * total_frames / frame_rate)
+    ms_frames = frame_rate / 1000.0
 
-def select_audio_file(output_dir):
+    chunks = []
+    interval_idx = 0
+    interval_offset = 0  # Concatenated offset of intervals[interval_idx]
+    for chunk_start_ms in range(0, duration_ms, chunk_length_ms):
+        chunk_start = int(chunk_start_ms * ms_frames)
+        chunk_end = min(int(min(chunk_start_ms + chunk_length_ms, duration_ms) * ms_frames), total_frames)
+        pieces = []
+        while interval_idx < len(intervals) and chunk_start < chunk_end:
+            start, end = intervals[interval_idx]
+            interval_end = interval_offset + end - start
+            if chunk_start >= interval_end:
+                interval_offset = interval_end
+                interval_idx += 1
+                continue
+            piece_end = min(chunk_end, interval_end)
+            pieces.append([start + chunk_start - interval_offset, start + piece_end - interval_offset])
+            chunk_start = piece_end
+        if pieces:
+            chunks.append(pieces)
+    return chunks
+
+def select_audio_file(output_dir, candidates=None):
     """
     Lists MP3 files in the output directory and allows the user to select one for splitting.
     
     Args:
         output_dir (str): Directory to search for MP3 files.
+        candidates (list, optional): Paths to choose from instead of scanning output_dir
+            (e.g. the files returned by download_media). A single candidate is returned directly.
 
     Returns:
         str: Path to the selected audio file, or None if no file is selected or available.
     """
-    mp3_files = [f for f in os.listdir(output_dir) if f.endswith('.mp3') and os.path.isfile(os.path.join(output_dir, f))]
+    if candidates is not None:
+        mp3_files = [path for path in candidates if path.endswith('.mp3')]
+        if len(mp3_files) == 1:
+            return mp3_files[0]
+    else:
+        mp3_files = [os.path.join(output_dir, f) for f in os.listdir(output_dir) if f.endswith('.mp3') and os.path.isfile(os.path.join(output_dir, f))]
     if not mp3_files:
         print("No MP3 files found in the output directory.")
         return None
 
     print("\nAvailable MP3 files:")
     for i, f in enumerate(mp3_files, 1):
-        print(f"{i}. {f}")
+        print(f"{i}. {os.path.basename(f)}")
 
     while True:
         try:
@@ -394,12 +3236,361 @@ def select_audio_file(output_dir):
                 return None
             choice_idx = int(choice) - 1
             if 0 <= choice_idx < len(mp3_files):
-                return os.path.join(output_dir, mp3_files[choice_idx])
+                return mp3_files[choice_idx]
             else:
                 print(f"Error: Please select a number between 1 and {len(mp3_files)}.")
         except ValueError:
             print("Error: Please enter a valid number or 'q' to cancel.")
 
+def prompt_number(prompt, default):
+    """
+    Prompts for a number, returning the default when the input is empty or invalid.
+    """
+    value = input(f"{prompt} [{default}]: ").strip()
+    if not value:
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        print(f"Error: '{value}' is not a number. Using {default}.")
+        return default
+
+def prompt_split_policy(subject):
+    """
+    Asks how audio should be split and returns the answer as a split policy, the same dict
+    batch jobs take as 'split' (see parse_batch_job), or None if the user cancels.
+
+    Args:
+        subject (str): What is being split, for the question (a file name or "each file").
+    """
+    print(f"\nHow do you want to split {subject}?")
+    print("1. Equal chunks by duration")
+    print("2. By silence detection")
+    print("3. Remove silence, then equal chunks")
+    print("4. Cancel")
+    choice = input("Enter choice (1/2/3/4): ").strip()
+
+    if choice == '1':
+        chunk_minutes = prompt_number("Chunk length in minutes", 10)
+        sample_accurate = input("Cut between MP3 frames instead of at frame boundaries? Slower, re-encodes every chunk (y/N): ").strip().lower() == 'y'
+        return {'mode': 'chunk', 'chunk_minutes': chunk_minutes, 'sample_accurate': sample_accurate}
+    if choice == '2':
+        min_silence_len = prompt_number("Minimum silence length in milliseconds", 500)
+        silence_thresh = prompt_number("Silence threshold in dBFS", -40)
+        min_chunk_minutes = prompt_number("Minimum chunk length in minutes", 5)
+        return {'mode': 'silence', 'min_silence_len': min_silence_len, 'silence_thresh': silence_thresh,
+                'min_chunk_minutes': min_chunk_minutes}
+    if choice == '3':
+        chunk_minutes = prompt_number("Chunk length in minutes", 10)
+        min_silence_len = prompt_number("Minimum silence length in milliseconds", 500)
+        silence_thresh = prompt_number("Silence threshold in dBFS", -40)
+        return {'mode': 'silence_chunks', 'chunk_minutes': chunk_minutes, 'min_silence_len': min_silence_len,
+                'silence_thresh': silence_thresh}
+    return None
+
+def split_audio_files(files, output_dir, split):
+    """
+    Splits audio files as described by a split policy (see prompt_split_policy).
+
+    Returns:
+        tuple: (paths of all chunks written, error message if a file produced no chunks, otherwise None)
+    """
+    chunk_length_ms = int(split.get('chunk_minutes', 10) * 60000)
+    min_silence_len = int(split.get('min_silence_len', 500))
+    silence_thresh = split.get('silence_thresh', -40)
+    chunks = []
+    for audio_file in files:
+        with span('post_processing', output_dir, mode=split['mode'], file=os.path.basename(audio_file)) as trace:
+            if split['mode'] == 'chunk':
+                chunk_names = split_audio_by_chunk(audio_file, output_dir, chunk_length_ms, bool(split.get('sample_accurate')))
+            elif split['mode'] == 'silence':
+                chunk_names = split_audio_by_silence(audio_file, output_dir, min_silence_len, silence_thresh,
+                                                     int(split.get('min_chunk_minutes', 5) * 60000))
+            else:
+                chunk_names = split_audio_by_silence_then_chunks(audio_file, output_dir, chunk_length_ms, min_silence_len, silence_thresh)
+            trace['chunks'] = len(chunk_names)
+            if not chunk_names:
+                trace['outcome'] = 'failed'
+                return chunks, f"splitting {os.path.basename(audio_file)} produced no chunks (see output above)"
+            chunks.extend(chunk_names)
+    return chunks, None
+
+def preview_silence_split(audio_file, split):
+    """
+    Prints the chunk boundaries a 'silence' or 'silence_chunks' split policy (see
+    prompt_split_policy) would produce, without exporting any audio. The first preview of a
+    file builds its loudness index; after that other settings are previewed in milliseconds.
+
+    Returns:
+        list: One list of [start, end) sample offsets per chunk, as passed to export_chunks.
+    """
+    min_silence_len = int(split.get('min_silence_len', 500))
+    silence_thresh = split.get('silence_thresh', -40)
+    intervals, frame_rate = detect_nonsilent_intervals(audio_file, min_silence_len, silence_thresh, keep_silence=200)
+    if split['mode'] == 'silence':
+        min_chunk_length_ms = int(split.get('min_chunk_minutes', 5) * 60000)
+        chunks = [[[start, end]] for start, end in intervals.tolist()
+                  if round(1000 * (end - start) / frame_rate) >= min_chunk_length_ms]
+    else:
+        chunk_length_ms = int(split.get('chunk_minutes', 10) * 60000)
+        total_frames = int((intervals[:, 1] - intervals[:, 0]).sum())
+        chunks = []
+        if total_frames and round(1000 * total_frames / frame_rate) >= chunk_length_ms:
+            chunks = concatenated_chunk_pieces(intervals.tolist(), frame_rate, chunk_length_ms)
+
+    def timestamp(frame):
+        seconds = int(frame / frame_rate)
+        return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+    print(f"\nSilence of at least {min_silence_len} ms below {silence_thresh:g} dBFS gives {len(chunks)} chunks:")
+    for i, pieces in enumerate(chunks, 1):
+        minutes = sum(end - start for start, end in pieces) / frame_rate / 60
+        removed = f", {len(pieces) - 1} silences removed" if len(pieces) > 1 else ""
+        print(f"{i}. {timestamp(pieces[0][0])} - {timestamp(pieces[-1][1])} ({minutes:.1f} min{removed})")
+    return chunks
+
+def audio_split_menu(audio_file, output_dir):
+    """
+    Asks the user how an audio file should be split and runs the matching split function.
+    Silence-based splits are previewed first (see preview_silence_split), so the settings can
+    be changed before any chunk is exported.
+
+    Args:
+        audio_file (str): Path to the audio file to split.
+        output_dir (str): Directory in which the split_chunks folder is created.
+    """
+    while True:
+        split = prompt_split_policy(os.path.basename(audio_file))
+        if split is None:
+            print("Split cancelled.")
+            return
+        if split['mode'] == 'chunk':
+            break
+        try:
+            preview_silence_split(audio_file, split)
+        except ImportError:
+            break
+        except Exception as e:
+            print(f"Error previewing the split: {e}")
+            break
+        if input("Export these chunks? (Y to export / n to try other settings): ").strip().lower() != 'n':
+            break
+    split_audio_files([audio_file], output_dir, split)
+
+def transcode_to_mp3(source):
+    """
+    Encodes a downloaded audio stream to MP3 next to it (VBR quality 0, like yt-dlp's
+    --audio-quality 0) and deletes the source, as yt-dlp does after extracting audio.
+    MP3 sources are returned unchanged.
+
+    Returns:
+        tuple: (path of the MP3 file or None, error message or None)
+    """
+    if source.lower().endswith('.mp3'):
+        return source, None
+    target = os.path.splitext(source)[0] + '.mp3'
+    with span('transcode', file=os.path.basename(source)) as trace:
+        try:
+            subprocess.run(
+                ['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', '-i', source,
+                 '-vn', '-c:a', 'libmp3lame', '-q:a', '0', '-f', 'mp3', target + '.part'],
+                check=True, capture_output=True, text=True, encoding='utf-8', errors='replace'
+            )
+            os.replace(target + '.part', target)
+            os.remove(source)
+        except subprocess.CalledProcessError as e:
+            trace['outcome'] = 'failed'
+            with contextlib.suppress(OSError):
+                os.remove(target + '.part')
+            return None, f"ffmpeg could not encode {os.path.basename(source)}: {e.stderr.strip()}"
+        except OSError as e:
+            trace['outcome'] = 'failed'
+            return None, f"Could not encode {os.path.basename(source)}: {e}"
+        trace['bytes'] = os.path.getsize(target)
+    return target, None
+
+def run_audio_pipeline(url, entries, playlist_items, output_dir, split=None, username=None, password=None, cookie_file=None, save_cookies_to=None, backend=None, download_workers=None, transcode_workers=None, split_workers=None):
+    """
+    Downloads playlist items as MP3 in three overlapping stages: downloading the audio stream
+    (PIPELINE_SOURCE_FORMAT), transcoding it to MP3 with ffmpeg, and splitting it with one split
+    policy for the whole selection. Each stage has its own worker threads and hands items on
+    through a queue of PIPELINE_QUEUE_SIZE, so item N is encoded or split while item N+1
+    downloads, and a stage that falls behind pauses the stage before it.
+
+    Download starts are paced per host like in download_playlist (see HostRateController), and
+    throttled downloads are retried up to PLAYLIST_JOB_ATTEMPTS times once the host's pacing allows.
+    Items already downloaded as MP3 skip straight to the split stage.
+
+    Args:
+        url (str): The URL of the playlist.
+        entries (list): The playlist entries from get_media_info (may contain None).
+        playlist_items (str): Selected item numbers as returned by parse_selection, or None for all.
+        output_dir (str): The directory where the files should be saved.
+        split (dict, optional): Split policy (see prompt_split_policy), or None to not split.
+        username, password, cookie_file, save_cookies_to: Same as for download_media.
+        backend (optional): The yt-dlp backend to use. Defaults to get_yt_dlp_backend().
+        download_workers, transcode_workers, split_workers (int, optional): Worker threads per
+            stage. Default to PIPELINE_DOWNLOAD_WORKERS, PIPELINE_TRANSCODE_WORKERS and
+            PIPELINE_SPLIT_WORKERS.
+
+    Returns:
+        tuple: (paths of the MP3 files in playlist order, list of error messages of failed items)
+    """
+    if backend is None:
+        backend = get_yt_dlp_backend()
+    stage_workers = {
+        'download': download_workers or PIPELINE_DOWNLOAD_WORKERS,
+        'transcode': transcode_workers or PIPELINE_TRANSCODE_WORKERS,
+        'split': split_workers or PIPELINE_SPLIT_WORKERS,
+    }
+    indices = [int(idx) for idx in playlist_items.split(',')] if playlist_items else list(range(1, len(entries) + 1))
+    source_variant = archive_variant('video', PIPELINE_SOURCE_FORMAT)
+    busy = collections.Counter()
+    lock = threading.Lock()
+    controllers = {}
+    schedule = threading.Condition()
+
+    items = []
+    for index in indices:
+        entry, job_url, job_items = playlist_job_target(url, entries, index)
+        items.append({
+            'index': index,
+            'label': f"{index}. {entry.get('title') or f'item {index}'}",
+            'url': job_url,
+            'playlist_items': job_items,
+            'extractor': entry.get('extractor_key') or entry.get('ie_key'),
+            'id': entry.get('id'),
+        })
+
+    def download_item(item):
+        existing = archive_lookup(output_dir, item['extractor'], item['id'], 'audio')
+        if existing:
+            print(f"[pipeline] {item['label']} is already downloaded.")
+            item['mp3'] = existing
+            return True
+        item['source'] = archive_lookup(output_dir, item['extractor'], item['id'], source_variant)
+        if item['source']:
+            return True
+        manifest_path = new_manifest_path(output_dir)
+        options = build_download_options(item['url'], PIPELINE_SOURCE_FORMAT, output_dir, 'video', item['playlist_items'],
+                                         manifest_path)
+        host = urllib.parse.urlsplit(normalize_url(item['url'])).hostname or ''
+        for attempt in range(1, PLAYLIST_JOB_ATTEMPTS + 1):
+            # Wait for the host's pacing, shared by all download workers.
+            with schedule:
+                controller = controllers.setdefault(host, HostRateController(host))
+                while not controller.can_start(time.monotonic()):
+                    schedule.wait(controller.ready(time.monotonic()))
+                controller.started(time.monotonic())
+                job_options = options + controller.options()
+            print(f"[pipeline] Downloading {item['label']}")
+            errors = []
+            started = time.monotonic()
+            try:
+                returncode = authenticated_download(backend, job_options, item['url'], output_dir, username, password,
+                                                    cookie_file, save_cookies_to, errors.append, label=item['label'],
+                                                    show=stage_workers['download'] == 1)
+            except FileNotFoundError:
+                errors.append("yt-dlp is not installed or not found in your system's PATH.")
+                returncode = 1
+            finally:
+                throttled = any(is_throttle_error(line) for line in errors)
+                with schedule:
+                    controller.finished(throttled)
+                    schedule.notify_all()
+            produced = read_output_manifest(manifest_path)
+            archive_record(output_dir, source_variant, produced)
+            if returncode == 0:
+                outcome = 'ok' if produced else 'no_file'
+            else:
+                outcome = 'throttled' if throttled else 'failed'
+            record_span('download', time.monotonic() - started, output_dir, media_type='audio', host=host, playlist_index=item['index'],
+                        bytes=sum(os.path.getsize(filepath) for _, _, filepath in produced), outcome=outcome)
+            if returncode == 0 and produced:
+                item['extractor'], item['id'], item['source'] = produced[0]
+                return True
+            if returncode == 0:
+                # yt-dlp skipped the item, e.g. because it was already downloaded or filtered out.
+                item['skipped'] = "yt-dlp produced no file (already downloaded or skipped by yt-dlp)"
+                return False
+            if not throttled or attempt == PLAYLIST_JOB_ATTEMPTS:
+                item['error'] = errors[-1] if errors else f"yt-dlp returned error code {returncode}"
+                return False
+            print(f"[pipeline] {item['label']} was throttled, retrying later.")
+
+    def transcode_item(item):
+        if item.get('mp3'):
+            return True
+        item['mp3'], item['error'] = transcode_to_mp3(item['source'])
+        if item['error']:
+            return False
+        if item['extractor'] and item['id']:
+            archive_record(output_dir, 'audio', [(item['extractor'], item['id'], item['mp3'])])
+        print(f"[pipeline] Encoded {item['label']}")
+        return True
+
+    def split_item(item):
+        item['chunks'], item['error'] = split_audio_files([item['mp3']], output_dir, split)
+        return item['error'] is None
+
+    def run_stage(name, work, source, sink):
+        while True:
+            item = source.get()
+            if item is None:
+                return
+            started = time.monotonic()
+            try:
+                with trace_to(output_dir):
+                    passed = work(item)
+            except Exception as e:
+                item['error'] = f"An unexpected error occurred: {e}"
+                passed = False
+            with lock:
+                busy[name] += time.monotonic() - started
+            if item.get('skipped'):
+                print(f"[pipeline] Skipped {item['label']}: {item['skipped']}")
+            elif not passed:
+                print(f"[pipeline] Failed {item['label']}: {item['error']}")
+            elif sink is not None:
+                sink.put(item)  # Blocks while the next stage is behind
+
+    stages = [('download', download_item), ('transcode', transcode_item)]
+    if split:
+        stages.append(('split', split_item))
+    queues = [queue.Queue()] + [queue.Queue(maxsize=PIPELINE_QUEUE_SIZE) for _ in stages[1:]]
+    threads = []
+    for position, (name, work) in enumerate(stages):
+        sink = queues[position + 1] if position + 1 < len(queues) else None
+        threads.append([threading.Thread(target=run_stage, args=(name, work, queues[position], sink), daemon=True)
+                        for _ in range(stage_workers[name])])
+    for stage_threads in threads:
+        for thread in stage_threads:
+            thread.start()
+
+    workers = ", ".join(f"{stage_workers[name]} {name}" for name, _ in stages)
+    print(f"\nProcessing {len(items)} playlist items as MP3 ({workers} workers). Saving to: {output_dir}")
+    started = time.monotonic()
+    for item in items:
+        queues[0].put(item)
+    for position, stage_threads in enumerate(threads):
+        for _ in stage_threads:
+            queues[position].put(None)
+        for thread in stage_threads:
+            thread.join()
+
+    elapsed = time.monotonic() - started
+    finished = [item for item in items if item.get('mp3') and not item.get('error')]
+    errors = [f"{item['label']}: {item['error']}" for item in items if item.get('error')]
+    skipped = [f"{item['label']}: {item['skipped']}" for item in items if item.get('skipped')]
+    stage_times = ", ".join(f"{name} {busy[name]:.0f}s" for name, _ in stages)
+    print(f"\nPipeline finished: {len(finished)} of {len(items)} items done, {len(skipped)} skipped, {len(errors)} failed "
+          f"in {elapsed:.0f}s (busy time per stage: {stage_times}).")
+    for item in skipped:
+        print(f"  Skipped {item}")
+    for error in errors:
+        print(f"  Failed {error}")
+    return [item['mp3'] for item in items if item.get('mp3')], errors
+
 def parse_selection(selection_str, max_items):
     """
     Parses user input for item selection (e.g., "1,3,5", "1-5", "all", "7").
@@ -438,6 +3629,705 @@ def parse_selection(selection_str, max_items):
     selected_indices = sorted(list(set(selected_indices)))
     return ",".join(map(str, selected_indices))
 
+def get_output_dir():
+    """
+    Returns the directory where downloads, edited files and caches are stored.
+    """
+    output_base_dir = os.path.expanduser('~/storage/downloads')
+    return os.path.join(output_base_dir, 'Pyanide')
+
+def open_job_queue(output_dir):
+    """
+    Opens (and creates if needed) the SQLite batch job queue in output_dir.
+    Every state change is committed immediately, so the queue survives crashes.
+    """
+    conn = sqlite3.connect(os.path.join(output_dir, BATCH_QUEUE_FILE), timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id INTEGER PRIMARY KEY, job_key TEXT UNIQUE NOT NULL, spec TEXT NOT NULL, "
+        "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, files TEXT, "
+        "added REAL NOT NULL, updated REAL NOT NULL, owner TEXT, heartbeat REAL)"
+    )
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if 'owner' not in columns:
+        # Queues from before job leases: add the lease columns and drop stored credentials.
+        with conn:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+            conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat REAL")
+            for row in conn.execute("SELECT id, spec FROM jobs").fetchall():
+                spec = json.loads(row['spec'])
+                if any(field in spec for field in BATCH_SECRET_FIELDS):
+                    spec = {key: value for key, value in spec.items() if key not in BATCH_SECRET_FIELDS}
+                    conn.execute("UPDATE jobs SET spec = ? WHERE id = ?", (json.dumps(spec, sort_keys=True), row['id']))
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+    return conn
+
+def parse_batch_job(line):
+    """
+    Parses and validates one line of batch input.
+
+    A line is either a bare URL or a JSON object such as
+    {"url": "...", "media_type": "audio", "playlist_items": "1-5",
+     "split": {"mode": "chunk", "chunk_minutes": 10}}.
+    Optional keys: media_type ('video' or 'audio', default 'video'), format (yt-dlp format
+    string for video), playlist_items (selection like '1,3-5' or 'all'), output_dir,
+    cookie_file, username, password and split. split takes a mode ('chunk', 'silence' or
+    'silence_chunks') and the same settings as the split menu: chunk_minutes,
+    sample_accurate, min_silence_len, silence_thresh and min_chunk_minutes.
+
+    Returns:
+        dict: The job spec.
+
+    Raises:
+        ValueError: If the line is not a valid job.
+    """
+    line = line.strip()
+    if line.startswith('{'):
+        try:
+            spec = json.loads(line)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"invalid JSON: {e}")
+    else:
+        spec = {'url': line}
+
+    url = spec.get('url')
+    if not isinstance(url, str) or not url.startswith(('http://', 'https://')):
+        raise ValueError("'url' must be an http(s) URL")
+    spec.setdefault('media_type', 'video')
+    if spec['media_type'] not in ('video', 'audio'):
+        raise ValueError("'media_type' must be 'video' or 'audio'")
+    split = spec.get('split')
+    if split is not None:
+        if spec['media_type'] != 'audio':
+            raise ValueError("'split' is only supported for audio jobs")
+        if not isinstance(split, dict) or split.get('mode') not in ('chunk', 'silence', 'silence_chunks'):
+            raise ValueError("'split.mode' must be 'chunk', 'silence' or 'silence_chunks'")
+    return spec
+
+def enqueue_batch_jobs(conn, lines, secrets=None):
+    """
+    Adds jobs to the queue. Jobs that are already queued are left alone, except failed
+    ones, which are reset so that feeding the same input again retries them.
+    The BATCH_SECRET_FIELDS of a job are neither stored nor part of its job key; they are
+    put into secrets instead, so only the run that read them can use them.
+
+    Args:
+        conn: The queue connection from open_job_queue.
+        lines (iterable): Lines of batch input (see parse_batch_job). Blank lines and
+            lines starting with '#' are ignored.
+        secrets (dict, optional): Filled with the credentials of each job, by job key.
+
+    Returns:
+        tuple: (number of new or retried jobs, number of invalid lines)
+    """
+    added = 0
+    invalid = 0
+    now = time.time()
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip() or line.lstrip().startswith('#'):
+            continue
+        try:
+            spec = parse_batch_job(line)
+        except ValueError as e:
+            print(f"Skipping line {line_number}: {e}")
+            invalid += 1
+            continue
+        credentials = {field: spec.pop(field) for field in BATCH_SECRET_FIELDS if field in spec}
+        spec_json = json.dumps(spec, sort_keys=True)
+        job_key = hashlib.sha256(spec_json.encode('utf-8')).hexdigest()
+        if credentials and secrets is not None:
+            secrets[job_key] = credentials
+        with conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO jobs (job_key, spec, state, added, updated) VALUES (?, ?, 'pending', ?, ?)",
+                (job_key, spec_json, now, now)
+            )
+            if not cursor.rowcount:
+                cursor = conn.execute(
+                    "UPDATE jobs SET state = 'pending', attempts = 0, error = NULL, updated = ? "
+                    "WHERE job_key = ? AND state = 'failed'",
+                    (now, job_key)
+                )
+        added += cursor.rowcount
+    return added, invalid
+
+def set_job_state(conn, job_id, state, **fields):
+    """
+    Moves a job to a new state, optionally updating other columns (error, files, attempts).
+    """
+    columns = ['state', 'updated'] + list(fields)
+    values = [state, time.time()] + list(fields.values())
+    with conn:
+        conn.execute(f"UPDATE jobs SET {', '.join(f'{column} = ?' for column in columns)} WHERE id = ?",
+                     values + [job_id])
+
+def claim_next_job(conn, owner):
+    """
+    Takes the oldest runnable job off the queue and leases it to owner: pending jobs start
+    over at 'fetching', jobs interrupted after their download go straight back to
+    'post-processing'. Jobs other runs are working on stay theirs while those runs keep
+    their lease alive (see renew_job_leases); a job whose lease is older than
+    BATCH_LEASE_SECONDS belongs to a run that died and is taken over. The claim is a
+    conditional update on the job's state and lease, so two runs never take the same job.
+
+    Args:
+        conn: The queue connection from open_job_queue.
+        owner (str): ID of the claiming batch run.
+
+    Returns:
+        sqlite3.Row: The claimed job (with its previous state), or None if the queue is drained.
+    """
+    while True:
+        now = time.time()
+        job = conn.execute(
+            "SELECT * FROM jobs WHERE state = 'pending' OR (state IN ('fetching', 'downloading', 'post-processing') "
+            "AND (owner IS NULL OR heartbeat IS NULL OR heartbeat < ?)) ORDER BY id LIMIT 1",
+            (now - BATCH_LEASE_SECONDS,)
+        ).fetchone()
+        if job is None:
+            return None
+        next_state = 'post-processing' if job['state'] == 'post-processing' else 'fetching'
+        with conn:
+            claimed = conn.execute(
+                "UPDATE jobs SET state = ?, owner = ?, heartbeat = ?, attempts = attempts + 1, updated = ? "
+                "WHERE id = ? AND state = ? AND owner IS ? AND heartbeat IS ?",
+                (next_state, owner, now, now, job['id'], job['state'], job['owner'], job['heartbeat'])
+            ).rowcount
+        if claimed:
+            return job
+
+def renew_job_leases(output_dir, owner, stop):
+    """
+    Heartbeat thread of a batch run: renews the lease on the jobs owner holds every
+    BATCH_HEARTBEAT_INTERVAL seconds until stop is set.
+    """
+    with contextlib.closing(open_job_queue(output_dir)) as conn:
+        while not stop.wait(BATCH_HEARTBEAT_INTERVAL):
+            with contextlib.suppress(sqlite3.Error), conn:
+                conn.execute("UPDATE jobs SET heartbeat = ? WHERE owner = ?", (time.time(), owner))
+
+def run_batch_job(conn, job, default_output_dir, backend=None, credentials=None):
+    """
+    Runs one claimed job through fetching, downloading and post-processing, recording each
+    state in the queue. Partial downloads are resumed because yt-dlp continues the .part
+    file of the same output path; a job interrupted after its download only redoes the split.
+    credentials holds the job's username and password, if this run read any (see
+    enqueue_batch_jobs).
+
+    Returns:
+        tuple: (list of produced files, error message or None)
+    """
+    spec = json.loads(job['spec'])
+    url = spec['url']
+    media_type = spec['media_type']
+    output_dir = os.path.expanduser(spec.get('output_dir') or default_output_dir)
+    os.makedirs(output_dir, exist_ok=True)
+    cookie_save_path = os.path.join(output_dir, 'cookies.txt')
+    credentials = credentials or {}
+    username, password, cookie_file = credentials.get('username'), credentials.get('password'), spec.get('cookie_file')
+    if cookie_file:
+        cookie_file = os.path.expanduser(cookie_file)
+
+    files = json.loads(job['files'] or '[]')
+    if job['state'] != 'post-processing' or not files or not all(os.path.isfile(f) for f in files):
+        if job['state'] == 'post-processing':
+            set_job_state(conn, job['id'], 'fetching')
+        with trace_to(output_dir):
+            info, error = get_media_info(url, username, password, cookie_file, cache_dir=output_dir, backend=backend)
+        if error:
+            return [], error
+
+        set_job_state(conn, job['id'], 'downloading')
+        format_string = (spec.get('format') or BATCH_DEFAULT_FORMAT) if media_type == 'video' else None
+        if info.get('_type') == 'playlist':
+            entries = info.get('entries') or []
+            playlist_items = parse_selection(str(spec.get('playlist_items') or 'all'), len(entries))
+            if playlist_items == "":
+                return [], f"no valid playlist items in {spec.get('playlist_items')!r} ({len(entries)} items)"
+            if media_type == 'audio':
+                # Downloading, encoding and splitting overlap, so the pipeline does the split as well.
+                files, errors = run_audio_pipeline(url, entries, playlist_items, output_dir, spec.get('split'),
+                                                   username, password, cookie_file, cookie_save_path, backend=backend)
+                if errors or not files:
+                    return files, "; ".join(errors) or "no file was produced (see the pipeline output above)"
+                return files, None
+            files = download_playlist(url, entries, playlist_items, format_string, output_dir, media_type,
+                                      username, password, cookie_file, cookie_save_path, backend=backend)
+        else:
+            files = download_media(url, format_string, output_dir, media_type, None,
+                                   username, password, cookie_file, cookie_save_path, backend=backend, info=info)
+        if not files:
+            return [], "download failed (see yt-dlp output above)"
+        set_job_state(conn, job['id'], 'post-processing', files=json.dumps(files))
+
+    if spec.get('split'):
+        _, error = split_audio_files(files, output_dir, spec['split'])
+        if error:
+            return files, error
+    return files, None
+
+def run_batch(source, output_dir):
+    """
+    Headless entry point: queues the jobs read from source and works through every
+    runnable job in the queue, then writes a throughput and failure summary.
+
+    Several runs can work on one queue at the same time. Jobs of a run that died are taken
+    over once their lease expires (see claim_next_job); their partial downloads are resumed
+    rather than restarted. Credentials are only known to the run whose input contained
+    them, so jobs that need a login should be fed again rather than resumed without input.
+
+    Args:
+        source (str): Path of a JSONL file, '-' for stdin, or None to only resume the queue.
+        output_dir (str): Directory holding the queue, the summary and (by default) the downloads.
+
+    Returns:
+        int: 0 if every job of this run succeeded, 1 otherwise.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    run_id = uuid.uuid4().hex
+    secrets = {}
+    stop_heartbeat = threading.Event()
+    heartbeat = threading.Thread(target=renew_job_leases, args=(output_dir, run_id, stop_heartbeat), daemon=True)
+    with contextlib.closing(open_job_queue(output_dir)) as conn:
+        if source == '-':
+            added, invalid = enqueue_batch_jobs(conn, sys.stdin, secrets)
+        elif source:
+            with open(os.path.expanduser(source), 'r', encoding='utf-8') as f:
+                added, invalid = enqueue_batch_jobs(conn, f, secrets)
+        else:
+            added, invalid = 0, 0
+        print(f"Queued {added} jobs ({invalid} invalid lines skipped). Queue: {os.path.join(output_dir, BATCH_QUEUE_FILE)}")
+
+        started = time.monotonic()
+        done = []
+        failed = []
+        output_bytes = 0
+        heartbeat.start()
+        try:
+            while True:
+                job = claim_next_job(conn, run_id)
+                if job is None:
+                    break
+                url = json.loads(job['spec'])['url']
+                resumed = " (resuming an interrupted run)" if job['state'] != 'pending' else ""
+                print(f"\n[batch] Job {job['id']}: {url} (attempt {job['attempts'] + 1}){resumed}")
+                job_started = time.monotonic()
+                try:
+                    files, error = run_batch_job(conn, job, output_dir, credentials=secrets.get(job['job_key']))
+                except Exception as e:
+                    files, error = [], f"An unexpected error occurred: {e}"
+                error = error.strip() if error else None
+
+                if error is None:
+                    set_job_state(conn, job['id'], 'done', error=None, owner=None)
+                    size = sum(os.path.getsize(f) for f in files if os.path.isfile(f))
+                    output_bytes += size
+                    done.append({'id': job['id'], 'url': url, 'files': len(files), 'bytes': size,
+                                 'seconds': round(time.monotonic() - job_started, 1)})
+                elif job['attempts'] + 1 < BATCH_JOB_ATTEMPTS:
+                    print(f"[batch] Job {job['id']} failed, will retry: {error}")
+                    set_job_state(conn, job['id'], 'pending', error=error, owner=None)
+                else:
+                    print(f"[batch] Job {job['id']} failed: {error}")
+                    set_job_state(conn, job['id'], 'failed', error=error, owner=None)
+                    failed.append({'id': job['id'], 'url': url, 'attempts': job['attempts'] + 1, 'error': error})
+        finally:
+            stop_heartbeat.set()
+            heartbeat.join()
+
+        states = dict(conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+
+    elapsed = time.monotonic() - started
+    summary = {
+        'finished': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'elapsed_seconds': round(elapsed, 1),
+        'jobs_done': len(done),
+        'jobs_failed': len(failed),
+        'jobs_per_minute': round(len(done) / max(elapsed, 0.001) * 60, 2),
+        'output_bytes': output_bytes,
+        'output_bytes_per_second': round(output_bytes / max(elapsed, 0.001)),
+        'queue_states': states,
+        'done': done,
+        'failures': failed,
+    }
+    summary_path = os.path.join(output_dir, BATCH_SUMMARY_FILE)
+    try:
+        with open(summary_path, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+    except OSError as e:
+        print(f"Warning: Could not write the batch summary: {e}")
+
+    print(f"\nBatch finished: {len(done)} done, {len(failed)} failed in {elapsed:.0f}s "
+          f"({summary['jobs_per_minute']} jobs/min, {summary['output_bytes_per_second'] / 1024:.0f} KB/s on average).")
+    for failure in failed:
+        print(f"  Failed job {failure['id']}: {failure['url']}: {failure['error']}")
+    print(f"Summary written to: {summary_path}")
+    return 1 if failed else 0
+
+def check_silence_detection_parity():
+    """
+    Compares streaming detect_nonsilent_intervals with pydub's split_on_silence on synthetic
+    audio, and the loudness index's answers with it to within LOUDNESS_INDEX_BIN_MS.
+    Skipped (returns no failures) when numpy, pydub or ffmpeg are not installed.
+
+    Returns:
+        list: Failure messages.
+    """
+    import random
+    import tempfile
+    import wave
+
+    if importlib.util.find_spec('numpy') is None or not check_pydub() or not check_ffmpeg():
+        print("Skipping silence detection parity check (needs numpy, pydub and ffmpeg).")
+        return []
+    from pydub import AudioSegment
+    from pydub.silence import split_on_silence
+
+    failures = []
+    rng = random.Random(1234)
+    for frame_rate, channels, extra_frames in ((44100, 2, 17), (22050, 1, 0)):
+        samples = []
+        for _ in range(14):
+            loud = rng.random() < 0.5
+            amplitude = rng.choice((3000, 9000)) if loud else rng.choice((0, 60, 250))
+            for _ in range(int(rng.uniform(0.15, 1.4) * frame_rate)):
+                samples.extend([int(rng.uniform(-amplitude, amplitude))] * channels)
+        samples.extend([0] * (extra_frames * channels))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            wav_path = os.path.join(tmp_dir, 'parity.wav')
+            with wave.open(wav_path, 'wb') as wav:
+                wav.setnchannels(channels)
+                wav.setsampwidth(2)
+                wav.setframerate(frame_rate)
+                wav.writeframes(struct.pack(f'<{len(samples)}h', *samples))
+
+            audio = AudioSegment.from_wav(wav_path)
+            for min_silence_len, silence_thresh, keep_silence in ((500, -40, 200), (300, -50, 100), (700, -30, True)):
+                expected = split_on_silence(audio, min_silence_len=min_silence_len,
+                                            silence_thresh=silence_thresh, keep_silence=keep_silence)
+                settings = (f"{frame_rate} Hz, {channels} ch, min_silence_len={min_silence_len}, "
+                            f"silence_thresh={silence_thresh}, keep_silence={keep_silence}")
+                intervals, _ = detect_nonsilent_intervals(wav_path, min_silence_len, silence_thresh, keep_silence, False)
+                frame_width = audio.frame_width
+                actual = [
+                    audio.raw_data[start * frame_width:end * frame_width].ljust((end - start) * frame_width, b'\0')
+                    for start, end in intervals.tolist()
+                ]
+                if [chunk.raw_data for chunk in expected] != actual:
+                    failures.append(f"silence detection differs from pydub ({settings}): "
+                                    f"{len(expected)} pydub chunks, {len(actual)} detected")
+                indexed, _ = detect_nonsilent_intervals(wav_path, min_silence_len, silence_thresh, keep_silence, True, tmp_dir)
+                tolerance = LOUDNESS_INDEX_BIN_MS * frame_rate // 1000 + 1
+                if indexed.shape != intervals.shape or (abs(indexed - intervals) > tolerance).any():
+                    failures.append(f"silence detection from the loudness index is off by more than "
+                                    f"{LOUDNESS_INDEX_BIN_MS} ms ({settings}): {len(intervals)} chunks, {len(indexed)} from the index")
+    return failures
+
+def check_chunk_export_alignment():
+    """
+    Cuts pieces out of VBR MP3s, with and without a seek table, with export_audio_pieces and
+    checks that each piece starts on the requested sample of the fully decoded file.
+    Skipped (returns no failures) when numpy or ffmpeg are not installed.
+
+    Returns:
+        list: Failure messages.
+    """
+    import tempfile
+
+    if importlib.util.find_spec('numpy') is None or not check_ffmpeg():
+        print("Skipping chunk export alignment check (needs numpy and ffmpeg).")
+        return []
+    import numpy as np
+
+    def decode(path):
+        pcm = subprocess.run(['ffmpeg', '-v', 'error', '-i', path, '-ac', '1', '-f', 's16le', '-'],
+                             check=True, capture_output=True).stdout
+        return np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+
+    failures = []
+    frame_rate = 44100
+    window = frame_rate // 4
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        vbr_path = os.path.join(tmp_dir, 'vbr.mp3')
+        plain_path = os.path.join(tmp_dir, 'vbr_no_toc.mp3')
+        try:
+            subprocess.run(['ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f"anoisesrc=d=90:a=0.3:r={frame_rate}",
+                            '-af', "volume='0.1+0.9*gt(mod(t,3.7),1.5)':eval=frame", '-c:a', 'libmp3lame', '-q:a', '6',
+                            vbr_path], check=True, capture_output=True)
+            subprocess.run(['ffmpeg', '-v', 'error', '-i', vbr_path, '-c', 'copy', '-write_xing', '0', plain_path],
+                           check=True, capture_output=True)
+        except subprocess.CalledProcessError:
+            print("Skipping chunk export alignment check (ffmpeg cannot encode MP3).")
+            return []
+        for path in (vbr_path, plain_path):
+            source = decode(path)
+            for start in (int(7.31 * frame_rate), int(61.77 * frame_rate)):
+                chunk_path = os.path.join(tmp_dir, 'chunk.mp3')
+                export_audio_pieces(path, [[start, start + 2 * frame_rate]], frame_rate, chunk_path)
+                chunk = decode(chunk_path)[frame_rate // 2:frame_rate // 2 + window]
+                offsets = range(-2 * window, 2 * window + 1)
+                errors = [float(np.abs(source[start + frame_rate // 2 + offset:][:window] - chunk).mean()) for offset in offsets]
+                offset = offsets[errors.index(min(errors))]
+                if offset:
+                    failures.append(f"chunk cut from {os.path.basename(path)} at sample {start} is {offset} samples off")
+    return failures
+
+def check_segmented_stall_restart():
+    """
+    Downloads a file with aria2c from a local server that stops sending on the first attempt,
+    and checks that monitored_download restarts the stalled download and completes the file.
+    Skipped (returns no failures) when yt-dlp or aria2c is not installed.
+
+    Returns:
+        list: Failure messages.
+    """
+    global STALL_WINDOW
+    import http.server
+    import tempfile
+
+    if not check_yt_dlp() or not get_capabilities()['aria2c']['version']:
+        print("Skipping segmented stall restart check (needs yt-dlp and aria2c).")
+        return []
+
+    payload = bytes(range(256)) * 4096 * 8
+    stalling = threading.Event()
+    stalling.set()
+
+    class StallingHandler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            start, end = 0, len(payload) - 1
+            match = re.match(r'bytes=(\d+)-(\d*)', self.headers.get('Range', ''))
+            if match:
+                start, end = int(match.group(1)), int(match.group(2) or end)
+            self.send_response(206 if match else 200)
+            self.send_header('Content-Type', 'video/mp4')
+            self.send_header('Accept-Ranges', 'bytes')
+            self.send_header('Content-Length', str(end - start + 1))
+            if match:
+                self.send_header('Content-Range', f"bytes {start}-{end}/{len(payload)}")
+            self.end_headers()
+            if stalling.is_set():
+                self.wfile.write(payload[start:start + 1024])
+                self.wfile.flush()
+                while stalling.is_set():
+                    time.sleep(0.2)
+                return
+            self.wfile.write(payload[start:end + 1])
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), StallingHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/stall.mp4"
+    events = []
+
+    def on_progress(event):
+        events.append(event['event'])
+        if event['event'] == 'restart':
+            stalling.clear()
+
+    saved_window = STALL_WINDOW
+    STALL_WINDOW = 3.0
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            options = build_download_options(url, 'best', tmp_dir, 'video')
+            if 'http:aria2c' not in options:
+                return ["build_download_options did not download the direct file with aria2c"]
+            with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+                returncode = monitored_download(SubprocessBackend(), options, url, on_progress=on_progress, show=False)
+            produced = [os.path.join(tmp_dir, name) for name in os.listdir(tmp_dir) if name.endswith('.mp4')]
+            with open(produced[0], 'rb') if produced else contextlib.nullcontext(None) as f:
+                complete = f is not None and f.read() == payload
+    finally:
+        STALL_WINDOW = saved_window
+        stalling.clear()
+        server.shutdown()
+        server.server_close()
+    if returncode != 0 or 'stall' not in events or 'restart' not in events or not complete:
+        return [f"a stalled aria2c download was not restarted and completed (exit code {returncode}, events {events})"]
+    return []
+
+def run_self_test():
+    """
+    Runs quick offline checks of the helpers (used by CI via --test).
+    Returns 0 on success, 1 on failure.
+    """
+    import tempfile
+
+    failures = []
+
+    # Probe the tools into a throwaway cache, so the self-test never writes to the download directory.
+    with tempfile.TemporaryDirectory() as capability_dir:
+        get_capabilities(capability_dir, refresh=True)
+
+    if normalize_url("https://youtu.be/abc123?si=xyz") != normalize_url("https://www.youtube.com/watch?v=abc123#t=5"):
+        failures.append("normalize_url does not unify equivalent YouTube links")
+    if not is_single_video_url("https://youtu.be/abc123") or is_single_video_url("https://www.youtube.com/watch?v=abc123&list=PL1"):
+        failures.append("is_single_video_url did not tell single videos from playlists")
+    if not inprocess_version_supported(YT_DLP_INPROCESS_VERSIONS[1] + '.232201') or inprocess_version_supported('2023.07.06') \
+            or inprocess_version_supported('unknown'):
+        failures.append("inprocess_version_supported did not accept exactly the tested yt_dlp releases")
+    if parse_selection("1,3-4", 5) != "1,3,4" or parse_selection("all", 5) is not None:
+        failures.append("parse_selection returned an unexpected selection")
+
+    documents = [parse_info_line(json.dumps({'id': str(i), 'title': f"Item {i}", 'playlist_index': i, 'playlist_title': 'List',
+                                             'formats': []})) for i in (2, 1)] + [parse_info_line("[download] log line")]
+    playlist = media_info_from_documents([document for document in documents if document])
+    if playlist['title'] != 'List' or [entry['id'] for entry in playlist['entries']] != ['1', '2'] or 'formats' in playlist['entries'][0]:
+        failures.append("media_info_from_documents did not build an ordered playlist of lightweight entries")
+
+    stats = {'youtube.com': {'slow': {'attempts': 4, 'successes': 4, 'latency_total': 40.0},
+                             'fast': {'attempts': 4, 'successes': 4, 'latency_total': 8.0}}}
+    if order_extractors_by_stats(stats, 'youtube.com', ['new', 'slow', 'fast']) != ['fast', 'slow', 'new']:
+        failures.append("order_extractors_by_stats did not put the fastest extractor first")
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        key = metadata_cache_key("https://example.com/v/1", ['generic:impersonate'], auth_fingerprint())
+        store_cached_media_info(cache_dir, key, "https://example.com/v/1", 'generic:impersonate', {'id': '1'})
+        if load_cached_media_info(cache_dir, key)[0] != {'id': '1'}:
+            failures.append("metadata cache did not return the stored entry")
+        if invalidate_metadata_cache(cache_dir, "http://www.example.com/v/1/") != 1:
+            failures.append("metadata cache invalidation did not remove the entry")
+
+    if TRACE_KEEP_RUNS:
+        with tempfile.TemporaryDirectory() as trace_dir:
+            trace_path = os.path.join(trace_dir, 'trace.jsonl')
+            with open(trace_path, 'w', encoding='utf-8') as f:
+                f.writelines(json.dumps({'span': 'download', 'run': str(run)}) + '\n' for run in range(TRACE_KEEP_RUNS + 5))
+            open_trace_file(trace_path).close()
+            with open(trace_path, encoding='utf-8') as f:
+                if [json.loads(line)['run'] for line in f] != [str(run) for run in range(6, TRACE_KEEP_RUNS + 5)]:
+                    failures.append("open_trace_file did not keep only the last TRACE_KEEP_RUNS runs")
+
+    with tempfile.TemporaryDirectory() as queue_dir:
+        with contextlib.closing(open_job_queue(queue_dir)) as conn:
+            lines = ['https://example.com/v/1', '{"url": "https://example.com/v/1"}', 'not a url',
+                     '{"url": "https://example.com/v/2", "username": "u", "password": "secret"}']
+            secrets = {}
+            if enqueue_batch_jobs(conn, lines, secrets) != (2, 1):
+                failures.append("enqueue_batch_jobs did not deduplicate jobs or reject invalid lines")
+            if 'secret' in json.dumps([tuple(row) for row in conn.execute("SELECT * FROM jobs")]) or len(secrets) != 1:
+                failures.append("enqueue_batch_jobs stored credentials in the job queue")
+            first, second = claim_next_job(conn, 'run-a'), claim_next_job(conn, 'run-b')
+            if first is None or second is None or claim_next_job(conn, 'run-b') is not None:
+                failures.append("claim_next_job did not hand out each queued job exactly once")
+            else:
+                with conn:
+                    conn.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time() - BATCH_LEASE_SECONDS - 1, first['id']))
+                taken_over = claim_next_job(conn, 'run-b')
+                if taken_over is None or taken_over['id'] != first['id'] or claim_next_job(conn, 'run-a') is not None:
+                    failures.append("claim_next_job did not take over only the job with an expired lease")
+
+    with tempfile.TemporaryDirectory() as session_dir:
+        def fake_login(login_cookies):
+            def login(options):
+                names = ['visitor'] + (login_cookies if '--password' in options else [])
+                with open(options[options.index('--cookies') + 1], 'w', encoding='utf-8') as f:
+                    f.writelines(f"example.com\tFALSE\t/\tFALSE\t0\t{name}\tx\n" for name in names)
+                return []
+            return login
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            session = AuthSession('example.com', 'user', session_dir)
+            with session.lease('pw', fake_login(['sid'])) as (options, outcome):
+                locked = session.lock.locked()
+            if '--password' in options or outcome['login'] or locked or not session.valid():
+                failures.append("AuthSession did not log in ahead of the run and release the session for it")
+            failed = AuthSession('example.com', 'other', session_dir)
+            with failed.lease('pw', fake_login([])) as (options, outcome):
+                pass
+            if '--password' not in options or failed.valid() or os.path.exists(failed.path):
+                failures.append("AuthSession kept a login that only set anonymous cookies")
+
+    formats = [{'format_id': 'h264', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080, 'filesize': 90 << 20},
+               {'format_id': 'vp9', 'vcodec': 'vp9', 'acodec': 'none', 'height': 1080, 'filesize': 60 << 20},
+               {'format_id': 'small', 'vcodec': 'avc1', 'acodec': 'none', 'height': 480, 'tbr': 400},
+               {'format_id': 'aac', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 128, 'tbr': 128},
+               {'format_id': 'opus', 'vcodec': 'none', 'acodec': 'opus', 'abr': 120, 'filesize': 2 << 20}]
+    options = get_available_video_formats({'duration': 600, 'formats': formats})
+    if [option[1].split('/')[0] for option in options] != ['vp9+opus', 'small+opus']:
+        failures.append("get_available_video_formats did not prefer the efficient codecs")
+    ranked, over_limit = rank_video_formats({'duration': 600, 'formats': formats}, max_bytes=50 << 20)
+    if [c['height'] for c in ranked] != [480] or ranked[0]['bytes'] != 400 * 125 * 600 + (2 << 20) or len(over_limit) != 1:
+        failures.append("rank_video_formats did not apply the size limit or estimate sizes from the bitrate")
+
+    switched = next_player_client(['-o', 'x', '--extractor-args', 'youtube:player_client=android'])
+    if switched[-1] != f"youtube:player_client={STALL_PLAYER_CLIENTS[1]}" or next_player_client(['-o', 'x']) != ['-o', 'x']:
+        failures.append("next_player_client did not switch to the next YouTube player client")
+
+    segmented = ['-o', 'x', '--downloader', 'http:aria2c', '--downloader-args', 'aria2c:--split=4', '--concurrent-fragments', '4']
+    if without_segmented_downloader(segmented) != ['-o', 'x', '--concurrent-fragments', '4', '--no-continue']:
+        failures.append("without_segmented_downloader did not fall back to one connection")
+
+    failures.extend(check_silence_detection_parity())
+    failures.extend(check_chunk_export_alignment())
+    failures.extend(check_segmented_stall_restart())
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    print("Self-test passed." if not failures else f"Self-test failed ({len(failures)} problems).")
+    return 1 if failures else 0
+
+def benchmark_startup(runs=5, output_dir=None):
+    """
+    Measures time-to-first-prompt: starts the script in a child process and times how long it
+    takes until the URL prompt appears. The first run starts without a capability cache, the
+    others are warm starts. Results are printed and appended to STARTUP_BENCHMARK_LOG.
+
+    Args:
+        runs (int, optional): Number of launches. Defaults to 5.
+        output_dir (str, optional): Directory holding the caches and the log. Defaults to get_output_dir().
+
+    Returns:
+        dict: The recorded benchmark entry.
+    """
+    output_dir = output_dir or get_output_dir()
+    prompt = b"Give me the URL"
+    timings = []
+    for run in range(runs):
+        if run == 0:
+            with contextlib.suppress(OSError):
+                os.remove(os.path.join(output_dir, CAPABILITY_CACHE_FILE))
+        started = time.monotonic()
+        process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        output = b""
+        while prompt not in output:
+            data = os.read(process.stdout.fileno(), 4096)
+            if not data:
+                break
+            output += data
+        elapsed = time.monotonic() - started
+        with contextlib.suppress(OSError):
+            process.communicate(b"q\n", timeout=10)
+        if prompt not in output:
+            print("Error: The script exited before showing the first prompt:")
+            print(output.decode('utf-8', errors='replace'))
+            return None
+        timings.append(elapsed)
+        print(f"Run {run + 1}/{runs} ({'cold' if run == 0 else 'warm'}): {elapsed * 1000:.0f} ms to first prompt")
+
+    warm = sorted(timings[1:]) or timings
+    entry = {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'cold_ms': round(timings[0] * 1000),
+        'warm_median_ms': round(warm[len(warm) // 2] * 1000),
+        'warm_min_ms': round(warm[0] * 1000),
+        'runs': runs,
+    }
+    print(f"Time to first prompt: {entry['cold_ms']} ms cold, {entry['warm_median_ms']} ms warm (median).")
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        with open(os.path.join(output_dir, STARTUP_BENCHMARK_LOG), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+    except OSError as e:
+        print(f"Warning: Could not write the startup benchmark log: {e}")
+    return entry
+
 def main():
     """
     Main function to run the Pyanide media downloader script.
@@ -463,18 +4353,196 @@ def main():
         print("Please install it by running: pkg install ffmpeg")
         return
     
-    if not check_pydub():
-        print("\n--- Error ---")
-        print("pydub is not installed.")
-        print("pydub is required for audio splitting functionality.")
-        print("Please install it by running: pip install pydub")
-        return
-    
-    output_base_dir = os.path.expanduser('~/storage/downloads')
-    target_dir = os.path.join(output_base_dir, 'Pyanide')
+    target_dir = get_output_dir()
 
     try:
         os.makedirs(target_dir, exist_ok=True)
         print(f"\nOutput directory set to: {target_dir}")
     except OSError as e:
-        print(f"Error: Could not create directory
\ No newline at end of file
+        print(f"Error: Could not create directory {target_dir}: {e}")
+        print("Make sure Termux has storage access by running: termux-setup-storage")
+        return
+
+    cookie_save_path = os.path.join(target_dir, 'cookies.txt')
+
+    while True:
+        url = input("\nGive me the URL of the trash you want to steal ('e' to edit an existing audio file, or 'q' to quit, pussy.): ").strip()
+        if url.lower() == 'q':
+            print("Exiting Pyanide. Goodbye!")
+            break
+        if url.lower() == 'e':
+            audio_file = select_audio_file(target_dir)
+            if audio_file:
+                audio_split_menu(audio_file, target_dir)
+            continue
+        if not url:
+            print("Error: Please enter a URL.")
+            continue
+
+        username = None
+        password = None
+        cookie_file = None
+        print("\nLogin options (for sites like FetLife that require authentication):")
+        print("1. Use an existing cookie file")
+        print("2. Enter username and password")
+        print("3. Continue without login")
+        login_choice = input("Enter choice (1/2/3): ").strip()
+        if login_choice == '1':
+            cookie_file = os.path.expanduser(input(f"Enter path to cookie file (e.g., {cookie_save_path}): ").strip())
+            if not os.path.isfile(cookie_file):
+                print(f"Error: Cookie file not found: {cookie_file}. Continuing without login.")
+                cookie_file = None
+        elif login_choice == '2':
+            username = input("Enter username: ").strip()
+            password = input("Enter password: ").strip()
+
+        print("\nFetching media information...")
+        lookup = MediaInfoLookup(url, username, password, cookie_file, cache_dir=target_dir)
+        entry = lookup.next_entry()
+
+        playlist_items = None
+        entries = None
+        if entry is None:
+            info, error = lookup.wait()
+            if error:
+                print(f"\n{error}")
+                continue
+            if info.get('_type') == 'playlist':
+                print("\nThe playlist is empty.")
+                continue
+        else:
+            info = None
+            print("\nPlaylist items:")
+            while entry is not None:
+                print(f"{entry.get('playlist_index') or len(lookup.entries)}. {entry.get('title', 'Unknown title')}")
+                if len(lookup.entries) >= PLAYLIST_PREVIEW_ITEMS:
+                    break
+                entry = lookup.next_entry()
+            if lookup.done:
+                print(f"({len(lookup.entries)} items)")
+            else:
+                print(f"... the rest of the playlist is still loading ({lookup.count()} items so far). You can select now.")
+            while True:
+                selection = input("Which pieces of garbage do you want? (e.g., '1,3,7'), a range (e.g., '1-5'), 'all' of this bullshit, or 'q' to quit, you fuckin pussy!: ").strip()
+                if selection.lower() == 'q':
+                    break
+                highest = max(map(int, re.findall(r'\d+', selection)), default=0)
+                if not lookup.done and (selection.lower() == 'all' or highest > len(lookup.entries)):
+                    print("Waiting for the rest of the playlist...")
+                    lookup.wait()
+                    print(f"Playlist has {lookup.count()} items.")
+                    if lookup.error:
+                        print(f"Warning: Listing the playlist stopped early: {lookup.error.strip().splitlines()[-1]}")
+                playlist_items = parse_selection(selection, lookup.count())
+                if playlist_items != "":
+                    break
+                print("Error: No valid items selected. Please try again.")
+            if selection.lower() == 'q':
+                continue
+            entries = lookup.entry_list()
+
+        print("\nWhat do you want to download?")
+        print("1. Video")
+        print("2. Audio (MP3)")
+        print("3. Cancel")
+        media_choice = input("Enter choice (1/2/3): ").strip()
+
+        if media_choice == '1':
+            if entries is not None:
+                # Offer the qualities of the first selected item; only it is fully extracted here.
+                first_index = int(playlist_items.split(',')[0]) if playlist_items else 1
+                first_entry = entries[first_index - 1] if first_index <= len(entries) else None
+                entry_info, _ = get_entry_info(first_entry, username, password, cookie_file, cache_dir=target_dir)
+                options = get_available_video_formats(entry_info) if entry_info else []
+            else:
+                options = get_available_video_formats(info)
+            if not options:
+                options = [("Best available quality", "bestvideo+bestaudio/best")]
+            print("\nAvailable qualities:")
+            for i, (display_name, _) in enumerate(options, 1):
+                print(f"{i}. {display_name}")
+            while True:
+                try:
+                    quality_idx = int(input("Just pick a damn number for the resolution, any number, you simpleton: ").strip()) - 1
+                    if 0 <= quality_idx < len(options):
+                        break
+                    print(f"Error: Please select a number between 1 and {len(options)}.")
+                except ValueError:
+                    print("Error: Please enter a valid number.")
+            if entries is not None:
+                download_playlist(url, entries, playlist_items, options[quality_idx][1], target_dir, 'video',
+                                  username, password, cookie_file, cookie_save_path)
+            else:
+                download_media(url, options[quality_idx][1], target_dir, 'video', None,
+                               username, password, cookie_file, cookie_save_path, info=info)
+        elif media_choice == '2':
+            if entries is not None:
+                # Choose the split once, so each file is split while the next ones download.
+                split = None
+                if input("\nDo you want to split the downloaded audio files? (y/n): ").strip().lower() == 'y':
+                    split = prompt_split_policy("each file")
+                run_audio_pipeline(url, entries, playlist_items, target_dir, split,
+                                   username, password, cookie_file, cookie_save_path)
+                continue
+            downloaded_files = download_media(url, None, target_dir, 'audio', None,
+                                              username, password, cookie_file, cookie_save_path, info=info)
+            if downloaded_files and input("\nDo you want to split the downloaded audio? (y/n): ").strip().lower() == 'y':
+                audio_file = select_audio_file(target_dir, downloaded_files)
+                if audio_file:
+                    audio_split_menu(audio_file, target_dir)
+        else:
+            print("Download cancelled.")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pyanide - Media Downloader and Editor for Termux")
+    parser.add_argument('--test', action='store_true', help="run offline self-checks and exit")
+    parser.add_argument('--backend', choices=['auto', 'inprocess', 'subprocess'],
+                        help=f"how yt-dlp is run (default: {YT_DLP_BACKEND})")
+    parser.add_argument('--max-size', type=float, metavar='MB',
+                        help="only offer video qualities estimated at most MB megabytes (overrides MAX_DOWNLOAD_BYTES)")
+    parser.add_argument('--max-bitrate', type=float, metavar='KBPS',
+                        help="only offer video qualities of at most KBPS kbit/s (overrides MAX_BITRATE_KBPS)")
+    parser.add_argument('--batch', nargs='?', const='', metavar='FILE',
+                        help="download the jobs in FILE (JSONL, '-' for stdin) without prompting, "
+                             "and resume unfinished jobs from earlier batch runs")
+    parser.add_argument('--benchmark-startup', nargs='?', type=int, const=5, metavar='RUNS',
+                        help="measure the time until the first prompt over RUNS launches (default 5), then exit")
+    parser.add_argument('--trace-summary', action='store_true',
+                        help=f"print a table of how long each phase took at exit (phases are always traced to {TRACE_FILE})")
+    parser.add_argument('--extractor-stats', action='store_true',
+                        help="show per-site extractor success rates and time-to-first-success, then exit")
+    parser.add_argument('--invalidate-cache', nargs='?', const='', metavar='URL',
+                        help="drop cached media info for URL (or the whole cache if no URL is given) and exit")
+    args = parser.parse_args()
+
+    if args.backend:
+        YT_DLP_BACKEND = args.backend
+    if args.trace_summary:
+        TRACE_SUMMARY = True
+    if args.max_size:
+        MAX_DOWNLOAD_BYTES = int(args.max_size * 1024 * 1024)
+    if args.max_bitrate:
+        MAX_BITRATE_KBPS = args.max_bitrate
+    if args.test:
+        TRACE_FILE = None
+        sys.exit(run_self_test())
+    if args.benchmark_startup:
+        sys.exit(0 if benchmark_startup(args.benchmark_startup) else 1)
+    if args.extractor_stats:
+        print_extractor_stats(get_output_dir())
+        sys.exit(0)
+    if args.invalidate_cache is not None:
+        removed = invalidate_metadata_cache(get_output_dir(), args.invalidate_cache or None)
+        print(f"Removed {removed} cached media info entr{'y' if removed == 1 else 'ies'}.")
+        sys.exit(0)
+    try:
+        if args.batch is not None:
+            if not check_yt_dlp() or not check_ffmpeg():
+                print("Error: yt-dlp and ffmpeg are required. Install them with: pkg install yt-dlp ffmpeg")
+                sys.exit(1)
+            sys.exit(run_batch(args.batch or None, get_output_dir()))
+        main()
+    finally:
+        get_yt_dlp_backend().close()
+        if TRACE_SUMMARY:
+            print_trace_summary()
@@ -0,0 +1,626 @@
+"""
+Offline benchmark suite for PyPorn_1.5.0.py.
+
+Everything runs locally: synthetic MP4/MP3/HLS media is generated with ffmpeg and served
+by a local HTTP server with configurable latency, bandwidth and 403/429 injection, and a
+stub yt-dlp on PATH stands in for the real one on the subprocess backend. Measured:
+
+  * get_media_info latency (uncached and cached) for single media and flat playlists,
+  * download_media throughput for MP4, MP3 (audio) and HLS items, and download_playlist
+    throughput (with throttling if --fail-rate is set),
+  * wall time and peak RSS of every split_audio_* function across input lengths, and of a
+    silence split preview answered from an existing loudness index.
+
+Results are written as JSON (--output) so runs can be compared with --compare.
+
+Usage:
+    python benchmark.py --quick --output results.json
+    python benchmark.py --lengths 1,5,15 --latency-ms 50 --bandwidth-kbps 4096 --output new.json --compare results.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import contextlib
+import subprocess
+import statistics
+import importlib.util
+import urllib.parse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then reported as None.
+    resource = None
+
+SCRIPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'PyPorn_1.5.0.py')
+RESULTS_SCHEMA = 1
+
+# Stub for the yt-dlp binary. It understands the options PyPorn passes and talks to the
+# benchmark server: /watch/<id> returns the media info, /playlist/<name> the entry list.
+STUB_YT_DLP = r'''
+import sys, json, os, time, urllib.request, urllib.error
+
+args = sys.argv[1:]
+if '--version' in args:
+    print('2099.01.01-stub')
+    sys.exit(0)
+url = args[-1]
+
+def option(name, count=1):
+    if name not in args:
+        return None
+    index = args.index(name)
+    return args[index + 1] if count == 1 else args[index + 1:index + 1 + count]
+
+def fetch(target):
+    try:
+        with urllib.request.urlopen(target, timeout=30) as response:
+            return response.read()
+    except urllib.error.HTTPError as e:
+        sys.stderr.write(f"ERROR: Unable to download webpage: HTTP Error {e.code}: {e.reason}\n")
+        sys.exit(1)
+
+def fetch_json(target):
+    return json.loads(fetch(target))
+
+def download(info, template, limit):
+    ext = 'mp3' if '-x' in args else info['ext']
+    path = template.replace('%(title)s', info['title']).replace('%(ext)s', ext)
+    media_urls = [info['url']]
+    if info['url'].endswith('.m3u8'):
+        base = info['url'].rsplit('/', 1)[0]
+        playlist = fetch(info['url']).decode('utf-8')
+        media_urls = [line if line.startswith('http') else f"{base}/{line}"
+                      for line in playlist.splitlines() if line and not line.startswith('#')]
+    started = time.monotonic()
+    written = 0
+    with open(path + '.part', 'wb') as f:
+        for media_url in media_urls:
+            try:
+                with urllib.request.urlopen(media_url, timeout=30) as response:
+                    while True:
+                        block = response.read(65536)
+                        if not block:
+                            break
+                        f.write(block)
+                        written += len(block)
+                        if limit:
+                            ahead = written / limit - (time.monotonic() - started)
+                            if ahead > 0:
+                                time.sleep(ahead)
+            except urllib.error.HTTPError as e:
+                sys.stderr.write(f"ERROR: unable to download video data: HTTP Error {e.code}: {e.reason}\n")
+                sys.exit(1)
+    os.replace(path + '.part', path)
+    print(f"[download] 100% of {written} bytes in {time.monotonic() - started:.2f}s")
+    manifest = option('--print-to-file', 2)
+    if manifest:
+        with open(manifest[1], 'a', encoding='utf-8') as f:
+            f.write(f"Generic\t{info['id']}\t{path}\n")
+
+if '/playlist/' in url:
+    playlist = fetch_json(url)
+    entries = playlist['entries']
+    selected = option('--playlist-items')
+    indices = [int(i) for i in selected.split(',')] if selected else range(1, len(entries) + 1)
+else:
+    playlist, entries, indices = None, None, None
+
+if '--dump-json' in args:
+    if playlist is None:
+        print(json.dumps(fetch_json(url)), flush=True)
+    else:
+        for index in indices:
+            entry = entries[index - 1]
+            if '--flat-playlist' not in args:
+                entry = fetch_json(entry['url'])
+            print(json.dumps(dict(entry, playlist_index=index, n_entries=len(entries), playlist_id=playlist['id'],
+                                  playlist_title=playlist['title'], extractor_key='Generic')), flush=True)
+    sys.exit(0)
+
+limit = option('--limit-rate')
+limit = float(limit) if limit else None
+template = option('-o')
+if playlist is None:
+    download(fetch_json(url), template, limit)
+else:
+    for index in indices:
+        download(fetch_json(entries[index - 1]['url']), template, limit)
+'''
+
+
+class MediaServer(ThreadingHTTPServer):
+    """
+    Local HTTP server for the benchmark media, with per-request latency, a per-connection
+    bandwidth cap and random 403/429 answers on /watch and /media requests.
+    """
+    daemon_threads = True
+
+    def __init__(self, media_dir, catalogue, playlists, latency=0.0, bandwidth=None, fail_rate=0.0,
+                 fail_status=429, seed=1234):
+        super().__init__(('127.0.0.1', 0), MediaRequestHandler)
+        self.media_dir = media_dir
+        self.catalogue = catalogue
+        self.playlists = playlists
+        self.latency = latency
+        self.bandwidth = bandwidth
+        # Failures are only injected while a throttled scenario runs (see bench_downloads).
+        self.configured_fail_rate = fail_rate
+        self.fail_rate = 0.0
+        self.fail_status = fail_status
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failures_injected = 0
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            if self.fail_rate and self.random.random() < self.fail_rate:
+                self.failures_injected += 1
+                return True
+            return False
+
+
+class MediaRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency)
+        path = urllib.parse.urlsplit(self.path).path
+        kind, _, name = path.strip('/').partition('/')
+
+        if kind in ('watch', 'media') and server.should_fail():
+            reason = 'Too Many Requests' if server.fail_status == 429 else 'Forbidden'
+            return self.send_bytes(server.fail_status, reason.encode('utf-8'), 'text/plain', send_body, reason)
+        if kind == 'watch' and name in server.catalogue:
+            item = server.catalogue[name]
+            info = {
+                'id': name, 'title': item['title'], 'ext': item['ext'], 'extractor_key': 'Generic',
+                'url': f"{server.base_url}/media/{item['file']}", 'webpage_url': f"{server.base_url}/watch/{name}",
+                'formats': [{'format_id': 'stub', 'ext': item['ext'], 'vcodec': item.get('vcodec', 'none'),
+                             'height': item.get('height'), 'url': f"{server.base_url}/media/{item['file']}"}],
+            }
+            return self.send_bytes(200, json.dumps(info).encode('utf-8'), 'application/json', send_body)
+        if kind == 'playlist' and name in server.playlists:
+            entries = [{'id': item_id, 'title': server.catalogue[item_id]['title'], '_type': 'url',
+                        'url': f"{server.base_url}/watch/{item_id}", 'webpage_url': f"{server.base_url}/watch/{item_id}"}
+                       for item_id in server.playlists[name]]
+            body = json.dumps({'id': name, 'title': f"Playlist {name}", 'entries': entries}).encode('utf-8')
+            return self.send_bytes(200, body, 'application/json', send_body)
+        if kind == 'media':
+            file_path = os.path.join(server.media_dir, os.path.basename(name))
+            if os.path.isfile(file_path):
+                return self.send_file(file_path, send_body)
+        self.send_bytes(404, b'Not found', 'text/plain', send_body)
+
+    def send_bytes(self, status, body, content_type, send_body, reason=None):
+        self.send_response(status, reason)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_file(self, file_path, send_body):
+        size = os.path.getsize(file_path)
+        start, end = 0, size - 1
+        range_header = self.headers.get('Range', '')
+        if range_header.startswith('bytes='):
+            first, _, last = range_header[6:].split(',')[0].partition('-')
+            if first:
+                start, end = int(first), min(int(last), size - 1) if last else size - 1
+            elif last:
+                start = max(0, size - int(last))
+            if start > end:
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{size}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(206)
+            self.send_header('Content-Range', f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not send_body:
+            return
+
+        bandwidth = self.server.bandwidth
+        started = time.monotonic()
+        sent = 0
+        with open(file_path, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                block = f.read(min(65536, remaining))
+                if not block:
+                    break
+                try:
+                    self.wfile.write(block)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                remaining -= len(block)
+                sent += len(block)
+                if bandwidth:
+                    ahead = sent / bandwidth - (time.monotonic() - started)
+                    if ahead > 0:
+                        time.sleep(ahead)
+
+
+def run_ffmpeg(*args):
+    subprocess.run(['ffmpeg', '-hide_banner', '-loglevel', 'error', '-y'] + list(args), check=True)
+
+
+def generate_media(media_dir, lengths_minutes):
+    """
+    Creates the synthetic media: a short MP4, an MP3 and an HLS stream for downloads, and
+    one MP3 per requested length (15 s of tone, then 5 s of silence, repeated) for splitting.
+
+    Returns:
+        dict: Paths of the split inputs keyed by length in minutes.
+    """
+    tone = "aevalsrc='if(lt(mod(t\\,20)\\,15)\\,0.5*sin(2*PI*440*t)\\,0)':s=44100:d={seconds}"
+    run_ffmpeg('-f', 'lavfi', '-i', 'testsrc=size=640x360:rate=25:duration=20',
+               '-f', 'lavfi', '-i', tone.format(seconds=20),
+               '-c:v', 'libx264', '-preset', 'ultrafast', '-c:a', 'aac', '-shortest',
+               os.path.join(media_dir, 'clip.mp4'))
+    run_ffmpeg('-f', 'lavfi', '-i', tone.format(seconds=120), '-c:a', 'libmp3lame', '-b:a', '192k',
+               os.path.join(media_dir, 'song.mp3'))
+    run_ffmpeg('-i', os.path.join(media_dir, 'clip.mp4'), '-c', 'copy', '-f', 'hls', '-hls_time', '2',
+               '-hls_list_size', '0', '-hls_segment_filename', os.path.join(media_dir, 'stream%03d.ts'),
+               os.path.join(media_dir, 'stream.m3u8'))
+
+    split_inputs = {}
+    for minutes in lengths_minutes:
+        path = os.path.join(media_dir, f"split_{minutes:g}min.mp3")
+        run_ffmpeg('-f', 'lavfi', '-i', tone.format(seconds=int(minutes * 60)), '-c:a', 'libmp3lame', '-b:a', '128k', path)
+        split_inputs[minutes] = path
+    return split_inputs
+
+
+def load_pyporn():
+    """
+    Imports PyPorn_1.5.0.py as the module 'pyporn' (registered in sys.modules like a regular
+    import).
+    """
+    spec = importlib.util.spec_from_file_location('pyporn', SCRIPT_PATH)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules['pyporn'] = module
+    spec.loader.exec_module(module)
+    module.TRACE_FILE = None
+    module.DEBUG_MODE = False
+    return module
+
+
+@contextlib.contextmanager
+def quiet(enabled=True):
+    """
+    Sends the script's console output (and the stub's, which inherits stdout) to /dev/null.
+    """
+    if not enabled:
+        yield
+        return
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        'runs': len(samples),
+        'min_s': round(samples[0], 4),
+        'median_s': round(statistics.median(samples), 4),
+        'p90_s': round(samples[min(len(samples) - 1, int(0.9 * len(samples)))], 4),
+        'max_s': round(samples[-1], 4),
+    }
+
+
+def bench_media_info(pyporn, backend, server, work_dir, runs, verbose):
+    results = []
+    for case, url in (('single', f"{server.base_url}/watch/clip"), ('playlist', f"{server.base_url}/playlist/main")):
+        uncached = []
+        entries = 0
+        for _ in range(runs):
+            started = time.perf_counter()
+            with quiet(not verbose):
+                info, error = pyporn.get_media_info(url, backend=backend)
+            uncached.append(time.perf_counter() - started)
+            if error:
+                raise RuntimeError(f"get_media_info failed for {url}: {error}")
+            entries = len(info.get('entries') or [])
+        results.append({'benchmark': 'get_media_info', 'case': f"{case}_uncached",
+                        'metrics': dict(summarize(uncached), entries=entries)})
+
+        cache_dir = tempfile.mkdtemp(dir=work_dir)
+        with quiet(not verbose):
+            pyporn.get_media_info(url, cache_dir=cache_dir, backend=backend)
+        cached = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            with quiet(not verbose):
+                pyporn.get_media_info(url, cache_dir=cache_dir, backend=backend)
+            cached.append(time.perf_counter() - started)
+        results.append({'benchmark': 'get_media_info', 'case': f"{case}_cached", 'metrics': summarize(cached)})
+    return results
+
+
+def bench_downloads(pyporn, backend, server, work_dir, runs, verbose):
+    results = []
+    for case, item_id, media_type in (('mp4', 'clip', 'video'), ('mp3_audio', 'song', 'audio'), ('hls', 'stream', 'video')):
+        samples = []
+        size = 0
+        for _ in range(runs):
+            output_dir = tempfile.mkdtemp(dir=work_dir)
+            started = time.perf_counter()
+            with quiet(not verbose):
+                files = pyporn.download_media(f"{server.base_url}/watch/{item_id}", 'best', output_dir, media_type, backend=backend)
+            samples.append(time.perf_counter() - started)
+            if not files:
+                raise RuntimeError(f"download_media produced no file for {item_id}")
+            size = sum(os.path.getsize(path) for path in files)
+        metrics = summarize(samples)
+        metrics.update(bytes=size, throughput_bytes_per_s=round(size / metrics['median_s']))
+        results.append({'benchmark': 'download_media', 'case': case, 'metrics': metrics})
+
+    url = f"{server.base_url}/playlist/main"
+    with quiet(not verbose):
+        info, error = pyporn.get_media_info(url, backend=backend)
+    if error:
+        raise RuntimeError(f"get_media_info failed for {url}: {error}")
+    for case, fail_rate in (('playlist', 0.0), ('playlist_throttled', server.configured_fail_rate)):
+        if case == 'playlist_throttled' and not fail_rate:
+            continue
+        server.fail_rate = fail_rate
+        injected_before = server.failures_injected
+        output_dir = tempfile.mkdtemp(dir=work_dir)
+        started = time.perf_counter()
+        with quiet(not verbose):
+            files = pyporn.download_playlist(url, info['entries'], None, 'best', output_dir, 'video', backend=backend)
+        elapsed = time.perf_counter() - started
+        size = sum(os.path.getsize(path) for path in files)
+        results.append({'benchmark': 'download_playlist', 'case': case, 'metrics': {
+            'wall_s': round(elapsed, 4),
+            'items': len(info['entries']),
+            'items_downloaded': len(files),
+            'items_per_min': round(len(files) / elapsed * 60, 2),
+            'bytes': size,
+            'throughput_bytes_per_s': round(size / elapsed),
+            'failures_injected': server.failures_injected - injected_before,
+        }})
+    server.fail_rate = 0.0
+    return results
+
+
+SPLIT_CASES = {
+    'split_audio_by_chunk': lambda pyporn, audio, out: pyporn.split_audio_by_chunk(audio, out, 60000),
+    'split_audio_by_chunk_sample_accurate': lambda pyporn, audio, out: pyporn.split_audio_by_chunk(audio, out, 60000, True),
+    'split_audio_by_silence': lambda pyporn, audio, out: pyporn.split_audio_by_silence(audio, out, 500, -40, 10000),
+    'split_audio_by_silence_then_chunks': lambda pyporn, audio, out: pyporn.split_audio_by_silence_then_chunks(audio, out, 20000, 500, -40),
+    # Answered from the loudness index, which is built before the clock starts.
+    'preview_silence_split_indexed': lambda pyporn, audio, out: pyporn.preview_silence_split(
+        audio, {'mode': 'silence', 'min_silence_len': 500, 'silence_thresh': -40, 'min_chunk_minutes': 10000 / 60000}),
+}
+
+
+def peak_rss_kb(who):
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak  # bytes on macOS, KiB elsewhere
+
+
+def run_split_child(case, audio_file, output_dir):
+    """
+    Runs one split function in this (fresh) process and prints its wall time and peak RSS
+    as JSON, so that memory use is measured per function. The input's loudness index is
+    kept under output_dir and removed first, so silence splits include building it, except
+    for the *_indexed cases.
+    Exits with status 1 if the function produced no chunks, so error paths are never timed.
+    """
+    pyporn = load_pyporn()
+    pyporn.LOUDNESS_INDEX_DIR = os.path.join(output_dir, pyporn.LOUDNESS_INDEX_DIR)
+    index = pyporn.LoudnessIndex(audio_file)
+    if case.endswith('_indexed'):
+        with quiet():
+            pyporn.get_loudness_index(audio_file)
+    else:
+        for path in (index.path, index.meta_path):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+    started = time.perf_counter()
+    with quiet():
+        chunks = SPLIT_CASES[case](pyporn, audio_file, output_dir)
+    elapsed = time.perf_counter() - started
+    print(json.dumps({
+        'wall_s': round(elapsed, 4),
+        'chunks': len(chunks or []),
+        'peak_rss_kb': peak_rss_kb(resource.RUSAGE_SELF) if resource else None,
+        'peak_child_rss_kb': peak_rss_kb(resource.RUSAGE_CHILDREN) if resource else None,
+    }))
+    if not chunks:
+        print(f"{case} produced no chunks for {audio_file}", file=sys.stderr)
+        sys.exit(1)
+
+
+def bench_splits(split_inputs, work_dir, runs):
+    results = []
+    for minutes, audio_file in sorted(split_inputs.items()):
+        for case in SPLIT_CASES:
+            samples = []
+            for _ in range(runs):
+                output_dir = tempfile.mkdtemp(dir=work_dir)
+                completed = subprocess.run([sys.executable, os.path.abspath(__file__), '--child-split', case, audio_file, output_dir],
+                                           capture_output=True, text=True)
+                if completed.returncode != 0:
+                    raise RuntimeError(f"{case} ({minutes:g} min) failed: {completed.stderr.strip()[-500:]}")
+                samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+                shutil.rmtree(output_dir, ignore_errors=True)
+            walls = [sample['wall_s'] for sample in samples]
+            metrics = summarize(walls)
+            metrics.update(
+                input_minutes=minutes,
+                chunks=samples[-1]['chunks'],
+                peak_rss_kb=max((sample['peak_rss_kb'] or 0) for sample in samples) or None,
+                peak_child_rss_kb=max((sample['peak_child_rss_kb'] or 0) for sample in samples) or None,
+            )
+            results.append({'benchmark': case, 'case': f"{minutes:g}min", 'metrics': metrics})
+            print(f"  {case} ({minutes:g} min): {metrics['median_s']:.2f}s, "
+                  f"peak RSS {metrics['peak_rss_kb']} KiB (ffmpeg {metrics['peak_child_rss_kb']} KiB)", file=sys.stderr)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=os.path.dirname(SCRIPT_PATH),
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(baseline_path, current):
+    """
+    Prints the relative change of every numeric metric present in both runs.
+    """
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    previous = {(result['benchmark'], result['case']): result['metrics'] for result in baseline.get('results', [])}
+    print(f"\nCompared with {baseline_path} ({baseline.get('git_commit') or 'unknown commit'}, {baseline.get('time')}):")
+    for result in current['results']:
+        old = previous.get((result['benchmark'], result['case']))
+        if not old:
+            continue
+        for metric in ('median_s', 'wall_s', 'throughput_bytes_per_s', 'items_per_min', 'peak_rss_kb'):
+            if isinstance(old.get(metric), (int, float)) and isinstance(result['metrics'].get(metric), (int, float)) and old[metric]:
+                change = (result['metrics'][metric] - old[metric]) / old[metric] * 100
+                print(f"  {result['benchmark']} [{result['case']}] {metric}: {old[metric]} -> {result['metrics'][metric]} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for PyPorn_1.5.0.py")
+    parser.add_argument('--output', metavar='FILE', help="write the results as JSON to FILE (default: stdout)")
+    parser.add_argument('--compare', metavar='FILE', help="print changes against an earlier results file")
+    parser.add_argument('--lengths', default='1,5,15', help="input lengths in minutes for the split benchmarks (default: 1,5,15)")
+    parser.add_argument('--runs', type=int, default=3, help="repetitions per measurement (default: 3)")
+    parser.add_argument('--playlist-items', type=int, default=6, help="items in the benchmark playlist (default: 6)")
+    parser.add_argument('--latency-ms', type=float, default=20, help="server latency per request (default: 20)")
+    parser.add_argument('--bandwidth-kbps', type=float, default=0, help="per-connection bandwidth cap in KiB/s (default: unlimited)")
+    parser.add_argument('--fail-rate', type=float, default=0, help="fraction of requests answered with --fail-status; "
+                                                                   "adds a throttled playlist run (default: 0)")
+    parser.add_argument('--fail-status', type=int, choices=[403, 429], default=429)
+    parser.add_argument('--only', choices=['info', 'download', 'split'], action='append',
+                        help="run only these benchmark groups (repeatable)")
+    parser.add_argument('--quick', action='store_true', help="one 1-minute split input and a single run each")
+    parser.add_argument('--verbose', action='store_true', help="show the script's own output")
+    parser.add_argument('--child-split', nargs=3, metavar=('CASE', 'AUDIO', 'OUTPUT_DIR'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child_split:
+        run_split_child(*args.child_split)
+        return 0
+    if shutil.which('ffmpeg') is None:
+        print("Error: ffmpeg is required to generate the benchmark media.", file=sys.stderr)
+        return 1
+
+    lengths = [1.0] if args.quick else [float(length) for length in args.lengths.split(',')]
+    runs = 1 if args.quick else args.runs
+    groups = set(args.only or ['info', 'download', 'split'])
+
+    with tempfile.TemporaryDirectory(prefix='pyporn-bench-') as work_dir:
+        # Keep caches, archives and traces of the script out of the real download directory.
+        os.environ['HOME'] = work_dir
+        stub_dir = os.path.join(work_dir, 'bin')
+        media_dir = os.path.join(work_dir, 'media')
+        os.makedirs(stub_dir)
+        os.makedirs(media_dir)
+        stub_path = os.path.join(stub_dir, 'yt-dlp')
+        with open(stub_path, 'w', encoding='utf-8') as f:
+            f.write(f"#!{sys.executable}\n{STUB_YT_DLP}")
+        os.chmod(stub_path, 0o755)
+        os.environ['PATH'] = stub_dir + os.pathsep + os.environ.get('PATH', '')
+
+        print("Generating benchmark media...", file=sys.stderr)
+        split_inputs = generate_media(media_dir, lengths if 'split' in groups else [])
+        catalogue = {
+            'clip': {'title': 'Clip', 'file': 'clip.mp4', 'ext': 'mp4', 'vcodec': 'avc1', 'height': 360},
+            'song': {'title': 'Song', 'file': 'song.mp3', 'ext': 'mp3'},
+            'stream': {'title': 'Stream', 'file': 'stream.m3u8', 'ext': 'mp4', 'vcodec': 'avc1', 'height': 360},
+        }
+        for index in range(1, args.playlist_items + 1):
+            catalogue[f"item{index}"] = {'title': f"Item {index}", 'file': 'clip.mp4', 'ext': 'mp4', 'vcodec': 'avc1', 'height': 360}
+        playlists = {'main': [f"item{index}" for index in range(1, args.playlist_items + 1)]}
+
+        server = MediaServer(media_dir, catalogue, playlists, latency=args.latency_ms / 1000,
+                             bandwidth=args.bandwidth_kbps * 1024 or None, fail_rate=args.fail_rate,
+                             fail_status=args.fail_status)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        pyporn = load_pyporn()
+        backend = pyporn.get_yt_dlp_backend('subprocess')
+        results = []
+        try:
+            if 'info' in groups:
+                print("Measuring get_media_info...", file=sys.stderr)
+                results.extend(bench_media_info(pyporn, backend, server, work_dir, runs, args.verbose))
+            if 'download' in groups:
+                print("Measuring downloads...", file=sys.stderr)
+                results.extend(bench_downloads(pyporn, backend, server, work_dir, runs, args.verbose))
+            if 'split' in groups:
+                print("Measuring split functions...", file=sys.stderr)
+                results.extend(bench_splits(split_inputs, work_dir, runs))
+        finally:
+            server.shutdown()
+
+    ffmpeg_version = subprocess.run(['ffmpeg', '-version'], capture_output=True, text=True).stdout.split('\n')[0]
+    report = {
+        'schema': RESULTS_SCHEMA,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': git_commit(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'ffmpeg': ffmpeg_version,
+        'config': {
+            'lengths_minutes': lengths, 'runs': runs, 'playlist_items': args.playlist_items,
+            'latency_ms': args.latency_ms, 'bandwidth_kbps': args.bandwidth_kbps,
+            'fail_rate': args.fail_rate, 'fail_status': args.fail_status, 'backend': 'subprocess (stub yt-dlp)',
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(json.dumps(report, indent=2))
+    if args.compare:
+        compare_results(args.compare, report)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())